@@ -9,6 +9,12 @@ project_root = os.path.abspath('.')
 datas = [
     (os.path.join(project_root, 'icon'), 'icon'),
     (os.path.join(project_root, 'core', 'clip_worker.py'), 'core'),
+    (os.path.join(project_root, 'core', 'clip_protocol.py'), 'core'),
+    (os.path.join(project_root, 'core', 'onnx_backend.py'), 'core'),
+    (os.path.join(project_root, 'core', 'clip_preprocess.py'), 'core'),
+    (os.path.join(project_root, 'core', 'hasher.py'), 'core'),
+    (os.path.join(project_root, 'core', 'hamming.py'), 'core'),
+    (os.path.join(project_root, 'core', 'clip_daemon.py'), 'core'),
 ]
 
 # 2. 隠しインポート（GUIや基本機能のみ）
@@ -17,6 +23,9 @@ hiddenimports = [
     'cv2', 'numpy', 'PIL', 'PIL.Image', 'send2trash',
     'core', 'core.scanner', 'core.clip_engine', 'core.database', 
     'core.comparator', 'core.hasher', 'core.faiss_engine', 'core.image_converter',
+    'core.feature_pipeline', 'core.hamming', 'core.clip_protocol', 'core.clip_pool',
+    'core.onnx_backend', 'core.clip_preprocess', 'core.clip_daemon', 'core.db_writer',
+    'core.embedding_store',
     'gui', 'gui.main_window', 'gui.image_grid', 'gui.styles', 'gui.converter_dialog'
 ]
 
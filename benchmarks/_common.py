@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - Benchmark Utilities
+ベンチマークスクリプト共通のヘルパー
+
+各スクリプトはリポジトリ直下から実行する:
+    python benchmarks/<script>.py [画像フォルダ]
+フォルダを省略した場合は合成画像を一時ディレクトリに生成して使用する。
+"""
+
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+
+# リポジトリ直下を import パスに追加（core パッケージ用）
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+import numpy as np
+import cv2
+
+SAMPLE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'}
+
+
+def generate_sample_images(
+    count: int = 8,
+    size: Sequence[int] = (6000, 4000),
+    out_dir: Optional[Path] = None
+) -> List[Path]:
+    """写真に近い合成JPEG（図形 + ぼかし + センサーノイズ）を生成"""
+    if out_dir is None:
+        out_dir = Path(tempfile.mkdtemp(prefix="spectramatch_bench_"))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    width, height = size
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        img = np.full((height, width, 3), rng.integers(0, 255, 3), dtype=np.uint8)
+        for _ in range(60):
+            color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            radius = int(rng.integers(width // 100, width // 6))
+            cv2.circle(img, center, radius, color, -1)
+        img = cv2.GaussianBlur(img, (0, 0), 1 + i % 4)
+        noise = rng.normal(0, 2 + i % 5, img.shape)
+        img = np.clip(img + noise, 0, 255).astype(np.uint8)
+        path = out_dir / f"sample_{i:03d}.jpg"
+        cv2.imwrite(str(path), img, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        paths.append(path)
+    return paths
+
+
+def collect_sample_images(folder: Optional[str], limit: int = 50) -> List[Path]:
+    """フォルダから画像を集める（未指定なら合成画像を生成）"""
+    if not folder:
+        print("画像フォルダ未指定のため合成画像 (6000x4000) を生成します...")
+        return generate_sample_images(count=min(limit, 8))
+    paths = sorted(
+        p for p in Path(folder).rglob("*")
+        if p.is_file() and p.suffix.lower() in SAMPLE_EXTENSIONS
+    )
+    return paths[:limit]
+
+
+def measure(fn: Callable[[], object], repeat: int = 3) -> float:
+    """関数の実行時間（秒）の中央値を返す"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - CLIP Batch Size Benchmark
+CLIPEngine.extract_embeddings_batch のバッチサイズ別スループット計測
+
+デコード済み画像（FeaturePipelineと同じCLIP用縮小RGB）を事前に用意し、
+前処理 + 推論のみの images/秒 をバッチサイズごとに比較する。
+batch_size=1 が従来の1枚ずつの推論に相当する。
+
+使用方法:
+    python benchmarks/bench_clip_batch.py [画像フォルダ] [--sizes 1,4,8,16,32,64]
+"""
+
+import argparse
+import time
+
+from _common import collect_sample_images
+
+from core.clip_engine import CLIPEngine
+from core.feature_pipeline import FeaturePipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLIPバッチ推論のベンチマーク")
+    parser.add_argument("folder", nargs="?", help="画像フォルダ（省略時は合成画像）")
+    parser.add_argument("--limit", type=int, default=64, help="使用する画像の最大数")
+    parser.add_argument("--sizes", default="1,2,4,8,16,32,64", help="計測するバッチサイズ（カンマ区切り）")
+    args = parser.parse_args()
+    
+    paths = collect_sample_images(args.folder, args.limit)
+    pipeline = FeaturePipeline()
+    decoded = [pipeline.decode(p) for p in paths]
+    pairs = [(p, d.clip_rgb) for p, d in zip(paths, decoded) if d is not None]
+    if not pairs:
+        print("画像が見つかりませんでした")
+        return
+    paths = [p for p, _ in pairs]
+    images = [img for _, img in pairs]
+    
+    engine = CLIPEngine()
+    engine._use_subprocess = False  # 推論そのものを計測するため常に直接モード
+    start = time.perf_counter()
+    if not engine.load_model():
+        print("CLIPモデルを読み込めませんでした")
+        return
+    print(f"モデル読み込み: {time.perf_counter() - start:.1f}s (device={engine.device})")
+    
+    # ウォームアップ
+    engine.extract_embeddings_batch(paths[:2], batch_size=2, images=images[:2])
+    
+    baseline = None
+    print(f"{'batch':>6} {'images/s':>10} {'ms/image':>10} {'speedup':>8}")
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        start = time.perf_counter()
+        embeddings = engine.extract_embeddings_batch(paths, batch_size=size, images=images)
+        elapsed = time.perf_counter() - start
+        ok = sum(e is not None for e in embeddings)
+        throughput = ok / elapsed if elapsed > 0 else 0.0
+        if baseline is None:
+            baseline = throughput
+        print(f"{size:>6} {throughput:>10.1f} {1000 * elapsed / max(ok, 1):>10.1f} "
+              f"{throughput / max(baseline, 1e-9):>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
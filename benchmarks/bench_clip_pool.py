@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - CLIP Worker Pool Benchmark
+ワーカー数 × ワーカーあたりスレッド数の組み合わせごとのスループット計測
+
+CLIPWorkerPool.calibrate と同じ候補・同じ手順で計測し、結果を表で表示する。
+--save を付けると最速の構成をアプリの設定（clip_pool_size / clip_worker_threads）に保存する。
+
+使用方法:
+    python benchmarks/bench_clip_pool.py [画像フォルダ] [--limit N] [--save]
+"""
+
+import argparse
+
+from _common import collect_sample_images
+
+from core.clip_pool import CALIBRATION_BATCH, CLIPWorkerPool, default_candidates
+from core.config import ConfigManager
+
+MODEL_NAME = "openai/clip-vit-base-patch32"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLIPワーカープールのベンチマーク")
+    parser.add_argument("folder", nargs="?", help="画像フォルダ（省略時は合成画像）")
+    parser.add_argument("--limit", type=int, default=64, help="使用する画像の最大数")
+    parser.add_argument("--batch", type=int, default=CALIBRATION_BATCH, help="1リクエストの枚数")
+    parser.add_argument("--max-pool", type=int, default=None, help="ワーカー数の上限")
+    parser.add_argument("--save", action="store_true", help="最速の構成を設定に保存する")
+    args = parser.parse_args()
+    
+    paths = collect_sample_images(args.folder, args.limit)
+    if not paths:
+        print("画像が見つかりませんでした")
+        return
+    
+    candidates = default_candidates(max_pool_size=args.max_pool) if args.max_pool else default_candidates()
+    print(f"{len(paths)}枚, バッチ{args.batch}, 候補{len(candidates)}件")
+    print(f"{'workers':>8} {'threads':>8} {'images/s':>10}")
+    
+    best = None
+    for size, threads in candidates:
+        rate = CLIPWorkerPool.measure(MODEL_NAME, size, threads, paths, batch_size=args.batch)
+        print(f"{size:>8} {threads:>8} {rate:>10.1f}")
+        if best is None or rate > best[2]:
+            best = (size, threads, rate)
+    
+    print(f"最速: {best[0]}プロセス × {best[1]}スレッド ({best[2]:.1f}枚/秒)")
+    if args.save:
+        ConfigManager().set_clip_pool(best[0], best[1])
+        print("設定に保存しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - Embedding Storage Benchmark
+DBに保存した埋め込みの読み込み（全ライブラリ分）のベンチマーク
+
+従来の pickle 形式（行ごとに pickle.loads → np.stack）と、
+DB_VERSION 4 の生バイト列（get_embedding_matrix で事前確保した行列に直接書き込む）を、
+ランダムな単位ベクトルを入れた一時DBで比較する。DBファイルのサイズも表示する。
+512次元の float32（2KB）は pickle（約2.2KB）と同じく1行で4KBページの半分を超えるため、
+ファイルサイズの差はページ単位では現れず、float16（1KB）で初めて小さくなる。
+
+使用方法:
+    python benchmarks/bench_embedding_storage.py [--count N] [--dim D]
+"""
+
+import argparse
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from _common import measure
+
+from core.database import ImageDatabase
+
+
+def build_database(path: Path, embeddings: np.ndarray, dtype: str) -> ImageDatabase:
+    """埋め込みを登録した一時DBを作る（dtype="pickle" は旧形式で直接書き込む）"""
+    db = ImageDatabase(path, embedding_dtype="float32" if dtype == "pickle" else dtype, convert_legacy=False)
+    db.batch_upsert([
+        {'path': f"/bench/{i:07d}.jpg", 'file_size': 1, 'embedding': vector}
+        for i, vector in enumerate(embeddings)
+    ])
+    if dtype == "pickle":
+        db.conn.executemany(
+            "UPDATE images SET embedding = ?, embedding_dtype = NULL, embedding_dim = NULL WHERE name = ?",
+            [(pickle.dumps(vector), f"{i:07d}.jpg") for i, vector in enumerate(embeddings)]
+        )
+        db.conn.commit()
+    db.conn.execute("VACUUM")
+    db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return db
+
+
+def load_pickle(db: ImageDatabase) -> np.ndarray:
+    """従来実装: 行ごとに pickle.loads して np.stack する"""
+    rows = db.conn.execute("SELECT embedding FROM images WHERE embedding IS NOT NULL").fetchall()
+    return np.stack([pickle.loads(row[0]) for row in rows], axis=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="埋め込みの保存形式（pickle / 生バイト列）のベンチマーク")
+    parser.add_argument("--count", type=int, default=50000, help="埋め込みの数")
+    parser.add_argument("--dim", type=int, default=512, help="埋め込みの次元数")
+    parser.add_argument("--repeat", type=int, default=3, help="計測の繰り返し回数")
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(args.count, args.dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="spectramatch_storage_"))
+    try:
+        print(f"{args.count}件 × {args.dim}次元")
+        for dtype in ("pickle", "float32", "float16"):
+            path = work_dir / f"{dtype}.db"
+            db = build_database(path, embeddings, dtype)
+            if dtype == "pickle":
+                elapsed = measure(lambda: load_pickle(db), args.repeat)
+                matrix = load_pickle(db)
+            else:
+                elapsed = measure(lambda: db.get_embedding_matrix(), args.repeat)
+                matrix = db.get_embedding_matrix()[2]
+            error = float(np.abs(matrix - embeddings).max())
+            size_mb = path.stat().st_size / (1 << 20)
+            print(f"  {dtype:8s} 読み込み {elapsed * 1000:8.1f} ms  DB {size_mb:7.1f} MB  最大誤差 {error:.2e}")
+            db.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
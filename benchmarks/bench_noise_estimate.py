@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - Noise Estimation Microbenchmark
+ImageHasher._estimate_noise のブロック分散計算（方法3）のベンチマーク
+
+従来のPythonループ実装とNumPyのreshapeビューによる一括計算を、
+鮮明度分析と同じ入力（長辺ANALYSIS_SIZEのグレースケール）で比較する。
+
+使用方法:
+    python benchmarks/bench_noise_estimate.py [画像フォルダ] [--limit N]
+"""
+
+import argparse
+
+import numpy as np
+
+from _common import collect_sample_images, measure
+
+from core.hasher import ImageHasher, to_gray
+
+
+def legacy_block_noise(gray_img: np.ndarray, block_size: int = 16) -> float:
+    """従来実装: ブロックごとに np.var を呼び、リストをソートする"""
+    h, w = gray_img.shape
+    min_vars = []
+    for y in range(0, h - block_size, block_size):
+        for x in range(0, w - block_size, block_size):
+            block = gray_img[y:y+block_size, x:x+block_size]
+            min_vars.append(np.var(block))
+    if not min_vars:
+        return 0.0
+    min_vars.sort()
+    num_blocks = max(1, len(min_vars) // 10)
+    return float(np.sqrt(np.mean(min_vars[:num_blocks])))
+
+
+def vectorized_block_noise(gray_img: np.ndarray, block_size: int = 16) -> float:
+    """新実装: 全ブロックの分散を一括計算し、np.partitionで下位10%を抽出"""
+    block_vars = ImageHasher._block_variances(gray_img, block_size)
+    if block_vars.size == 0:
+        return 0.0
+    num_blocks = max(1, block_vars.size // 10)
+    lowest = np.partition(block_vars, num_blocks - 1)[:num_blocks]
+    return float(np.sqrt(np.mean(lowest)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ノイズ推定（ブロック分散）のベンチマーク")
+    parser.add_argument("folder", nargs="?", help="画像フォルダ（省略時は合成画像）")
+    parser.add_argument("--limit", type=int, default=50, help="使用する画像の最大数")
+    parser.add_argument("--repeat", type=int, default=20, help="計測の繰り返し回数")
+    args = parser.parse_args()
+    
+    hasher = ImageHasher()
+    grays = []
+    for path in collect_sample_images(args.folder, args.limit):
+        img, _, _ = hasher.load_image(path, min_long_side=hasher.ANALYSIS_SIZE)
+        if img is not None:
+            grays.append(hasher.prepare_analysis_gray(to_gray(img)))
+    if not grays:
+        print("画像が見つかりませんでした")
+        return
+    
+    legacy_total = 0.0
+    vector_total = 0.0
+    max_diff = 0.0
+    for gray in grays:
+        legacy_total += measure(lambda: legacy_block_noise(gray), args.repeat)
+        vector_total += measure(lambda: vectorized_block_noise(gray), args.repeat)
+        max_diff = max(max_diff, abs(legacy_block_noise(gray) - vectorized_block_noise(gray)))
+    
+    full_total = sum(measure(lambda: hasher._estimate_noise(gray), args.repeat) for gray in grays)
+    
+    n = len(grays)
+    print(f"画像数: {n} (分析サイズ {grays[0].shape[1]}x{grays[0].shape[0]} など)")
+    print(f"ブロック分散 従来ループ : {legacy_total / n * 1000:8.3f} ms/枚")
+    print(f"ブロック分散 NumPy一括  : {vector_total / n * 1000:8.3f} ms/枚 "
+          f"({legacy_total / max(vector_total, 1e-12):.1f}x)")
+    print(f"_estimate_noise 全体     : {full_total / n * 1000:8.3f} ms/枚")
+    print(f"結果の最大差: {max_diff:.3e}")
+
+
+if __name__ == "__main__":
+    main()
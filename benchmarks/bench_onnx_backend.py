@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - ONNX Runtime Backend Benchmark
+PyTorch と ONNX Runtime の CLIP 推論を比較するベンチマーク
+
+同じ画像（FeaturePipelineと同じCLIP用縮小RGB）を両バックエンドの直接モードで処理し、
+モデル読み込み時間・スループット（枚/秒）と、埋め込みの数値的な一致度
+（要素ごとの最大絶対誤差・最小コサイン類似度）を表示する。
+
+使用方法:
+    python benchmarks/bench_onnx_backend.py [画像フォルダ] [--limit N] [--batch N]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from _common import collect_sample_images
+
+from core.clip_engine import CLIPEngine
+from core.feature_pipeline import FeaturePipeline
+from core.onnx_backend import EMBEDDING_TOLERANCE, MIN_COSINE_SIMILARITY, is_onnx_available
+
+
+def run_backend(backend: str, paths, images, batch_size: int):
+    """指定バックエンドで全画像を処理し、(読み込み秒, 枚/秒, 埋め込み) を返す"""
+    engine = CLIPEngine(backend=backend)
+    engine._use_subprocess = False  # 推論そのものを計測するため常に直接モード
+    start = time.perf_counter()
+    if not engine.load_model():
+        return None
+    load_seconds = time.perf_counter() - start
+    if backend == "onnx" and engine._onnx is None:
+        print("ONNXバックエンドを読み込めず、PyTorchにフォールバックしました")
+        return None
+    
+    # ウォームアップ
+    engine.extract_embeddings_batch(paths[:2], batch_size=2, images=images[:2])
+    
+    start = time.perf_counter()
+    embeddings = engine.extract_embeddings_batch(paths, batch_size=batch_size, images=images)
+    elapsed = time.perf_counter() - start
+    ok = sum(e is not None for e in embeddings)
+    return load_seconds, (ok / elapsed if elapsed > 0 else 0.0), embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTorch / ONNX Runtime バックエンドの比較")
+    parser.add_argument("folder", nargs="?", help="画像フォルダ（省略時は合成画像）")
+    parser.add_argument("--limit", type=int, default=64, help="使用する画像の最大数")
+    parser.add_argument("--batch", type=int, default=16, help="バッチサイズ")
+    args = parser.parse_args()
+    
+    if not is_onnx_available():
+        print("onnxruntime がインストールされていません (pip install onnxruntime)")
+        return
+    
+    paths = collect_sample_images(args.folder, args.limit)
+    pipeline = FeaturePipeline()
+    decoded = [pipeline.decode(p) for p in paths]
+    pairs = [(p, d.clip_rgb) for p, d in zip(paths, decoded) if d is not None]
+    if not pairs:
+        print("画像が見つかりませんでした")
+        return
+    paths = [p for p, _ in pairs]
+    images = [img for _, img in pairs]
+    
+    results = {}
+    print(f"{len(paths)}枚, バッチ{args.batch}")
+    print(f"{'backend':>8} {'load':>8} {'images/s':>10}")
+    for backend in ("torch", "onnx"):
+        result = run_backend(backend, paths, images, args.batch)
+        if result is None:
+            print(f"{backend:>8} 読み込み失敗")
+            continue
+        load_seconds, throughput, embeddings = result
+        results[backend] = embeddings
+        print(f"{backend:>8} {load_seconds:>7.1f}s {throughput:>10.1f}")
+    
+    if len(results) < 2:
+        return
+    
+    pairs = [
+        (t, o) for t, o in zip(results["torch"], results["onnx"])
+        if t is not None and o is not None
+    ]
+    if not pairs:
+        return
+    torch_emb = np.stack([t for t, _ in pairs])
+    onnx_emb = np.stack([o for _, o in pairs])
+    max_abs = float(np.abs(torch_emb - onnx_emb).max())
+    min_cos = float(np.sum(torch_emb * onnx_emb, axis=1).min())
+    
+    ok = max_abs <= EMBEDDING_TOLERANCE and min_cos >= MIN_COSINE_SIMILARITY
+    print(f"最大絶対誤差: {max_abs:.2e} (許容 {EMBEDDING_TOLERANCE:.0e})")
+    print(f"最小コサイン類似度: {min_cos:.7f} (許容 {MIN_COSINE_SIMILARITY})")
+    print("判定: " + ("許容範囲内" if ok else "許容範囲外"))
+
+
+if __name__ == "__main__":
+    main()
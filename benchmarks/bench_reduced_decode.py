@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - Reduced Decode Benchmark
+JPEG縮小デコード（IMREAD_REDUCED_*）とフル解像度デコードの比較
+
+計測項目:
+- compute_sharpness / compute_phash の処理時間と速度向上率
+- 鮮明度スコアの相対誤差とpHashのハミング距離（フルデコードとのずれ）
+
+使用方法:
+    python benchmarks/bench_reduced_decode.py [画像フォルダ] [--limit N]
+"""
+
+import argparse
+
+from _common import collect_sample_images, measure
+
+from core.hasher import ImageHasher
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JPEG縮小デコードのベンチマーク")
+    parser.add_argument("folder", nargs="?", help="画像フォルダ（省略時は合成画像）")
+    parser.add_argument("--limit", type=int, default=50, help="使用する画像の最大数")
+    parser.add_argument("--repeat", type=int, default=3, help="計測の繰り返し回数")
+    args = parser.parse_args()
+    
+    paths = collect_sample_images(args.folder, args.limit)
+    if not paths:
+        print("画像が見つかりませんでした")
+        return
+    
+    full = ImageHasher(reduced_decode=False)
+    reduced = ImageHasher(reduced_decode=True)
+    
+    full_time = 0.0
+    reduced_time = 0.0
+    sharp_errors = []
+    phash_distances = []
+    
+    print(f"{'file':<32} {'full[ms]':>9} {'reduced[ms]':>12} {'speedup':>8} {'sharp diff':>11} {'pHash dist':>10}")
+    for path in paths:
+        t_full = measure(lambda: (full.compute_sharpness(path), full.compute_phash(path)), args.repeat)
+        t_reduced = measure(lambda: (reduced.compute_sharpness(path), reduced.compute_phash(path)), args.repeat)
+        full_time += t_full
+        reduced_time += t_reduced
+        
+        sharp_full, _, _ = full.compute_sharpness(path)
+        sharp_reduced, _, _ = reduced.compute_sharpness(path)
+        sharp_error = abs(sharp_reduced - sharp_full) / sharp_full if sharp_full > 0 else 0.0
+        sharp_errors.append(sharp_error)
+        
+        phash_full = full.compute_phash(path)
+        phash_reduced = reduced.compute_phash(path)
+        distance = None
+        if phash_full is not None and phash_reduced is not None:
+            distance = full.compute_phash_distance(phash_full, phash_reduced)
+            phash_distances.append(distance)
+        
+        print(
+            f"{path.name[:32]:<32} {t_full * 1000:>9.1f} {t_reduced * 1000:>12.1f} "
+            f"{t_full / max(t_reduced, 1e-9):>7.2f}x {sharp_error * 100:>10.2f}% "
+            f"{'-' if distance is None else distance:>10}"
+        )
+    
+    print()
+    print(f"画像数: {len(paths)}")
+    print(f"合計: full={full_time:.2f}s reduced={reduced_time:.2f}s "
+          f"speedup={full_time / max(reduced_time, 1e-9):.2f}x")
+    if sharp_errors:
+        print(f"鮮明度スコアの相対誤差: 平均 {100 * sum(sharp_errors) / len(sharp_errors):.2f}% "
+              f"/ 最大 {100 * max(sharp_errors):.2f}%")
+    if phash_distances:
+        print(f"pHashハミング距離: 平均 {sum(phash_distances) / len(phash_distances):.2f} "
+              f"/ 最大 {max(phash_distances)} (64ビット中)")
+
+
+if __name__ == "__main__":
+    main()
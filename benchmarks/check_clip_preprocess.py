@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - CLIP Preprocess Parity Check
+OpenCV版の前処理（CLIPPreprocessor）と HuggingFace の CLIPProcessor の比較
+
+同じ画像を両方で前処理し、正規化後テンソルの誤差と処理時間を表示する。
+比較は2通り:
+    メモリ上: 同じフル解像度のRGB配列を両方に渡す（リサイズ・正規化の差だけを見る）
+    ファイル: 実際のスキャンと同じ CLIPPreprocessor.load（縮小デコード + EXIF回転）と、
+              EXIF回転を適用した PIL のフル解像度デコードを比べる
+どちらかの平均絶対誤差が PIXEL_MEAN_TOLERANCE を超えると AssertionError で終了コード1になる。
+--embed を付けると両方の入力でCLIPの埋め込みを計算し、コサイン類似度が
+MIN_COSINE_SIMILARITY 未満の場合も失敗にする。
+transformers が無い環境では CLIPProcessor と同じ手順の PIL 実装を基準にする。
+画像フォルダを省略した場合は、合成画像にEXIFの回転（Orientation=6）付きのコピーを加える。
+
+使用方法:
+    python benchmarks/check_clip_preprocess.py [画像フォルダ] [--limit N] [--embed]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from _common import collect_sample_images
+
+from core.clip_preprocess import (
+    CLIP_IMAGE_SIZE, CLIP_MEAN, CLIP_STD, MIN_COSINE_SIMILARITY, PIXEL_MEAN_TOLERANCE,
+    CLIPPreprocessor
+)
+
+MODEL_NAME = "openai/clip-vit-base-patch32"
+
+# EXIFの Orientation タグ（6 = 時計回りに90度回転して表示）
+EXIF_ORIENTATION = 0x0112
+
+
+def reference_preprocess(images) -> np.ndarray:
+    """CLIPProcessor と同じ手順の PIL 実装（バイキュービック縮小 → 中央切り出し → 正規化）"""
+    from PIL import Image
+    
+    size = CLIP_IMAGE_SIZE
+    batch = np.empty((len(images), 3, size, size), dtype=np.float32)
+    for i, image in enumerate(images):
+        w, h = image.size
+        if w <= h:
+            new_w, new_h = size, int(size * h / w)
+        else:
+            new_w, new_h = int(size * w / h), size
+        image = image.resize((new_w, new_h), resample=Image.BICUBIC)
+        top = (new_h - size) // 2
+        left = (new_w - size) // 2
+        pixels = np.asarray(image, dtype=np.float32)[top:top + size, left:left + size]
+        batch[i] = ((pixels / 255.0 - CLIP_MEAN) / CLIP_STD).transpose(2, 0, 1)
+    return batch
+
+
+def load_processor():
+    """CLIPProcessor を読み込む（無ければ PIL 実装で代用）"""
+    try:
+        from transformers import CLIPProcessor
+        processor = CLIPProcessor.from_pretrained(MODEL_NAME)
+        return "CLIPProcessor", lambda images: processor(images=images, return_tensors="np")["pixel_values"]
+    except Exception as e:
+        print(f"CLIPProcessor を使えないため PIL 実装を基準にします ({e})")
+        return "PIL reference", reference_preprocess
+
+
+def add_rotated_copies(paths: List[Path]) -> List[Path]:
+    """EXIFの回転付きでコピーした画像を加える（回転の扱いが一致するかを確認するため）"""
+    from PIL import Image
+    
+    rotated = []
+    for path in paths[:2]:
+        target = path.with_name(f"{path.stem}_exif6.jpg")
+        with Image.open(path) as image:
+            exif = image.getexif()
+            exif[EXIF_ORIENTATION] = 6
+            image.convert("RGB").save(target, quality=92, exif=exif.tobytes())
+        rotated.append(target)
+    return list(paths) + rotated
+
+
+def load_oriented(path: Path):
+    """PIL でフル解像度デコードし、EXIFの回転を適用する"""
+    from PIL import Image, ImageOps
+    
+    with Image.open(path) as image:
+        return ImageOps.exif_transpose(image).convert("RGB")
+
+
+def check_tensor(label: str, expected: np.ndarray, actual: np.ndarray):
+    """正規化後テンソルの平均絶対誤差が許容範囲内であることを確認（範囲外は AssertionError）"""
+    if expected.shape != actual.shape:
+        raise AssertionError(f"{label}: テンソルの形が一致しません {expected.shape} != {actual.shape}")
+    diff = np.abs(actual - expected)
+    per_image = diff.reshape(len(diff), -1).mean(axis=1)
+    print(f"{label}: 平均絶対誤差 {diff.mean():.4f} (許容 {PIXEL_MEAN_TOLERANCE}), "
+          f"画像ごとの最大 {per_image.max():.4f}")
+    if diff.mean() > PIXEL_MEAN_TOLERANCE:
+        raise AssertionError(
+            f"{label}: 平均絶対誤差 {diff.mean():.4f} が許容値 {PIXEL_MEAN_TOLERANCE} を超えています"
+        )
+
+
+def check_embeddings(label: str, expected: np.ndarray, actual: np.ndarray):
+    """埋め込みのコサイン類似度が許容範囲内であることを確認（範囲外は AssertionError）"""
+    cosine = np.sum(embed(expected) * embed(actual), axis=1)
+    print(f"{label}: 埋め込みのコサイン類似度 最小 {cosine.min():.5f}, 平均 {cosine.mean():.5f} "
+          f"(許容 {MIN_COSINE_SIMILARITY})")
+    if cosine.min() < MIN_COSINE_SIMILARITY:
+        raise AssertionError(
+            f"{label}: コサイン類似度 {cosine.min():.5f} が許容値 {MIN_COSINE_SIMILARITY} を下回っています"
+        )
+
+
+def embed(pixel_values: np.ndarray) -> np.ndarray:
+    """前処理済みテンソルからL2正規化した埋め込みを計算"""
+    import torch
+    from transformers import CLIPModel
+    
+    if not hasattr(embed, "model"):
+        embed.model = CLIPModel.from_pretrained(MODEL_NAME).eval()
+    with torch.no_grad():
+        outputs = embed.model.get_image_features(pixel_values=torch.from_numpy(pixel_values)).numpy()
+    return outputs / np.linalg.norm(outputs, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLIP前処理の同等性チェック")
+    parser.add_argument("folder", nargs="?", help="画像フォルダ（省略時は合成画像）")
+    parser.add_argument("--limit", type=int, default=32, help="使用する画像の最大数")
+    parser.add_argument("--embed", action="store_true", help="CLIPの埋め込みでも比較する")
+    args = parser.parse_args()
+    
+    from PIL import Image
+    
+    paths = collect_sample_images(args.folder, args.limit)
+    if not paths:
+        print("画像が見つかりませんでした")
+        return
+    if not args.folder:
+        paths = add_rotated_copies(paths)
+    
+    # メモリ上: 同じ画素から比較するため、フル解像度のRGBを両方に渡す
+    pil_images = [load_oriented(p) for p in paths]
+    arrays = [np.asarray(image) for image in pil_images]
+    
+    name, reference = load_processor()
+    preprocess = CLIPPreprocessor(capacity=len(arrays))
+    
+    start = time.perf_counter()
+    expected = np.asarray(reference(pil_images), dtype=np.float32)
+    reference_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    actual = preprocess(arrays).copy()
+    native_seconds = time.perf_counter() - start
+    
+    # ファイル: スキャン時と同じ縮小デコード（EXIF回転はOpenCVが適用）からの前処理
+    start = time.perf_counter()
+    loaded = preprocess.load(paths)
+    reduced_decode = time.perf_counter() - start
+    if any(image is None for image in loaded):
+        raise AssertionError("CLIPPreprocessor.load で読み込めない画像があります")
+    from_file = preprocess(loaded).copy()
+    
+    start = time.perf_counter()
+    for path in paths:
+        Image.open(path).convert("RGB")
+    pil_decode = time.perf_counter() - start
+    
+    print(f"{len(paths)}枚, 基準: {name}")
+    print(f"前処理時間: {name} {reference_seconds * 1000 / len(paths):.2f}ms/枚, "
+          f"CLIPPreprocessor {native_seconds * 1000 / len(paths):.2f}ms/枚 "
+          f"({reference_seconds / max(native_seconds, 1e-9):.1f}x)")
+    print(f"デコード時間: PIL {pil_decode * 1000 / len(paths):.2f}ms/枚, "
+          f"縮小デコード {reduced_decode * 1000 / len(paths):.2f}ms/枚")
+    
+    try:
+        check_tensor("メモリ上", expected, actual)
+        check_tensor("ファイル", expected, from_file)
+        if args.embed:
+            check_embeddings("メモリ上", expected, actual)
+            check_embeddings("ファイル", expected, from_file)
+    except AssertionError as e:
+        print(f"判定: 許容範囲外 ({e})")
+        sys.exit(1)
+    print("判定: 許容範囲内")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - INT8 Quantization Validation Report
+INT8量子化モデルの埋め込みがfp32からどれだけずれるかの検証レポート
+
+参照用の画像フォルダ（コーパス）をfp32とINT8の両方で処理し、以下を表示する。
+    - 埋め込みのコサインドリフト（1 - cos(fp32, int8)）の平均・最大・99パーセンタイル
+    - 類似度が閾値をまたいだ画像ペアの数
+    - アプリと同じグループ化で、変化した類似グループの数
+    - 処理速度（枚/秒）
+
+INT8モデルが未作成の場合は --calibration-folder（省略時はコーパス自身）の画像で
+静的量子化する。--rebuild を付けると既存のINT8モデルを作り直す。
+
+使用方法:
+    python benchmarks/validate_quantization.py 画像フォルダ [--backend onnx] [--threshold 85]
+        [--calibration-folder フォルダ] [--rebuild] [--output report.json]
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from _common import collect_sample_images
+
+from core.clip_engine import CLIPEngine
+from core.database import ImageDatabase
+from core.onnx_backend import onnx_model_path
+from core.scanner import ImageScanner
+
+
+def embed_all(engine: CLIPEngine, paths, batch_size: int):
+    """全画像の埋め込みを計算し、(埋め込みリスト, 枚/秒) を返す"""
+    engine.extract_embeddings_batch(paths[:2], batch_size=2)  # ウォームアップ
+    start = time.perf_counter()
+    embeddings = engine.extract_embeddings_batch(paths, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    ok = sum(e is not None for e in embeddings)
+    return embeddings, (ok / elapsed if elapsed > 0 else 0.0)
+
+
+def find_groups(engine: CLIPEngine, paths, embeddings, threshold: int, work_dir: Path):
+    """アプリと同じ手順（DB → _find_groups_clip）で類似グループを求め、パス集合のセットを返す"""
+    db = ImageDatabase(work_dir / f"{engine.model_tag.replace(':', '_')}.db")
+    db.batch_upsert([
+        {'path': p, 'embedding': e, 'model_tag': engine.model_tag}
+        for p, e in zip(paths, embeddings)
+    ])
+    scanner = ImageScanner(db=db)
+    scanner._clip_engine = engine
+    groups = scanner._find_groups_clip(threshold)
+    db.close()
+    return {frozenset(str(img.path) for img in group.images) for group in groups}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8量子化モデルの検証レポート")
+    parser.add_argument("folder", help="参照用の画像フォルダ")
+    parser.add_argument("--limit", type=int, default=2000, help="使用する画像の最大数")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="onnx", help="推論バックエンド")
+    parser.add_argument("--batch", type=int, default=32, help="バッチサイズ")
+    parser.add_argument("--threshold", type=int, default=85, help="類似度閾値（%%）")
+    parser.add_argument("--calibration-folder", default=None, help="静的量子化のキャリブレーション用フォルダ")
+    parser.add_argument("--rebuild", action="store_true", help="INT8モデルを作り直す")
+    parser.add_argument("--output", default=None, help="レポートをJSONで保存するパス")
+    args = parser.parse_args()
+    
+    paths = collect_sample_images(args.folder, args.limit)
+    if len(paths) < 2:
+        print("画像が足りません")
+        return
+    
+    fp32 = CLIPEngine(backend=args.backend)
+    int8 = CLIPEngine(backend=args.backend, quantize=True)
+    for engine in (fp32, int8):
+        engine._use_subprocess = False  # 推論そのものを比較するため常に直接モード
+    
+    if args.rebuild:
+        int8_path = onnx_model_path(int8.model_name, quantized=True)
+        for stale in (int8_path, int8_path.with_suffix(".json")):
+            stale.unlink(missing_ok=True)
+    if int8.needs_quantization_calibration:
+        calibration = collect_sample_images(args.calibration_folder, args.limit) if args.calibration_folder else paths
+        int8.set_calibration_sample(calibration)
+        print(f"INT8モデルを作成します（キャリブレーション {len(int8.calibration_paths)}枚）")
+    
+    if not fp32.load_model() or not int8.load_model():
+        print("CLIPモデルを読み込めませんでした")
+        return
+    print(f"fp32: {fp32.model_tag} / int8: {int8.model_tag}")
+    
+    fp32_embeddings, fp32_rate = embed_all(fp32, paths, args.batch)
+    int8_embeddings, int8_rate = embed_all(int8, paths, args.batch)
+    valid = [
+        i for i, (a, b) in enumerate(zip(fp32_embeddings, int8_embeddings))
+        if a is not None and b is not None
+    ]
+    paths = [paths[i] for i in valid]
+    a = np.stack([fp32_embeddings[i] for i in valid])
+    b = np.stack([int8_embeddings[i] for i in valid])
+    
+    # コサインドリフト（埋め込みはL2正規化済み）
+    drift = 1.0 - np.sum(a * b, axis=1)
+    
+    # 閾値をまたいだペア（アプリと同じく (cos + 1) / 2 を類似度とする）
+    threshold = args.threshold / 100.0
+    upper = np.triu_indices(len(paths), k=1)
+    similar_a = ((a @ a.T + 1.0) / 2.0)[upper] >= threshold
+    similar_b = ((b @ b.T + 1.0) / 2.0)[upper] >= threshold
+    
+    with tempfile.TemporaryDirectory(prefix="spectramatch_quant_") as work_dir:
+        groups_a = find_groups(fp32, paths, list(a), args.threshold, Path(work_dir))
+        groups_b = find_groups(int8, paths, list(b), args.threshold, Path(work_dir))
+    
+    report = {
+        'images': len(paths),
+        'backend': args.backend,
+        'fp32_model_tag': fp32.model_tag,
+        'int8_model_tag': int8.model_tag,
+        'cosine_drift_mean': float(drift.mean()),
+        'cosine_drift_p99': float(np.percentile(drift, 99)),
+        'cosine_drift_max': float(drift.max()),
+        'pairs_similar_fp32': int(similar_a.sum()),
+        'pairs_lost': int((similar_a & ~similar_b).sum()),
+        'pairs_gained': int((~similar_a & similar_b).sum()),
+        'groups_fp32': len(groups_a),
+        'groups_int8': len(groups_b),
+        'groups_unchanged': len(groups_a & groups_b),
+        'groups_changed': len(groups_a - groups_b),
+        'groups_new': len(groups_b - groups_a),
+        'fp32_images_per_second': fp32_rate,
+        'int8_images_per_second': int8_rate,
+    }
+    
+    print(f"{report['images']}枚, 閾値{args.threshold}%")
+    print(
+        f"コサインドリフト: 平均 {report['cosine_drift_mean']:.2e}, "
+        f"99% {report['cosine_drift_p99']:.2e}, 最大 {report['cosine_drift_max']:.2e}"
+    )
+    print(
+        f"類似ペア: fp32 {report['pairs_similar_fp32']}組, "
+        f"INT8で消えた {report['pairs_lost']}組, 増えた {report['pairs_gained']}組"
+    )
+    print(
+        f"類似グループ: fp32 {report['groups_fp32']}個, INT8 {report['groups_int8']}個 "
+        f"(変化なし {report['groups_unchanged']}, 変化 {report['groups_changed']}, 新規 {report['groups_new']})"
+    )
+    print(f"速度: fp32 {fp32_rate:.1f}枚/秒, INT8 {int8_rate:.1f}枚/秒 ({int8_rate / max(fp32_rate, 1e-9):.2f}x)")
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"レポートを保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
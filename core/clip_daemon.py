@@ -0,0 +1,760 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - CLIP Daemon Module
+CLIPモデルを読み込んだまま常駐し、複数のアプリ・CLIから共有される埋め込みデーモン
+
+通常のワーカー（clip_worker.py）はアプリの起動ごとに作られ、スキャンのたびに
+PyTorch / transformers の読み込みとモデルのロード（数秒〜数十秒）が発生する。
+デーモンはローカルソケット（Windowsは名前付きパイプ、それ以外はUnixドメインソケット）で
+待ち受け、モデルを保持したまま接続を受け付ける。接続が無い状態が idle_timeout 秒続くと終了する。
+
+通信:
+    multiprocessing.connection のメッセージ単位で、内容は clip_protocol の v2 と同じ
+    （リクエストはJSON、レスポンスはバイナリフレーム）。加えて次の制御メッセージを持つ。
+        {"op": "hello"}     → デーモンの状態（status, device, model_tag, backend, quantize, pid ...）
+        {"op": "shutdown"}  → 新規接続の受け付けを止め、既存の接続が終わったら終了
+        "QUIT"              → この接続だけを閉じる
+    DaemonConnection は subprocess.Popen と同じ stdin / stdout / poll / wait / kill を持つため、
+    CLIPEngine はワーカープロセスと同じコードでデーモンを使える。
+
+接続は ~/.spectramatch/clip_daemon.key の認証キーで保護する（同じユーザーのみ読める）。
+
+CLI（システムPythonでスクリプトとして実行）:
+    python clip_daemon.py serve [--backend onnx] [--quantize] [--idle-timeout 1800]
+    python clip_daemon.py status
+    python clip_daemon.py stop
+    python clip_daemon.py embed a.jpg b.jpg --output embeddings.npy
+
+clip_worker.py と同様に同じディレクトリのモジュールとして実行されるため、標準ライブラリのみに依存させる
+（モデルの読み込みと推論は serve 時に clip_worker から借りる）。
+"""
+
+import getpass
+import io
+import json
+import logging
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Connection, Listener
+from pathlib import Path
+from queue import Queue
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DAEMON_DIR = Path.home() / ".spectramatch"
+KEY_PATH = DAEMON_DIR / "clip_daemon.key"
+LOG_PATH = DAEMON_DIR / "clip_daemon.log"
+SOCKET_PATH = DAEMON_DIR / "clip_daemon.sock"
+
+MODEL_NAME = "openai/clip-vit-base-patch32"
+
+# 接続が無い状態でこの秒数が経過したら終了する（0=終了しない）
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+
+# 起動したデーモンが待ち受けを始めるまで / モデルの読み込みが終わるまでの待ち時間（秒）
+CONNECT_TIMEOUT = 30
+STARTUP_TIMEOUT = 300
+
+# 停止要求後に既存の接続の完了を待つ時間（秒）
+DRAIN_TIMEOUT = 60
+
+# モデルの読み込みに失敗した場合、クライアントがエラーを受け取れるよう待ち受けを続ける時間（秒）
+FATAL_LINGER = 5
+
+# ログファイルがこのサイズを超えていたら起動時に作り直す
+MAX_LOG_BYTES = 1 << 20
+
+
+def daemon_address():
+    """待ち受けアドレスと種別を返す（Windowsはユーザーごとの名前付きパイプ）"""
+    if sys.platform == "win32":
+        return rf"\\.\pipe\spectramatch-clip-{getpass.getuser()}", "AF_PIPE"
+    return str(SOCKET_PATH), "AF_UNIX"
+
+
+def load_authkey() -> bytes:
+    """認証キーを読む（無ければ作成。先に作った側のキーを全員が使う）"""
+    DAEMON_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "w", encoding="ascii") as f:
+            f.write(secrets.token_hex(32))
+    
+    # 同時に作成された場合に書き込み途中のキーを読まないよう、空の間は待つ
+    for _ in range(50):
+        key = KEY_PATH.read_text(encoding="ascii").strip()
+        if key:
+            return key.encode("ascii")
+        time.sleep(0.01)
+    raise OSError(f"Daemon auth key is empty: {KEY_PATH}")
+
+
+def connect(timeout: float = 0) -> Optional[Connection]:
+    """起動中のデーモンに接続する（timeout秒まで再試行。接続できなければNone）"""
+    address, family = daemon_address()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return Client(address, family=family, authkey=load_authkey())
+        except (OSError, EOFError) as e:
+            if time.monotonic() >= deadline:
+                logger.debug(f"CLIP daemon not reachable: {e}")
+                return None
+        except Exception as e:
+            # 認証失敗（別のキーで起動したデーモン）など
+            logger.warning(f"CLIP daemon connection refused: {e}")
+            return None
+        time.sleep(0.1)
+
+
+def request(conn: Connection, op: str) -> Dict:
+    """制御メッセージを送り、JSONの応答を返す"""
+    conn.send_bytes(json.dumps({"op": op}).encode("utf-8"))
+    return json.loads(conn.recv_bytes().decode("utf-8"))
+
+
+def daemon_status() -> Optional[Dict]:
+    """起動中のデーモンの状態（起動していなければNone）"""
+    conn = connect()
+    if conn is None:
+        return None
+    try:
+        return request(conn, "hello")
+    except (OSError, EOFError, ValueError):
+        return None
+    finally:
+        conn.close()
+
+
+def stop_daemon(timeout: float = 10) -> bool:
+    """デーモンに停止を要求し、待ち受けが閉じるまで待つ（起動していなければFalse）"""
+    conn = connect()
+    if conn is None:
+        return False
+    try:
+        request(conn, "shutdown")
+    except (OSError, EOFError, ValueError):
+        pass
+    finally:
+        conn.close()
+    
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        probe = connect()
+        if probe is None:
+            return True
+        probe.close()
+        time.sleep(0.2)
+    return False
+
+
+def spawn_daemon(
+    python_exe: str,
+    script: Path,
+    env: Optional[Dict[str, str]] = None,
+    backend: str = "torch",
+    threads: int = 0,
+    quantize: bool = False,
+    idle_timeout: int = DEFAULT_IDLE_TIMEOUT,
+    calibration_list: Optional[str] = None
+) -> subprocess.Popen:
+    """デーモンを親プロセスから切り離して起動する（出力は LOG_PATH に追記）"""
+    command = [
+        python_exe, str(script), "serve",
+        "--backend", backend,
+        "--threads", str(threads),
+        "--idle-timeout", str(int(idle_timeout)),
+    ]
+    if quantize:
+        command.append("--quantize")
+    if calibration_list:
+        command += ["--calibration-list", calibration_list]
+    
+    DAEMON_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        mode = "wb" if LOG_PATH.stat().st_size > MAX_LOG_BYTES else "ab"
+    except OSError:
+        mode = "ab"
+    
+    if os.name == "nt":
+        detach = {"creationflags": subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        detach = {"start_new_session": True}
+    
+    with open(LOG_PATH, mode) as log:
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            env=env,
+            close_fds=True,
+            **detach
+        )
+    logger.info(f"Spawned CLIP daemon (pid {process.pid}): {' '.join(command)}")
+    return process
+
+
+class _RequestWriter:
+    """Popen.stdin 互換: 書き込まれた行を1行1メッセージとして送る"""
+    
+    def __init__(self, conn: Connection):
+        self._conn = conn
+        self._buffer = b""
+    
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        while b"\n" in self._buffer:
+            line, self._buffer = self._buffer.split(b"\n", 1)
+            self._conn.send_bytes(line)
+        return len(data)
+    
+    def flush(self):
+        pass
+
+
+class _FrameReader:
+    """Popen.stdout 互換: 受信したメッセージを連続したバイト列として read する"""
+    
+    def __init__(self, conn: Connection):
+        self._conn = conn
+        self._buffer = memoryview(b"")
+    
+    def read(self, size: int) -> bytes:
+        if not self._buffer:
+            try:
+                self._buffer = memoryview(self._conn.recv_bytes())
+            except (EOFError, OSError):
+                return b""
+        chunk = self._buffer[:size].tobytes()
+        self._buffer = self._buffer[size:]
+        return chunk
+
+
+class DaemonConnection:
+    """
+    デーモンへの接続を subprocess.Popen と同じ形で扱うアダプター
+    
+    CLIPEngine のワーカー用コード（v2リクエストの書き込み、結果フレームの受信、
+    QUIT による停止）をそのまま使える。停止してもデーモン自体は終了しない。
+    """
+    
+    def __init__(self, conn: Connection, info: Dict, spawned: bool = False):
+        self.info = info
+        self.pid = info.get("pid")
+        # このセッションでデーモンを起動した（モデルの読み込みを待った）か
+        self.spawned = spawned
+        self.stdin = _RequestWriter(conn)
+        self.stdout = _FrameReader(conn)
+        self.stderr = None
+        self._conn = conn
+        self._closed = False
+    
+    def poll(self) -> Optional[int]:
+        return 0 if self._closed else None
+    
+    def wait(self, timeout: Optional[float] = None) -> int:
+        self.close()
+        return 0
+    
+    def kill(self):
+        self.close()
+    
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if os.name != "nt":
+            # 別スレッドで受信待ちしている recv を確実に起こすため、先にソケットを shutdown する
+            try:
+                with socket.socket(fileno=os.dup(self._conn.fileno())) as sock:
+                    sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        try:
+            self._conn.close()
+        except OSError:
+            pass
+
+
+def open_session(
+    python_exe: str,
+    script: Path,
+    env: Optional[Dict[str, str]] = None,
+    backend: str = "torch",
+    threads: int = 0,
+    quantize: bool = False,
+    idle_timeout: int = DEFAULT_IDLE_TIMEOUT,
+    calibration_list: Optional[str] = None,
+    progress_callback: Optional[Callable[[str], None]] = None,
+    timeout: float = STARTUP_TIMEOUT
+) -> Optional[DaemonConnection]:
+    """デーモンに接続し、モデルの準備ができた接続を返す
+    
+    起動していなければ起動する。起動中のデーモンのバックエンド・量子化設定が異なる場合は
+    停止して新しい設定で起動し直す。失敗した場合はNone（呼び出し側は専用ワーカーを使う）。
+    """
+    conn = connect()
+    if conn is not None:
+        try:
+            info = request(conn, "hello")
+        except (OSError, EOFError, ValueError):
+            info = {}
+        if info.get("backend") != backend or bool(info.get("quantize")) != quantize:
+            logger.info(
+                f"CLIP daemon settings differ (backend={info.get('backend')}, quantize={info.get('quantize')}), restarting"
+            )
+            conn.close()
+            conn = None
+            stop_daemon()
+    
+    spawned = conn is None
+    if spawned:
+        if progress_callback:
+            progress_callback("AIデーモンを起動中...")
+        try:
+            process = spawn_daemon(
+                python_exe, script, env, backend, threads, quantize, idle_timeout, calibration_list
+            )
+        except OSError as e:
+            logger.error(f"Failed to spawn CLIP daemon: {e}")
+            return None
+        conn = connect(timeout=CONNECT_TIMEOUT)
+        if conn is None:
+            logger.error(f"CLIP daemon did not start listening (exit code {process.poll()}, see {LOG_PATH})")
+            return None
+    
+    # モデルの読み込みが終わるまで状態を問い合わせる（読み込み中の進捗もここで受け取る）
+    deadline = time.monotonic() + timeout
+    last_message = None
+    try:
+        while True:
+            info = request(conn, "hello")
+            status = info.get("status")
+            if status == "ready":
+                return DaemonConnection(conn, info, spawned)
+            if status == "fatal":
+                logger.error(f"CLIP daemon failed to load the model: {info.get('error')}")
+                break
+            if time.monotonic() > deadline:
+                logger.error(f"CLIP daemon startup timed out after {timeout}s")
+                break
+            message = info.get("message")
+            if message and message != last_message:
+                logger.info(message)
+                if progress_callback:
+                    progress_callback(message)
+                last_message = message
+            time.sleep(0.5)
+    except (OSError, EOFError, ValueError) as e:
+        logger.error(f"Lost connection to CLIP daemon during startup: {e}")
+    conn.close()
+    return None
+
+
+class _ProgressLog(io.TextIOBase):
+    """clip_worker の読み込み関数が出力するJSON行から進捗とエラーを拾う stdout の代わり"""
+    
+    def __init__(self, daemon: "CLIPDaemon", stream):
+        self._daemon = daemon
+        self._stream = stream
+    
+    def write(self, text: str) -> int:
+        self._stream.write(text)
+        for line in text.splitlines():
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(data, dict):
+                continue
+            if data.get("status") == "fatal":
+                self._daemon.error = data.get("error")
+            elif data.get("message"):
+                self._daemon.message = data["message"]
+        return len(text)
+    
+    def flush(self):
+        self._stream.flush()
+
+
+class CLIPDaemon:
+    """
+    モデルを常駐させて接続ごとにバッチを処理するデーモン本体
+    
+    接続ごとに読み込みスレッドが画像をデコードしてキューに積み（clip_worker の v2 と同じ先読み）、
+    推論はモデルのロックを取って1バッチずつ行う。
+    """
+    
+    def __init__(
+        self,
+        backend: str = "torch",
+        threads: int = 0,
+        quantize: bool = False,
+        idle_timeout: int = DEFAULT_IDLE_TIMEOUT,
+        calibration_list: Optional[str] = None,
+        model_name: str = MODEL_NAME
+    ):
+        self.backend = backend
+        self.threads = threads
+        self.quantize = quantize
+        self.idle_timeout = idle_timeout
+        self.calibration_list = calibration_list
+        self.model_name = model_name
+        
+        self.message = "AIモデルを読み込み中..."
+        self.error: Optional[str] = None
+        self.device = "cpu"
+        self.model_tag: Optional[str] = None
+        self.started_at = time.time()
+        self.load_seconds = 0.0
+        self.batches = 0
+        self.images = 0
+        
+        self._worker = None
+        self._forward = None
+        self._listener: Optional[Listener] = None
+        self._loaded = threading.Event()
+        self._stopping = threading.Event()
+        self._model_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._clients = 0
+        self._last_activity = time.monotonic()
+    
+    def info(self) -> Dict:
+        """hello への応答"""
+        if not self._loaded.is_set():
+            status = "loading"
+        else:
+            status = "ready" if self._forward is not None else "fatal"
+        return {
+            "status": status,
+            "message": self.message,
+            "error": self.error,
+            "device": self.device,
+            "model_tag": self.model_tag,
+            "backend": self.backend,
+            "quantize": self.quantize,
+            "pid": os.getpid(),
+            "clients": self._clients,
+            "uptime": time.time() - self.started_at,
+            "load_seconds": self.load_seconds,
+            "batches": self.batches,
+            "images": self.images,
+            "idle_timeout": self.idle_timeout,
+        }
+    
+    def serve(self) -> int:
+        """待ち受けを開始し、停止要求かアイドルタイムアウトまで処理を続ける"""
+        self._listener = self._bind()
+        if self._listener is None:
+            return 1
+        logger.info(f"CLIP daemon listening on {self._listener.address} (pid {os.getpid()})")
+        
+        threading.Thread(target=self._accept_loop, name="DaemonAccept", daemon=True).start()
+        threading.Thread(target=self._watch_idle, name="DaemonIdle", daemon=True).start()
+        
+        self._load()
+        if self._forward is None:
+            time.sleep(FATAL_LINGER)
+            self.stop("model load failed")
+        
+        self._stopping.wait()
+        self._listener.close()
+        
+        # 処理中の接続が終わるのを待つ
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while self._clients > 0 and time.monotonic() < deadline:
+            time.sleep(0.1)
+        logger.info(f"CLIP daemon exiting ({self.batches} batches, {self.images} images served)")
+        return 0 if self._forward is not None else 1
+    
+    def stop(self, reason: str):
+        if not self._stopping.is_set():
+            logger.info(f"CLIP daemon stopping: {reason}")
+            self._stopping.set()
+    
+    def _bind(self) -> Optional[Listener]:
+        """待ち受けを開始（別のデーモンが起動中ならNone）"""
+        address, family = daemon_address()
+        if family == "AF_UNIX" and os.path.exists(address):
+            probe = connect()
+            if probe is not None:
+                probe.close()
+                logger.info("Another CLIP daemon is already running")
+                return None
+            # 異常終了したデーモンが残したソケットファイル
+            os.unlink(address)
+        try:
+            return Listener(address, family=family, authkey=load_authkey())
+        except OSError as e:
+            logger.info(f"Could not listen on {address} (another daemon may be running): {e}")
+            return None
+    
+    def _load(self):
+        """clip_worker の読み込み関数でモデルを読み込む（進捗は hello で返す）"""
+        start = time.perf_counter()
+        stdout = sys.stdout
+        sys.stdout = _ProgressLog(self, stdout)
+        try:
+            # clip_worker はスクリプトと同じディレクトリのモジュールとしてimportする
+            sys.path.insert(0, str(Path(__file__).resolve().parent))
+            import clip_worker
+            self._worker = clip_worker
+            
+            calibration_paths = None
+            if self.calibration_list:
+                with open(self.calibration_list, "r", encoding="utf-8") as f:
+                    calibration_paths = [Path(line.strip()) for line in f if line.strip()]
+            
+            loaded = clip_worker.load_forward(
+                self.model_name, self.threads, self.backend, self.quantize, calibration_paths
+            )
+            if loaded is not None:
+                self._forward, self.device, self.model_tag = loaded
+                self.message = "ready"
+        except Exception as e:
+            self.error = str(e)
+            logger.exception("CLIP daemon failed to load the model")
+        finally:
+            sys.stdout = stdout
+            self.load_seconds = time.perf_counter() - start
+            if self._forward is None and self.error is None:
+                self.error = "Failed to load CLIP model"
+            self._touch()
+            self._loaded.set()
+        
+        if self._forward is not None:
+            logger.info(
+                f"CLIP model ready on {self.device} (model_tag={self.model_tag}) in {self.load_seconds:.1f}s"
+            )
+    
+    def _accept_loop(self):
+        while not self._stopping.is_set():
+            try:
+                conn = self._listener.accept()
+            except Exception as e:
+                if self._stopping.is_set():
+                    break
+                logger.warning(f"Rejected connection: {e}")
+                continue
+            if self._stopping.is_set():
+                conn.close()
+                break
+            threading.Thread(target=self._serve_connection, args=(conn,), name="DaemonClient", daemon=True).start()
+    
+    def _watch_idle(self):
+        """接続が無い状態が idle_timeout 秒続いたら停止する"""
+        if self.idle_timeout <= 0:
+            return
+        while not self._stopping.wait(min(5.0, self.idle_timeout)):
+            with self._state_lock:
+                idle = time.monotonic() - self._last_activity
+                clients = self._clients
+            if self._loaded.is_set() and clients == 0 and idle >= self.idle_timeout:
+                self.stop(f"idle for {idle:.0f}s")
+    
+    def _touch(self, images: int = 0):
+        with self._state_lock:
+            self._last_activity = time.monotonic()
+            if images:
+                self.batches += 1
+                self.images += images
+    
+    def _serve_connection(self, conn: Connection):
+        """1つの接続を処理する（読み込みスレッドで先読みしつつ、このスレッドで推論して返す）"""
+        with self._state_lock:
+            self._clients += 1
+            self._last_activity = time.monotonic()
+        
+        # 推論中に先読みしておくバッチ数（clip_worker と同じ）
+        prepared: Queue = Queue(maxsize=2)
+        send_lock = threading.Lock()
+        
+        def send(data: bytes):
+            with send_lock:
+                conn.send_bytes(data)
+        
+        def receive():
+            try:
+                while True:
+                    try:
+                        data = conn.recv_bytes()
+                    except (EOFError, OSError):
+                        break
+                    line = data.decode("utf-8", errors="replace").strip()
+                    if line == "QUIT":
+                        break
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._touch()
+                    
+                    op = message.get("op")
+                    if op == "hello":
+                        send(json.dumps(self.info()).encode("utf-8"))
+                    elif op == "shutdown":
+                        send(json.dumps({"status": "stopping"}).encode("utf-8"))
+                        self.stop("shutdown requested")
+                    elif op == "batch":
+                        paths = [str(p) for p in message.get("paths", [])]
+                        self._loaded.wait()
+                        if self._worker is not None:
+                            images, slots, errors = self._worker.load_images(paths)
+                        else:
+                            images, slots, errors = [], [], {i: self.error for i in range(len(paths))}
+                        prepared.put((int(message.get("id", 0)), len(paths), images, slots, errors))
+            except (OSError, EOFError):
+                pass
+            finally:
+                prepared.put(None)
+        
+        threading.Thread(target=receive, name="DaemonLoader", daemon=True).start()
+        
+        item = None
+        try:
+            while True:
+                item = prepared.get()
+                if item is None:
+                    break
+                request_id, count = item[0], item[1]
+                try:
+                    if self._forward is None:
+                        raise RuntimeError(self.error or "CLIP model is not loaded")
+                    with self._model_lock:
+                        frame = self._worker.encode_results(self._forward, *item)
+                except Exception as e:
+                    if self._worker is None:
+                        break
+                    failed = {i: str(e) for i in range(count)}
+                    frame = self._worker.encode_results(None, request_id, count, [], [], failed)
+                try:
+                    send(frame)
+                except (OSError, ValueError):
+                    break
+                self._touch(images=count)
+        finally:
+            conn.close()
+            # 読み込みスレッドがキューで止まったままにならないよう残りを捨てる
+            if item is not None:
+                while prepared.get() is not None:
+                    pass
+            with self._state_lock:
+                self._clients -= 1
+                self._last_activity = time.monotonic()
+
+
+def _embed(paths: List[str], output: Optional[str], backend: str, quantize: bool, batch_size: int) -> int:
+    """CLI: 画像の埋め込みをデーモンで計算し、.npy に保存（または件数と次元を表示）"""
+    import numpy as np
+    
+    try:
+        from .clip_protocol import STATUS_OK, encode_batch_request, read_frame
+    except ImportError:
+        from clip_protocol import STATUS_OK, encode_batch_request, read_frame
+    
+    connection = open_session(
+        sys.executable, Path(__file__).resolve(), backend=backend, quantize=quantize,
+        progress_callback=lambda message: print(message, file=sys.stderr)
+    )
+    if connection is None:
+        print(f"デーモンに接続できませんでした（{LOG_PATH} を確認してください）", file=sys.stderr)
+        return 1
+    
+    start = time.perf_counter()
+    rows = []
+    failed = 0
+    try:
+        for offset in range(0, len(paths), batch_size):
+            batch = [str(Path(p).resolve()) for p in paths[offset:offset + batch_size]]
+            connection.stdin.write(encode_batch_request(offset, batch))
+            frame = read_frame(connection.stdout)
+            if frame is None:
+                print("デーモンとの接続が切れました", file=sys.stderr)
+                return 1
+            vectors = np.frombuffer(frame.payload, dtype="<f4").reshape(-1, frame.dim or 1)
+            row = 0
+            for i, status in enumerate(frame.statuses):
+                if status == STATUS_OK:
+                    rows.append(vectors[row])
+                    row += 1
+                else:
+                    failed += 1
+                    rows.append(None)
+                    print(f"{batch[i]}: {frame.errors.get(i, 'unknown error')}", file=sys.stderr)
+    finally:
+        connection.stdin.write(b"QUIT\n")
+        connection.close()
+    
+    elapsed = time.perf_counter() - start
+    dim = next((len(r) for r in rows if r is not None), 0)
+    matrix = np.stack([r if r is not None else np.full(dim, np.nan, dtype=np.float32) for r in rows]) if dim else None
+    if output and matrix is not None:
+        np.save(output, matrix)
+    print(
+        f"{len(rows) - failed}/{len(rows)}枚 dim={dim} {elapsed:.2f}秒 "
+        f"(model_tag={connection.info.get('model_tag')}, デーモン{'起動' if connection.spawned else '再利用'})"
+    )
+    return 0 if failed == 0 else 2
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="SpectraMatch CLIP常駐デーモン")
+    sub = parser.add_subparsers(dest="command", required=True)
+    
+    serve = sub.add_parser("serve", help="デーモンを起動（フォアグラウンド）")
+    serve.add_argument("--backend", choices=["torch", "onnx"], default="torch", help="推論バックエンド")
+    serve.add_argument("--threads", type=int, default=0, help="演算スレッド数（0=既定値）")
+    serve.add_argument("--quantize", action="store_true", help="INT8量子化モデルを使う")
+    serve.add_argument("--calibration-list", default=None, help="キャリブレーション画像の一覧ファイル")
+    serve.add_argument(
+        "--idle-timeout", type=int, default=DEFAULT_IDLE_TIMEOUT,
+        help="接続が無い状態でこの秒数が経過したら終了（0=終了しない）"
+    )
+    
+    sub.add_parser("status", help="起動中のデーモンの状態を表示")
+    sub.add_parser("stop", help="デーモンを停止")
+    
+    embed = sub.add_parser("embed", help="画像の埋め込みを計算（デーモンが無ければ起動）")
+    embed.add_argument("paths", nargs="+", help="画像ファイル")
+    embed.add_argument("--output", default=None, help="埋め込みを保存する .npy（失敗した行はNaN）")
+    embed.add_argument("--backend", choices=["torch", "onnx"], default="torch", help="推論バックエンド")
+    embed.add_argument("--quantize", action="store_true", help="INT8量子化モデルを使う")
+    embed.add_argument("--batch-size", type=int, default=32, help="1リクエストあたりの枚数")
+    
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    
+    if args.command == "serve":
+        daemon = CLIPDaemon(args.backend, args.threads, args.quantize, args.idle_timeout, args.calibration_list)
+        return daemon.serve()
+    if args.command == "status":
+        info = daemon_status()
+        if info is None:
+            print("デーモンは起動していません")
+            return 1
+        print(json.dumps(info, ensure_ascii=False, indent=2))
+        return 0
+    if args.command == "stop":
+        if not stop_daemon():
+            print("デーモンは起動していません")
+            return 1
+        print("デーモンを停止しました")
+        return 0
+    return _embed(args.paths, args.output, args.backend, args.quantize, args.batch_size)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
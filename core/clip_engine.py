@@ -9,10 +9,19 @@ import sys
 import logging
 import shutil
 import importlib
+import threading
+from concurrent.futures import Future
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 
+from .clip_daemon import DEFAULT_IDLE_TIMEOUT
+from .clip_preprocess import CLIP_IMAGE_SIZE, CLIPPreprocessor, load_rgb, preprocess_model_tag
+from .clip_protocol import (
+    FP32_MODEL_TAG, HANDSHAKE, PROTOCOL_VERSION, STATUS_OK, TORCH_INT8_MODEL_TAG, BatchFrame,
+    encode_batch_request, read_frame
+)
+
 logger = logging.getLogger(__name__)
 
 # AIライブラリの保存先
@@ -22,6 +31,17 @@ AI_ENV_PATH = Path.home() / ".spectramatch" / "ai_libs"
 if str(AI_ENV_PATH) not in sys.path:
     sys.path.append(str(AI_ENV_PATH))
 
+# AIエンジンの確認結果の保存先と、確認するパッケージ
+AI_PROBE_CACHE_PATH = Path.home() / ".spectramatch" / "ai_probe.json"
+AI_PROBE_PACKAGES = ("numpy", "torch", "transformers", "PIL")
+
+# 確認結果（None=未確認）。確認中は _AI_PROBE_LOCK を保持する
+_AI_PROBE: Dict[str, Optional[bool]] = {"available": None}
+_AI_PROBE_LOCK = threading.Lock()
+
+# バックグラウンドでモデルを先読みするのに必要な空きメモリの目安（PyTorch + CLIP 1プロセス分）
+WARMUP_MIN_FREE_MEMORY = 2 * 1024 ** 3
+
 def find_python_executable() -> str:
     """システムのPython実行ファイルのパスを見つける"""
     if not getattr(sys, 'frozen', False):
@@ -108,7 +128,7 @@ def get_install_command() -> List[str]:
     python_exe = find_python_executable() or "python"
     return [
         python_exe, "-m", "pip", "install",
-        "torch", "transformers", "pillow", "numpy",
+        "torch", "transformers", "pillow", "numpy", "onnxruntime", "opencv-python-headless",
         "--target", str(AI_ENV_PATH),
         "--no-cache-dir",
         "--only-binary=:all:",
@@ -132,14 +152,121 @@ def is_ai_installed_on_disk() -> bool:
 
 
 def is_ai_installed() -> bool:
-    """AIエンジンがインストールされているか確認"""
+    """AIエンジンがインストールされているか確認
+    
+    結果はキャッシュする（ai_probe_result / start_ai_probe 参照）。初回はチェックが終わるまで待つため、
+    GUIスレッドからは ai_probe_result を使うこと。
+    """
+    if _AI_PROBE["available"] is not None:
+        return _AI_PROBE["available"]
+    with _AI_PROBE_LOCK:
+        # バックグラウンドのチェックが実行中ならその完了を待つ
+        if _AI_PROBE["available"] is None:
+            _AI_PROBE["available"] = _probe_ai_cached()
+        return _AI_PROBE["available"]
+
+
+def ai_probe_result() -> Optional[bool]:
+    """キャッシュ済みのAIエンジン確認結果（チェックが終わっていなければNone。待たない）"""
+    return _AI_PROBE["available"]
+
+
+def start_ai_probe():
+    """AIエンジンの確認をバックグラウンドで開始する（確認済み・確認中なら何もしない）"""
+    if _AI_PROBE["available"] is not None:
+        return
+    thread = threading.Thread(target=is_ai_installed, name="AIProbe", daemon=True)
+    thread.start()
+
+
+def invalidate_ai_probe():
+    """確認結果を破棄し、バックグラウンドで確認し直す（インストーラーの完了時に呼ぶ）"""
+    def reprobe():
+        # 実行中の確認があれば、その完了を待ってから破棄する
+        with _AI_PROBE_LOCK:
+            _AI_PROBE["available"] = None
+            try:
+                AI_PROBE_CACHE_PATH.unlink()
+            except OSError:
+                pass
+        is_ai_installed()
     
-    # PyInstaller環境の場合はサブプロセスでシステムPythonを使ってチェック
+    threading.Thread(target=reprobe, name="AIProbe", daemon=True).start()
+
+
+def _ai_probe_key() -> str:
+    """AIエンジンの確認結果のキャッシュキー
+    
+    確認に使うPythonのパスと更新日時、AI_ENV_PATH 直下の各エントリ（パッケージと
+    dist-info）の名前・更新日時・サイズから作る。pip install --target でパッケージを
+    入れ替えると直下のエントリが作り直されるため、キーが変わる。
+    開発環境では site-packages 側のインストールも検出できるよう、各パッケージの場所も含める。
+    """
+    import hashlib
+    import importlib.util
+    
+    frozen = getattr(sys, 'frozen', False)
+    python_exe = find_python_executable() if frozen else sys.executable
+    digest = hashlib.sha1(f"{python_exe}|{frozen}|{AI_ENV_PATH}".encode("utf-8"))
+    
+    for path in (python_exe, AI_ENV_PATH):
+        try:
+            digest.update(f"|{os.stat(path).st_mtime_ns}".encode("utf-8"))
+        except (OSError, TypeError):
+            digest.update(b"|missing")
+    
+    try:
+        for entry in sorted(os.scandir(AI_ENV_PATH), key=lambda e: e.name):
+            stat = entry.stat(follow_symlinks=False)
+            digest.update(f"|{entry.name}:{stat.st_mtime_ns}:{stat.st_size}".encode("utf-8"))
+    except OSError:
+        pass
+    
+    if not frozen:
+        for name in AI_PROBE_PACKAGES:
+            try:
+                spec = importlib.util.find_spec(name)
+            except (ImportError, ValueError):
+                spec = None
+            digest.update(f"|{name}={spec.origin if spec else None}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _probe_ai_cached() -> bool:
+    """保存済みの確認結果がキーと一致すれば使い、無ければ実際に確認して保存する"""
+    import json
+    import time
+    
+    if not getattr(sys, 'frozen', False):
+        # キャッシュを使う場合も、後でtorchをimportできるようにパスは設定しておく
+        _prepare_ai_import_path()
+    
+    key = _ai_probe_key()
+    try:
+        with open(AI_PROBE_CACHE_PATH, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            logger.info(f"AI components check (cached): available={cached['available']}")
+            return bool(cached["available"])
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    start = time.perf_counter()
     if getattr(sys, 'frozen', False):
-        return _check_ai_via_subprocess()
+        # PyInstaller環境の場合はサブプロセスでシステムPythonを使ってチェック
+        available = _check_ai_via_subprocess()
+    else:
+        # 通常のPython環境の場合は直接インポートテスト
+        available = _check_ai_direct_import()
+    logger.info(f"AI components check took {time.perf_counter() - start:.1f}s: available={available}")
     
-    # 通常のPython環境の場合は直接インポートテスト
-    return _check_ai_direct_import()
+    try:
+        AI_PROBE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(AI_PROBE_CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "available": available, "checked_at": time.time()}, f)
+    except OSError as e:
+        logger.debug(f"Could not save AI check result: {e}")
+    return available
 
 
 def _check_ai_via_subprocess() -> bool:
@@ -195,6 +322,26 @@ except Exception as e:
 
 def _check_ai_direct_import() -> bool:
     """直接インポートでAIライブラリをチェック（通常Python環境用）"""
+    _prepare_ai_import_path()
+    importlib.invalidate_caches()
+    
+    try:
+        import numpy
+        import torch
+        import transformers
+        import PIL.Image
+        
+        logger.info(f"AI components detected: torch={torch.__version__}, transformers={transformers.__version__}")
+        return True
+    except (ImportError, ModuleNotFoundError) as e:
+        logger.warning(f"AI component missing or failed to load: {e}")
+        return False
+    except Exception as e:
+        logger.error(f"Unexpected error during AI check: {e}")
+        return False
+
+def _prepare_ai_import_path():
+    """AIライブラリをこのプロセスでimportできるよう sys.path とDLL検索パスを設定"""
     # sys.path を再チェック
     if str(AI_ENV_PATH) not in sys.path:
         sys.path.insert(0, str(AI_ENV_PATH))
@@ -215,29 +362,95 @@ def _check_ai_direct_import() -> bool:
         except (AttributeError, OSError):
             pass
 
-    importlib.invalidate_caches()
-    
+def get_available_memory() -> Optional[int]:
+    """空き物理メモリ（バイト）を返す（取得できない環境ではNone）"""
     try:
-        import numpy
-        import torch
-        import transformers
-        import PIL.Image
+        if sys.platform == "win32":
+            import ctypes
+            
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [
+                    ("dwLength", ctypes.c_ulong),
+                    ("dwMemoryLoad", ctypes.c_ulong),
+                    ("ullTotalPhys", ctypes.c_ulonglong),
+                    ("ullAvailPhys", ctypes.c_ulonglong),
+                    ("ullTotalPageFile", ctypes.c_ulonglong),
+                    ("ullAvailPageFile", ctypes.c_ulonglong),
+                    ("ullTotalVirtual", ctypes.c_ulonglong),
+                    ("ullAvailVirtual", ctypes.c_ulonglong),
+                    ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+                ]
+            
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return int(status.ullAvailPhys)
+            return None
         
-        logger.info(f"AI components detected: torch={torch.__version__}, transformers={transformers.__version__}")
-        return True
-    except (ImportError, ModuleNotFoundError) as e:
-        logger.warning(f"AI component missing or failed to load: {e}")
-        return False
+        # Linux: ページキャッシュなど解放可能な分を含む MemAvailable を使う
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def lower_thread_priority():
+    """呼び出したスレッドの優先度を下げる（Windowsのみ。UIスレッドより後回しにする）
+    
+    Linuxではスレッドのnice値が以後に生成される演算スレッドへ引き継がれ、
+    スキャン中の推論まで遅くなるため変更しない。
+    """
+    if sys.platform != "win32":
+        return
+    try:
+        import ctypes
+        THREAD_PRIORITY_BELOW_NORMAL = -1
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_PRIORITY_BELOW_NORMAL)
     except Exception as e:
-        logger.error(f"Unexpected error during AI check: {e}")
-        return False
+        logger.debug(f"Could not lower thread priority: {e}")
+
+def _gather_futures(futures: List[Future]) -> Future:
+    """複数のリスト結果Futureを、順序を保って連結した1つのFutureにまとめる"""
+    combined: Future = Future()
+    if not futures:
+        combined.set_result([])
+        return combined
+    
+    remaining = [len(futures)]
+    lock = threading.Lock()
+    
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            combined.set_result([item for f in futures for item in f.result()])
+    
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+class _PendingRequests(dict):
+    """1つのワーカープロセスの応答待ちリクエスト（request_id → (Future, パス)）
+    
+    受信スレッドの終了時に closed を立て、以降は誰も読まない表に追加されないようにする。
+    closed の読み書きは CLIPEngine._pending_lock を保持して行う。
+    """
+    closed = False
 
 _CLIP_AVAILABLE = None
 
 def _check_clip_available() -> bool:
     """CLIPが利用可能かチェック（内部キャッシュあり）"""
     global _CLIP_AVAILABLE
-    # 実行時に動的にチェックする（インストール直後に対応するため）
+    # 確認結果はキャッシュされ、インストーラーの完了時に invalidate_ai_probe で破棄される
     _CLIP_AVAILABLE = is_ai_installed()
     return _CLIP_AVAILABLE
 
@@ -248,19 +461,111 @@ class CLIPEngine:
     ワーカープロセスでCLIP処理を行う。
     """
     
-    def __init__(self, model_name: str = "openai/clip-vit-base-patch32"):
+    # ワーカーに同時に送っておけるバッチリクエスト数（v2プロトコルのみ）
+    WORKER_MAX_IN_FLIGHT = 4
+    
+    def __init__(
+        self,
+        model_name: str = "openai/clip-vit-base-patch32",
+        pool_size: int = 1,
+        worker_threads: int = 0,
+        backend: str = "torch",
+        quantize: bool = False,
+        use_daemon: bool = False,
+        daemon_idle_timeout: int = DEFAULT_IDLE_TIMEOUT
+    ):
+        """
+        Args:
+            model_name: CLIPモデル名
+            pool_size: ワーカープロセス数（1=従来どおり、2以上=プール、0=計測して自動決定）
+            worker_threads: ワーカー1つあたりのPyTorchスレッド数（0=PyTorchの既定値）
+            backend: 推論バックエンド（"torch" または "onnx"。onnxが使えない場合はtorch）
+            quantize: ビジョンエンコーダーの線形層をINT8に量子化する（CPU向け、オプトイン）
+            use_daemon: 常駐デーモン（clip_daemon.py）に接続し、アプリ終了後もモデルを保持させる
+            daemon_idle_timeout: 接続が無い状態でデーモンが終了するまでの秒数（0=終了しない）
+        """
         self.model_name = model_name
+        self.backend = backend
+        self.quantize = quantize
+        # 読み込んだモデルの種類（埋め込みと一緒にDBへ保存する。load_model後に確定）
+        self.model_tag = FP32_MODEL_TAG
+        # 静的量子化のキャリブレーションに使うライブラリのサンプル（set_calibration_sample）
+        self.calibration_paths: List[Path] = []
+        self._onnx = None
         self.model = None
-        self.processor = None
+        self._preprocess = CLIPPreprocessor()
+        # 前処理バッファは共有のため、直接モードの推論（warm_up とスキャン）を直列化する
+        self._forward_lock = threading.Lock()
         self.device = "cpu"
-        self._use_subprocess = getattr(sys, 'frozen', False)
+        # デーモン使用時は開発環境でもワーカー経由（接続先はデーモン）で処理する
+        self.use_daemon = use_daemon
+        self.daemon_idle_timeout = daemon_idle_timeout
+        self._use_subprocess = getattr(sys, 'frozen', False) or use_daemon
         self._worker_process = None
         self._worker_ready = False
+        self._worker_protocol = 1
+        self._next_request_id = 1
+        self.worker_launches = 0
+        self.max_in_flight = self.WORKER_MAX_IN_FLIGHT
+        
+        # パイプライン化クライアントの状態（request_id → (Future, パス)）
+        self._pending = _PendingRequests()
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._window: Optional[threading.BoundedSemaphore] = None
+        self._reader_thread: Optional[threading.Thread] = None
+        self._start_lock = threading.RLock()
+        
+        # ワーカープール（pool_size != 1 の場合のみ使用）
+        self.pool_size = pool_size
+        self.worker_threads = worker_threads
+        # デーモンは1プロセスで全クライアントを受け持つため、プールとは併用しない
+        self._use_pool = pool_size != 1 and not use_daemon
+        self._pool = None
+        self.calibrated_pool: Optional[Tuple[int, int]] = None
         
     @property
     def is_available(self) -> bool:
         return is_ai_installed()
     
+    @property
+    def is_loaded(self) -> bool:
+        """モデルが読み込み済みで、すぐに推論できるか"""
+        if self._use_pool:
+            return self._pool is not None and self._pool.is_running
+        if self._use_subprocess:
+            return self._worker_ready
+        return self.model is not None or self._onnx is not None
+    
+    @property
+    def accepts_decoded_images(self) -> bool:
+        """デコード済み画像を受け取れるか（ワーカー版はパスから自前で読み込む）"""
+        return not self._use_subprocess and not self._use_pool
+    
+    @property
+    def supports_pipelining(self) -> bool:
+        """推論中に次のリクエストを送れるか（プール使用時、またはv2ワーカーで複数リクエストを許可している場合）"""
+        if self._use_pool:
+            return True
+        return (
+            self._use_subprocess
+            and self._worker_protocol >= PROTOCOL_VERSION
+            and self.max_in_flight > 1
+        )
+    
+    @property
+    def needs_quantization_calibration(self) -> bool:
+        """INT8モデルをまだ作っておらず、キャリブレーション用のサンプルが必要か（ONNX使用時のみ）"""
+        if not self.quantize or self.backend != "onnx":
+            return False
+        from .onnx_backend import onnx_model_path, read_model_tag
+        return read_model_tag(onnx_model_path(self.model_name, quantized=True)) is None
+    
+    def set_calibration_sample(self, image_paths: List[Path]):
+        """静的量子化のキャリブレーションに使う画像（ユーザーのライブラリから抽出）を設定"""
+        from .onnx_backend import select_calibration_sample
+        self.calibration_paths = select_calibration_sample(image_paths)
+    
     def _get_worker_script_path(self) -> Path:
         """ワーカースクリプトのパスを取得"""
         if getattr(sys, 'frozen', False):
@@ -279,6 +584,11 @@ class CLIPEngine:
         return Path(__file__).parent / "clip_worker.py"
     
     def _start_worker(self, progress_callback=None) -> bool:
+        """ワーカープロセスを起動（複数スレッドから呼ばれても二重起動しない）"""
+        with self._start_lock:
+            return self._launch_worker(progress_callback)
+    
+    def _launch_worker(self, progress_callback=None) -> bool:
         """ワーカープロセスを起動（タイムアウト付き）"""
         import subprocess
         import json
@@ -297,6 +607,7 @@ class CLIPEngine:
             return False
 
         worker_script = self._get_worker_script_path()
+        calibration_file = None
         
         logger.info(f"Starting worker: python={python_exe}, script={worker_script}")
         
@@ -314,18 +625,34 @@ class CLIPEngine:
             env = os.environ.copy()
             env['PYTHONPATH'] = str(AI_ENV_PATH) + os.pathsep + env.get('PYTHONPATH', '')
             
+            command = [python_exe, str(worker_script)]
+            if self.worker_threads > 0:
+                # プール内の各ワーカーが互いのコアを奪い合わないようスレッド数を固定
+                command += ["--threads", str(self.worker_threads)]
+                env['OMP_NUM_THREADS'] = str(self.worker_threads)
+                env['MKL_NUM_THREADS'] = str(self.worker_threads)
+            if self.backend != "torch":
+                command += ["--backend", self.backend]
+            if self.quantize:
+                command.append("--quantize")
+                if self.calibration_paths and self.needs_quantization_calibration:
+                    calibration_file = self._write_calibration_list()
+                    command += ["--calibration-list", calibration_file]
+            
+            if self.use_daemon and self._connect_daemon(python_exe, worker_script, env, calibration_file, progress_callback):
+                return True
+            
+            # v2のバイナリフレームを受け取るためバイナリモードで開く（テキスト行は自前でデコード）
             self._worker_process = subprocess.Popen(
-                [python_exe, str(worker_script)],
+                command,
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
                 creationflags=creationflags,
-                env=env,
-                encoding='utf-8'
+                env=env
             )
             
+            self.worker_launches += 1
             logger.info(f"Worker process started with PID: {self._worker_process.pid}")
             
             # モデル読み込み完了を待つ（タイムアウト付き）
@@ -336,7 +663,8 @@ class CLIPEngine:
             self._stderr_lines = []
             def read_stderr():
                 try:
-                    for line in self._worker_process.stderr:
+                    for raw in self._worker_process.stderr:
+                        line = raw.decode('utf-8', errors='replace')
                         self._stderr_lines.append(line)
                         logger.debug(f"Worker stderr: {line.strip()}")
                 except:
@@ -368,7 +696,7 @@ class CLIPEngine:
                     return False
                 
                 try:
-                    data = json.loads(line.strip())
+                    data = json.loads(line.decode('utf-8').strip())
                     status = data.get("status")
                     
                     if status == "loading":
@@ -378,7 +706,11 @@ class CLIPEngine:
                             progress_callback(msg)
                     elif status == "ready":
                         self.device = data.get("device", "cpu")
-                        logger.info(f"CLIP worker ready on {self.device}")
+                        self.model_tag = data.get("model_tag", FP32_MODEL_TAG)
+                        logger.info(f"CLIP worker ready on {self.device} (model_tag={self.model_tag})")
+                        self._worker_protocol = self._negotiate_protocol()
+                        if self._worker_protocol >= PROTOCOL_VERSION:
+                            self._start_reader()
                         self._worker_ready = True
                         return True
                     elif status == "fatal":
@@ -386,8 +718,8 @@ class CLIPEngine:
                         traceback_info = data.get('traceback', '')
                         logger.error(f"Worker fatal error: {error_msg}\n{traceback_info}")
                         return False
-                except json.JSONDecodeError:
-                    logger.warning(f"Invalid JSON from worker: {line}")
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    logger.warning(f"Invalid JSON from worker: {line!r}")
                     continue
                     
         except Exception as e:
@@ -395,27 +727,194 @@ class CLIPEngine:
             import traceback
             logger.debug(traceback.format_exc())
             return False
+        finally:
+            if calibration_file is not None:
+                try:
+                    os.unlink(calibration_file)
+                except OSError:
+                    pass
+    
+    def _connect_daemon(self, python_exe, worker_script, env, calibration_file, progress_callback=None) -> bool:
+        """常駐デーモンに接続する（起動していなければ起動）。失敗した場合は専用ワーカーを使う"""
+        from .clip_daemon import open_session
+        
+        connection = open_session(
+            python_exe,
+            worker_script.with_name("clip_daemon.py"),
+            env=env,
+            backend=self.backend,
+            threads=self.worker_threads,
+            quantize=self.quantize,
+            idle_timeout=self.daemon_idle_timeout,
+            calibration_list=calibration_file,
+            progress_callback=progress_callback
+        )
+        if connection is None:
+            logger.warning("CLIP daemon unavailable, starting a private worker instead")
+            return False
+        
+        self._worker_process = connection
+        self.worker_launches += 1
+        self.device = connection.info.get("device", "cpu")
+        self.model_tag = connection.info.get("model_tag") or FP32_MODEL_TAG
+        self._worker_protocol = PROTOCOL_VERSION
+        self._start_reader()
+        self._worker_ready = True
+        logger.info(
+            f"Connected to CLIP daemon (pid {connection.pid}, "
+            f"{'started' if connection.spawned else 'warm, model load skipped'}) "
+            f"on {self.device} (model_tag={self.model_tag})"
+        )
+        return True
+    
+    def _write_calibration_list(self) -> str:
+        """キャリブレーション画像のパスを一時ファイルに書き出す（ワーカーへの受け渡し用）"""
+        import tempfile
+        
+        fd, path = tempfile.mkstemp(prefix="spectramatch_calib_", suffix=".txt")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("\n".join(str(p) for p in self.calibration_paths))
+        return path
+    
+    def _negotiate_protocol(self) -> int:
+        """ワーカーとバッチプロトコル（v2）を交渉し、使用するバージョンを返す
+        
+        v1のみのワーカーはハンドシェイク行を画像パスとして扱いエラーを返すため、
+        その場合は従来の1行1パスのプロトコルを使う。
+        """
+        import json
+        
+        try:
+            self._worker_process.stdin.write(f"{HANDSHAKE}\n".encode('utf-8'))
+            self._worker_process.stdin.flush()
+            line = self._worker_process.stdout.readline()
+            data = json.loads(line.decode('utf-8').strip()) if line else {}
+            if data.get("status") == "protocol" and data.get("version") == PROTOCOL_VERSION:
+                logger.info(f"CLIP worker protocol v{PROTOCOL_VERSION} (batched binary frames)")
+                return PROTOCOL_VERSION
+        except Exception as e:
+            logger.warning(f"Protocol negotiation failed: {e}")
+        logger.info("CLIP worker protocol v1 (line-based fallback)")
+        return 1
+    
+    def _start_reader(self):
+        """ワーカーの結果フレームを受信するスレッドを起動
+        
+        応答待ちの表と送信枠はプロセスごとに新しく作り、受信スレッドに引数で渡す。
+        再起動前のプロセスの受信スレッドが後から終了しても、新しいプロセスの状態には触れない。
+        """
+        pending = _PendingRequests()
+        window = threading.BoundedSemaphore(max(1, self.max_in_flight))
+        self._pending = pending
+        self._window = window
+        self._reader_thread = threading.Thread(
+            target=self._read_worker_frames,
+            args=(self._worker_process, pending, window),
+            name="CLIPWorkerReader",
+            daemon=True
+        )
+        self._reader_thread.start()
+    
+    def _read_worker_frames(self, process, pending: _PendingRequests, window: threading.BoundedSemaphore):
+        """結果フレームを読み続け、request_idで対応するFutureを完了させる"""
+        try:
+            while True:
+                frame = read_frame(process.stdout)
+                if frame is None:
+                    # 応答待ちが残っている状態でのEOFはワーカーの異常終了
+                    with self._pending_lock:
+                        has_pending = bool(pending)
+                    if has_pending:
+                        logger.error("Worker returned empty response (EOF). Worker might have crashed.")
+                    break
+                
+                with self._pending_lock:
+                    entry = pending.pop(frame.request_id, None)
+                if entry is None:
+                    logger.warning(f"Unexpected frame for unknown request {frame.request_id}")
+                    continue
+                
+                future, paths = entry
+                window.release()
+                future.set_result(self._decode_frame(frame, paths))
+        except Exception as e:
+            logger.error(f"Error communicating with worker: {e}")
+        finally:
+            if self._worker_process is process:
+                self._worker_ready = False
+                # 受信できなくなったプロセスは再利用できないため停止し、次の送信で起動し直す
+                if process.poll() is None:
+                    logger.warning("Stopping CLIP worker after its reader exited")
+                    try:
+                        process.kill()
+                        process.wait(timeout=5)
+                    except Exception as e:
+                        logger.debug(f"Could not stop CLIP worker: {e}")
+            self._fail_pending(pending, window)
+    
+    def _fail_pending(self, pending: _PendingRequests, window: threading.BoundedSemaphore):
+        """プロセスの応答待ちリクエストを全て失敗（None）として完了させ、以降の追加を拒否する"""
+        with self._pending_lock:
+            pending.closed = True
+            entries = list(pending.values())
+            pending.clear()
+        for future, paths in entries:
+            window.release()
+            future.set_result([None] * len(paths))
+    
+    def _decode_frame(self, frame: BatchFrame, image_paths: List[Path]) -> List[Optional[np.ndarray]]:
+        """結果フレームをリクエスト順の埋め込みリストに変換"""
+        results: List[Optional[np.ndarray]] = [None] * len(image_paths)
+        if frame.count != len(image_paths):
+            logger.error(
+                f"Unexpected frame (id={frame.request_id}, count={frame.count}) "
+                f"for request with {len(image_paths)} paths"
+            )
+            return results
+        
+        vectors = np.frombuffer(frame.payload, dtype='<f4')
+        if frame.dim:
+            vectors = vectors.reshape(-1, frame.dim)
+        row = 0
+        for i, status in enumerate(frame.statuses):
+            if status == STATUS_OK:
+                results[i] = vectors[row]
+                row += 1
+            else:
+                logger.error(f"Worker error: {image_paths[i]} - {frame.errors.get(i, 'unknown error')}")
+        return results
     
     def _stop_worker(self):
         """ワーカープロセスを停止"""
-        if self._worker_process is not None:
+        process = self._worker_process
+        if process is not None:
+            # 先に切り離し、QUIT後のEOFを受信スレッドが異常終了として扱わないようにする
+            self._worker_process = None
+            self._worker_ready = False
             try:
-                self._worker_process.stdin.write("QUIT\n")
-                self._worker_process.stdin.flush()
-                self._worker_process.wait(timeout=5)
+                with self._write_lock:
+                    process.stdin.write(b"QUIT\n")
+                    process.stdin.flush()
+                process.wait(timeout=5)
             except Exception:
-                self._worker_process.kill()
-            finally:
-                self._worker_process = None
-                self._worker_ready = False
+                process.kill()
         
     def load_model(self, progress_callback=None):
-        """モデルを読み込む"""
+        """モデルを読み込む（ウォームアップ中に呼ばれた場合はその読み込みの完了を待って使う）"""
+        with self._start_lock:
+            return self._load_model(progress_callback)
+    
+    def _load_model(self, progress_callback=None):
+        if self._use_pool:
+            return self._start_pool(progress_callback)
         if self._use_subprocess:
             return self._start_worker(progress_callback)
         
         # 通常版（直接インポート）
-        if self.model is not None: 
+        if self.model is not None or self._onnx is not None: 
+            return True
+        
+        if self.backend == "onnx" and self._load_onnx(progress_callback):
             return True
         
         if not is_ai_installed():
@@ -426,13 +925,25 @@ class CLIPEngine:
             if progress_callback: 
                 progress_callback("AIモデルを読み込み中...")
             import torch
-            from transformers import CLIPProcessor, CLIPModel
+            from transformers import CLIPModel
             
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
             logger.info(f"Loading CLIP model: {self.model_name} on {self.device}...")
             
+            # 前処理は CLIPPreprocessor（OpenCV）で行うため CLIPProcessor は読み込まない
             self.model = CLIPModel.from_pretrained(self.model_name).to(self.device)
-            self.processor = CLIPProcessor.from_pretrained(self.model_name)
+            
+            self.model_tag = FP32_MODEL_TAG
+            if self.quantize:
+                if self.device == "cpu":
+                    # 量子化済み線形層はCPU専用（GPUではfp32のまま使う）
+                    self.model = torch.ao.quantization.quantize_dynamic(
+                        self.model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+                    )
+                    self.model_tag = TORCH_INT8_MODEL_TAG
+                else:
+                    logger.info("INT8 quantization is CPU-only, keeping fp32 model on GPU")
+            self.model_tag = preprocess_model_tag(self.model_tag)
             
             logger.info("CLIP model loaded successfully")
             return True
@@ -442,32 +953,206 @@ class CLIPEngine:
             logger.debug(traceback.format_exc())
             return False
 
-    def get_embedding(self, image_path: Path) -> Optional[np.ndarray]:
-        """画像から特徴ベクトルを抽出"""
+    def warm_up(
+        self,
+        cancel_event: Optional[threading.Event] = None,
+        progress_callback=None
+    ) -> Optional[float]:
+        """モデルを読み込み、ダミー画像で1回推論しておく
+        
+        初回の推論でだけ発生する初期化（カーネルの選択やメモリ確保）もここで済ませる。
+        cancel_event は読み込みの前後で確認する（読み込み自体は途中で止めない）。
+        
+        Returns:
+            開始から最初の埋め込みが得られるまでの秒数（中止・失敗した場合はNone）
+        """
+        import tempfile
+        import time
+        import cv2
+        
+        start = time.perf_counter()
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        if not self.load_model(progress_callback):
+            return None
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        
+        image = np.full((CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE, 3), 128, dtype=np.uint8)
+        if self.accepts_decoded_images:
+            embedding = self.extract_embeddings_batch([Path("warmup.png")], images=[image])[0]
+        else:
+            # ワーカーはパスから読み込むため、一時ファイルに書き出して渡す
+            fd, path = tempfile.mkstemp(prefix="spectramatch_warmup_", suffix=".png")
+            os.close(fd)
+            try:
+                cv2.imwrite(path, image)
+                embedding = self.extract_embeddings_batch([Path(path)])[0]
+            finally:
+                os.unlink(path)
+        
+        if embedding is None:
+            logger.warning("CLIP warm-up inference failed")
+            return None
+        return time.perf_counter() - start
+
+    def _load_onnx(self, progress_callback=None) -> bool:
+        """ONNX Runtimeバックエンドを読み込む（失敗時はPyTorch版にフォールバック）"""
+        from .onnx_backend import ONNXCLIPBackend
+        
+        backend = ONNXCLIPBackend(self.model_name, threads=self.worker_threads, quantized=self.quantize)
+        if not backend.load(progress_callback, self.calibration_paths or None):
+            logger.warning("ONNX backend unavailable, falling back to PyTorch")
+            return False
+        self._onnx = backend
+        self.model_tag = backend.model_tag
+        self.device = "cpu"
+        return True
+    
+    def _start_pool(self, progress_callback=None) -> bool:
+        """ワーカープールを起動（pool_size=0 の場合は先に計測して構成を決める）"""
+        from .clip_pool import CLIPWorkerPool
+        
+        with self._start_lock:
+            if self._pool is not None:
+                return self._pool.is_running
+            
+            if self.needs_quantization_calibration and self.calibration_paths:
+                # INT8モデルは1つのワーカーで先に作り、プールの各ワーカーはそれを読み込むだけにする
+                builder = CLIPEngine(
+                    self.model_name, worker_threads=self.worker_threads,
+                    backend=self.backend, quantize=True
+                )
+                builder._use_subprocess = True
+                builder.calibration_paths = self.calibration_paths
+                builder.load_model(progress_callback)
+                builder._stop_worker()
+            
+            if self.pool_size <= 0:
+                if progress_callback:
+                    progress_callback("AIワーカー構成を計測中...")
+                self.pool_size, self.worker_threads = CLIPWorkerPool.calibrate(
+                    self.model_name, backend=self.backend, quantize=self.quantize,
+                    progress_callback=progress_callback
+                )
+                self.calibrated_pool = (self.pool_size, self.worker_threads)
+            
+            pool = CLIPWorkerPool(
+                self.model_name, self.pool_size, self.worker_threads, self.backend, self.quantize
+            )
+            if not pool.start(progress_callback):
+                return False
+            self._pool = pool
+            self.device = pool.device
+            self.model_tag = pool.model_tag
+            return True
+    
+    def _stop_pool(self):
+        """ワーカープールを停止"""
+        if self._pool is not None:
+            self._pool.stop()
+            self._pool = None
+    
+    def get_embedding(
+        self,
+        image_path: Path,
+        image: Optional[np.ndarray] = None
+    ) -> Optional[np.ndarray]:
+        """画像から特徴ベクトルを抽出
+        
+        Args:
+            image_path: 画像パス
+            image: デコード済みのRGB画像（指定時は再デコードしない。ワーカー版では無視）
+        """
+        if self._use_pool:
+            return self.submit_embeddings_batch([image_path]).result()[0]
         if self._use_subprocess:
             return self._get_embedding_via_worker(image_path)
         else:
-            return self._get_embedding_direct(image_path)
+            return self._get_embedding_direct(image_path, image)
     
     def _get_embedding_via_worker(self, image_path: Path) -> Optional[np.ndarray]:
         """ワーカープロセス経由で特徴抽出"""
-        import json
-        import base64
+        return self._get_embeddings_via_worker([image_path])[0]
+    
+    def _get_embeddings_via_worker(self, image_paths: List[Path]) -> List[Optional[np.ndarray]]:
+        """ワーカープロセス経由でバッチ特徴抽出（v1ワーカーでは1枚ずつ）"""
+        return self._submit_worker_batch(image_paths).result()
+    
+    def _submit_worker_batch(self, image_paths: List[Path]) -> Future:
+        """バッチリクエストをワーカーに送信し、結果のFutureを返す
+        
+        v2ワーカーでは応答を待たずに戻る（同時送信数はmax_in_flightまで）。
+        v1ワーカーでは従来どおり1枚ずつ同期的に処理し、完了済みのFutureを返す。
+        """
+        future: Future = Future()
+        failed = [None] * len(image_paths)
+        if not image_paths:
+            future.set_result([])
+            return future
         
         if not self._worker_ready:
             if not self._start_worker():
-                return None
+                future.set_result(failed)
+                return future
         
         # ワーカー生存確認
-        if self._worker_process.poll() is not None:
-            logger.error(f"Worker process died unexpectedly with code {self._worker_process.poll()}")
+        process = self._worker_process
+        if process.poll() is not None:
+            logger.error(f"Worker process died unexpectedly with code {process.poll()}")
             self._worker_ready = False
-            return None
-
+            future.set_result(failed)
+            return future
+        
+        if self._worker_protocol < PROTOCOL_VERSION:
+            future.set_result([self._get_embedding_via_worker_v1(path) for path in image_paths])
+            return future
+        
+        # 送信先プロセスの状態をまとめて取得（途中で再起動されても混ざらないように）
+        pending, window, reader = self._pending, self._window, self._reader_thread
+        
+        # 送信枠が空くまで待つ（受信スレッドが終了していたら諦める）
+        while not window.acquire(timeout=1.0):
+            if reader is None or not reader.is_alive():
+                future.set_result(failed)
+                return future
+        
+        with self._pending_lock:
+            closed = pending.closed
+            if not closed:
+                request_id = self._next_request_id
+                self._next_request_id += 1
+                pending[request_id] = (future, list(image_paths))
+        if closed:
+            # 受信スレッドが終了済み（応答は誰も受け取らない）
+            window.release()
+            future.set_result(failed)
+            return future
+        
+        try:
+            with self._write_lock:
+                process.stdin.write(encode_batch_request(request_id, [str(p) for p in image_paths]))
+                process.stdin.flush()
+        except Exception as e:
+            logger.error(f"Error communicating with worker: {e}")
+            if self._worker_process is process:
+                self._worker_ready = False
+            with self._pending_lock:
+                entry = pending.pop(request_id, None)
+            if entry is not None:
+                window.release()
+                future.set_result(failed)
+        return future
+    
+    def _get_embedding_via_worker_v1(self, image_path: Path) -> Optional[np.ndarray]:
+        """従来の1行1パスのプロトコルで特徴抽出（v1ワーカー用フォールバック）"""
+        import json
+        import base64
+        
         try:
             # 画像パスをワーカーに送信
             logger.info(f"Sending request to worker: {image_path}")
-            self._worker_process.stdin.write(f"{image_path}\n")
+            self._worker_process.stdin.write(f"{image_path}\n".encode('utf-8'))
             self._worker_process.stdin.flush()
             
             # 結果を受信
@@ -476,12 +1161,15 @@ class CLIPEngine:
             if not line:
                 logger.error("Worker returned empty response (EOF). Worker might have crashed.")
                 # stderrを少し読んでみる
-                err_preview = self._worker_process.stderr.read(1024) if self._worker_process.stderr else "No stderr"
+                err_preview = (
+                    self._worker_process.stderr.read(1024).decode('utf-8', errors='replace')
+                    if self._worker_process.stderr else "No stderr"
+                )
                 logger.error(f"Worker stderr preview: {err_preview}")
                 self._worker_ready = False
                 return None
             
-            data = json.loads(line.strip())
+            data = json.loads(line.decode('utf-8').strip())
             
             if data.get("status") == "ok":
                 embedding_b64 = data["embedding"]
@@ -497,50 +1185,141 @@ class CLIPEngine:
             self._worker_ready = False
             return None
     
-    def _get_embedding_direct(self, image_path: Path) -> Optional[np.ndarray]:
+    def _get_embedding_direct(
+        self,
+        image_path: Path,
+        image_array: Optional[np.ndarray] = None
+    ) -> Optional[np.ndarray]:
         """直接インポートで特徴抽出（通常Python環境用）"""
+        return self._get_embeddings_direct_batch([image_path], [image_array])[0]
+    
+    def _get_embeddings_direct_batch(
+        self,
+        image_paths: List[Path],
+        image_arrays: List[Optional[np.ndarray]]
+    ) -> List[Optional[np.ndarray]]:
+        """直接インポートでバッチ特徴抽出（1回のforwardでN枚を処理）
+        
+        読み込みに失敗した画像はその枠だけNoneになり、残りの画像はそのまま処理する。
+        """
+        results: List[Optional[np.ndarray]] = [None] * len(image_paths)
         if not self.load_model(): 
-            return None
-        import torch
-        from PIL import Image
+            return results
+        
+        images = []
+        slots = []
+        for i, (path, array) in enumerate(zip(image_paths, image_arrays)):
+            try:
+                images.append(array if array is not None else load_rgb(path))
+                slots.append(i)
+            except Exception as e:
+                logger.error(f"Error loading image: {path} - {e}")
+        
+        if not images:
+            return results
+        
         try:
-            image = Image.open(image_path).convert("RGB")
-            inputs = self.processor(images=image, return_tensors="pt").to(self.device)
-            with torch.no_grad():
-                outputs = self.model.get_image_features(**inputs)
-            embedding = outputs.cpu().numpy()[0]
-            norm = np.linalg.norm(embedding)
-            if norm > 1e-6: 
-                embedding = embedding / norm
-            return embedding
+            embeddings = self._forward_images(images)
         except Exception as e:
-            logger.error(f"Error extracting features: {e}")
-            return None
+            # バッチ全体が失敗した場合は1枚ずつ処理し、原因の画像だけを失敗扱いにする
+            logger.warning(f"Batch inference failed ({e}), retrying images individually")
+            for slot, image in zip(slots, images):
+                try:
+                    results[slot] = self._forward_images([image])[0]
+                except Exception as e:
+                    logger.error(f"Error extracting features: {image_paths[slot]} - {e}")
+            return results
+        
+        for slot, embedding in zip(slots, embeddings):
+            results[slot] = embedding
+        return results
+    
+    def _forward_images(self, images: list) -> np.ndarray:
+        """RGB画像のリストを1つのテンソルにまとめて推論し、L2正規化した行列を返す
+        
+        前処理の戻り値は共有バッファのビューのため、推論が終わるまでロックを保持する。
+        """
+        with self._forward_lock:
+            if self._onnx is not None:
+                return self._onnx.embed(images)
+            import torch
+            pixel_values = torch.from_numpy(self._preprocess(images)).to(self.device)
+            with torch.no_grad():
+                outputs = self.model.get_image_features(pixel_values=pixel_values)
+            embeddings = outputs.cpu().numpy()
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        # ノルムがほぼ0のベクトルは正規化しない（従来の1枚ずつの処理と同じ）
+        norms = np.where(norms > 1e-6, norms, 1.0)
+        return embeddings / norms
     
     def __del__(self):
         """デストラクタ: ワーカーを停止"""
+        self._stop_pool()
         self._stop_worker()
     
     def extract_embedding(self, image_path: Path) -> Optional[np.ndarray]:
         """画像から特徴ベクトルを抽出（get_embeddingのエイリアス）"""
         return self.get_embedding(image_path)
     
+    def submit_embeddings_batch(
+        self,
+        image_paths: List[Path],
+        batch_size: int = 32,
+        images: Optional[List[Optional[np.ndarray]]] = None
+    ) -> Future:
+        """extract_embeddings_batch の非同期版
+        
+        v2ワーカーではリクエストを送信した時点で戻るため、呼び出し側は結果を待つ間に
+        次の画像のデコードなどを進められる。それ以外の場合は計算を終えてから
+        完了済みのFutureを返す。
+        
+        Returns:
+            埋め込みベクトルのリスト（extract_embeddings_batchと同じ）を結果に持つFuture
+        """
+        if not self._use_subprocess and not self._use_pool:
+            future: Future = Future()
+            future.set_result(self.extract_embeddings_batch(image_paths, batch_size, images))
+            return future
+        
+        step = max(1, batch_size)
+        chunks = [image_paths[start:start + step] for start in range(0, len(image_paths), step)]
+        
+        if self._use_pool:
+            if not self.load_model():
+                future = Future()
+                future.set_result([None] * len(image_paths))
+                return future
+            # チャンクは共有キューに積まれ、手の空いたワーカーから順に取っていく
+            return _gather_futures([self._pool.submit(chunk) for chunk in chunks])
+        
+        return _gather_futures([self._submit_worker_batch(chunk) for chunk in chunks])
+    
     def extract_embeddings_batch(
         self, 
         image_paths: List[Path], 
-        batch_size: int = 32
+        batch_size: int = 32,
+        images: Optional[List[Optional[np.ndarray]]] = None
     ) -> List[Optional[np.ndarray]]:
         """複数画像から特徴ベクトルをバッチ抽出
         
         Args:
             image_paths: 画像パスのリスト
-            batch_size: バッチサイズ（ワーカー版では無視）
+            batch_size: 1回の推論（ワーカー版では1リクエスト）でまとめて処理する枚数
+            images: image_pathsと同順のデコード済みRGB画像（FeaturePipeline参照）。
+                    Noneの要素はパスから読み込む
         
         Returns:
             各画像の埋め込みベクトルのリスト（失敗した場合はNone）
         """
-        results = []
-        for path in image_paths:
-            embedding = self.get_embedding(path)
-            results.append(embedding)
+        if self._use_subprocess or self._use_pool:
+            # 全チャンクを先に送信し、ワーカーが推論している間も次のリクエストを待機させる
+            return self.submit_embeddings_batch(image_paths, batch_size).result()
+        
+        if images is None:
+            images = [None] * len(image_paths)
+        
+        results: List[Optional[np.ndarray]] = []
+        for start in range(0, len(image_paths), max(1, batch_size)):
+            end = start + max(1, batch_size)
+            results.extend(self._get_embeddings_direct_batch(image_paths[start:end], images[start:end]))
         return results
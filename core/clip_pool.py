@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - CLIP Worker Pool Module
+複数のCLIPワーカープロセスでバッチを分担するプール
+
+GPUの無い多コアマシンでは、PyTorchプロセス1つでは全コアを使い切れない
+（または演算スレッド同士が競合する）。プールでは各ワーカーのスレッド数を固定し、
+バッチを共有キューに積んで手の空いたワーカーから取っていく（ワークスティーリング）。
+ワーカーが異常終了した場合は再起動し、処理中だったバッチはキューに戻す。
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from queue import Queue
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# モデル1つあたり数百MBのメモリを使うため、プールの上限を設ける
+MAX_POOL_SIZE = 8
+
+# ワーカー1つあたりの配送スレッド数（2以上で送信と推論が重なる）
+DISPATCH_PER_WORKER = 2
+
+# ワーカーの異常終了で失敗したバッチを再投入する回数
+MAX_RETRIES = 2
+
+# 計測に使う画像数とバッチサイズ
+CALIBRATION_IMAGES = 64
+CALIBRATION_BATCH = 16
+
+
+def default_candidates(
+    cpu_count: Optional[int] = None,
+    max_pool_size: int = MAX_POOL_SIZE
+) -> List[Tuple[int, int]]:
+    """計測する (ワーカー数, ワーカーあたりスレッド数) の候補を返す
+    
+    コア数をワーカー数 × スレッド数で分け合う組み合わせを、スレッド数を倍々にして列挙する。
+    """
+    cores = max(1, cpu_count or os.cpu_count() or 1)
+    candidates: List[Tuple[int, int]] = []
+    threads = 1
+    while threads <= cores:
+        size = min(max_pool_size, max(1, cores // threads))
+        if (size, threads) not in candidates:
+            candidates.append((size, threads))
+        threads *= 2
+    return candidates
+
+
+class CLIPWorkerPool:
+    """
+    CLIPワーカープロセスのプール
+    
+    使い方:
+        pool = CLIPWorkerPool(model_name, size=4, threads_per_worker=8)
+        pool.start()
+        future = pool.submit(paths)       # 結果は埋め込みのリスト
+        pool.stop()
+    """
+    
+    def __init__(
+        self,
+        model_name: str,
+        size: int,
+        threads_per_worker: int = 0,
+        backend: str = "torch",
+        quantize: bool = False
+    ):
+        self.model_name = model_name
+        self.backend = backend
+        self.quantize = quantize
+        self.size = max(1, size)
+        self.threads_per_worker = threads_per_worker
+        self.device = "cpu"
+        self.model_tag = None
+        
+        self._workers = []
+        self._jobs: Queue = Queue()
+        self._dispatchers: List[threading.Thread] = []
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stopping = False
+    
+    @property
+    def is_running(self) -> bool:
+        return self._active > 0 and not self._stopping
+    
+    @property
+    def restarts(self) -> int:
+        """異常終了したワーカーを再起動した回数"""
+        return sum(max(0, engine.worker_launches - 1) for engine in self._workers)
+    
+    def start(self, progress_callback: Optional[Callable[[str], None]] = None) -> bool:
+        """全ワーカーを並列に起動（一部が失敗しても1つ以上起動できれば続行）"""
+        from .clip_engine import CLIPEngine
+        
+        if progress_callback:
+            progress_callback(
+                f"AIワーカーを起動中... ({self.size}プロセス × {self.threads_per_worker or '既定'}スレッド)"
+            )
+        
+        engines = [
+            CLIPEngine(
+                self.model_name, worker_threads=self.threads_per_worker,
+                backend=self.backend, quantize=self.quantize
+            )
+            for _ in range(self.size)
+        ]
+        for engine in engines:
+            engine._use_subprocess = True
+        
+        started = [False] * len(engines)
+        
+        def launch(index: int):
+            started[index] = engines[index].load_model()
+        
+        threads = [threading.Thread(target=launch, args=(i,), daemon=True) for i in range(len(engines))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        self._workers = [engine for engine, ok in zip(engines, started) if ok]
+        for engine, ok in zip(engines, started):
+            if not ok:
+                engine._stop_worker()
+        if not self._workers:
+            logger.error("No CLIP worker could be started")
+            return False
+        if len(self._workers) < self.size:
+            logger.warning(f"Only {len(self._workers)}/{self.size} CLIP workers started")
+        
+        self.device = self._workers[0].device
+        self.model_tag = self._workers[0].model_tag
+        self._stopping = False
+        self._active = len(self._workers)
+        for index, engine in enumerate(self._workers):
+            for n in range(DISPATCH_PER_WORKER):
+                t = threading.Thread(
+                    target=self._dispatch,
+                    args=(engine,),
+                    name=f"CLIPPool-{index}-{n}",
+                    daemon=True
+                )
+                t.start()
+                self._dispatchers.append(t)
+        
+        logger.info(
+            f"CLIP worker pool ready: {len(self._workers)} workers, "
+            f"{self.threads_per_worker or 'default'} threads each"
+        )
+        return True
+    
+    def submit(self, image_paths: List[Path]) -> Future:
+        """バッチをキューに積み、埋め込みのリストを結果に持つFutureを返す"""
+        future: Future = Future()
+        if not image_paths:
+            future.set_result([])
+        elif not self.is_running:
+            future.set_result([None] * len(image_paths))
+        else:
+            self._jobs.put((list(image_paths), future, 0))
+        return future
+    
+    def stop(self):
+        """配送スレッドとワーカーを停止（キューに残ったバッチは失敗扱い）"""
+        self._stopping = True
+        for _ in self._dispatchers:
+            self._jobs.put(None)
+        for t in self._dispatchers:
+            t.join(timeout=5)
+        self._dispatchers = []
+        self._fail_queued()
+        for engine in self._workers:
+            engine._stop_worker()
+        self._workers = []
+        self._active = 0
+    
+    def _dispatch(self, engine):
+        """キューからバッチを取り出して担当ワーカーに送る（配送スレッド本体）"""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            paths, future, attempts = job
+            
+            try:
+                results = engine._submit_worker_batch(paths).result()
+            except Exception as e:
+                logger.error(f"CLIP pool dispatch error: {e}")
+                results = [None] * len(paths)
+            
+            if engine._worker_ready or self._stopping:
+                future.set_result(results)
+                continue
+            
+            # ワーカーが落ちた: バッチは他のワーカーに回し、このワーカーは再起動する
+            if attempts < MAX_RETRIES:
+                logger.warning(f"CLIP worker died, requeueing {len(paths)} images (attempt {attempts + 1})")
+                self._jobs.put((paths, future, attempts + 1))
+            else:
+                future.set_result(results)
+            
+            # 同じワーカーの他の配送スレッドが既に再起動している場合は起動済みのまま戻る
+            if not engine._start_worker():
+                logger.error("CLIP worker could not be restarted, retiring it from the pool")
+                self._retire()
+                break
+    
+    def _retire(self):
+        """ワーカーを1つ退役させる（全滅した場合は残りのバッチを失敗扱いにする）"""
+        with self._lock:
+            self._active -= 1
+            last = self._active <= 0
+        if last:
+            self._fail_queued()
+    
+    def _fail_queued(self):
+        """キューに残っているバッチを全て失敗（None）として完了させる"""
+        while not self._jobs.empty():
+            job = self._jobs.get_nowait()
+            if job is not None:
+                paths, future, _ = job
+                future.set_result([None] * len(paths))
+    
+    @classmethod
+    def measure(
+        cls,
+        model_name: str,
+        size: int,
+        threads_per_worker: int,
+        sample_paths: List[Path],
+        batch_size: int = CALIBRATION_BATCH,
+        backend: str = "torch",
+        quantize: bool = False
+    ) -> float:
+        """指定構成のプールで sample_paths を処理し、スループット（枚/秒）を返す"""
+        pool = cls(model_name, size, threads_per_worker, backend, quantize)
+        if not pool.start():
+            return 0.0
+        try:
+            # ウォームアップ（各ワーカーの初回推論を計測から除く）
+            warmup = [pool.submit(sample_paths[:1]) for _ in range(len(pool._workers))]
+            for f in warmup:
+                f.result()
+            
+            start = time.perf_counter()
+            futures = [
+                pool.submit(sample_paths[i:i + batch_size])
+                for i in range(0, len(sample_paths), batch_size)
+            ]
+            done = sum(1 for f in futures for e in f.result() if e is not None)
+            elapsed = time.perf_counter() - start
+            return done / elapsed if elapsed > 0 else 0.0
+        finally:
+            pool.stop()
+    
+    @classmethod
+    def calibrate(
+        cls,
+        model_name: str,
+        sample_paths: Optional[List[Path]] = None,
+        candidates: Optional[List[Tuple[int, int]]] = None,
+        progress_callback: Optional[Callable[[str], None]] = None,
+        backend: str = "torch",
+        quantize: bool = False
+    ) -> Tuple[int, int]:
+        """候補構成を順に短時間計測し、最もスループットの高い (ワーカー数, スレッド数) を返す
+        
+        sample_paths を省略した場合は一時フォルダに合成画像を作って計測する
+        （推論時間は画像の内容に依存しないため）。
+        """
+        candidates = candidates or default_candidates()
+        temp_dir = None
+        if not sample_paths:
+            temp_dir, sample_paths = _make_calibration_images(CALIBRATION_IMAGES)
+        
+        best = (1, 0)
+        best_rate = 0.0
+        try:
+            for size, threads in candidates:
+                rate = cls.measure(
+                    model_name, size, threads, sample_paths, backend=backend, quantize=quantize
+                )
+                message = f"計測: {size}プロセス × {threads}スレッド → {rate:.1f}枚/秒"
+                logger.info(message)
+                if progress_callback:
+                    progress_callback(message)
+                if rate > best_rate:
+                    best, best_rate = (size, threads), rate
+        finally:
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        
+        logger.info(f"CLIP pool calibrated: {best[0]} workers x {best[1]} threads ({best_rate:.1f} img/s)")
+        return best
+
+
+def _make_calibration_images(count: int) -> Tuple[str, List[Path]]:
+    """計測用の合成画像（ノイズ画像）を一時フォルダに書き出す"""
+    import numpy as np
+    import cv2
+    
+    temp_dir = tempfile.mkdtemp(prefix="spectramatch_calib_")
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        path = Path(temp_dir) / f"calib_{i:03d}.jpg"
+        cv2.imwrite(str(path), rng.integers(0, 256, (480, 640, 3), dtype=np.uint8))
+        paths.append(path)
+    return temp_dir, paths
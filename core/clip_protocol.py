@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - CLIP Worker Protocol
+CLIPEngine と clip_worker.py の間で使うバッチ通信プロトコル（v2）の定義
+
+clip_worker.py はシステムPythonでスクリプトとして実行されるため、
+このモジュールは標準ライブラリのみに依存させる（同じディレクトリから直接importされる）。
+
+v1（従来）: 1行1パスを送り、base64埋め込みを含むJSONが1行返る
+v2:
+    ハンドシェイク  クライアント → "PROTOCOL 2\\n"
+                    ワーカー     → {"status": "protocol", "version": 2}\\n
+                    （v1ワーカーは "File not found" エラーを返すので、それを見てv1にフォールバック）
+    リクエスト      {"op": "batch", "id": <int>, "paths": [...]}\\n
+    レスポンス      バイナリフレーム（リトルエンディアン）
+                    ヘッダ     "SMB2" + request_id(u32) + count(u32) + dim(u32)
+                    ステータス count バイト（1=成功, 0=失敗）
+                    埋め込み   成功件数 × dim 個の float32（L2正規化済み、リクエスト順）
+                    エラー     u32長 + JSON {"<index>": "<message>"}（失敗した項目のみ）
+
+モデルタグ:
+    埋め込みを計算したモデルの種類。ワーカーは ready メッセージの "model_tag" で報告し、
+    DBには埋め込みと一緒に保存される。タグの異なる埋め込みは同じ検索インデックスに入れない。
+    fp32（PyTorch / ONNX Runtime）は数値的に同等なので同じタグを使う。
+"""
+
+import json
+import struct
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, List, Optional
+
+PROTOCOL_VERSION = 2
+HANDSHAKE = f"PROTOCOL {PROTOCOL_VERSION}"
+
+FRAME_MAGIC = b"SMB2"
+FRAME_HEADER = struct.Struct("<4sIII")
+ERROR_LENGTH = struct.Struct("<I")
+
+STATUS_ERROR = 0
+STATUS_OK = 1
+
+FP32_MODEL_TAG = "fp32"
+TORCH_INT8_MODEL_TAG = "int8-dynamic-torch"
+
+
+@dataclass
+class BatchFrame:
+    """ワーカーから返されたバッチ結果フレーム"""
+    request_id: int
+    dim: int
+    statuses: bytes
+    payload: bytes
+    errors: Dict[int, str] = field(default_factory=dict)
+    
+    @property
+    def count(self) -> int:
+        return len(self.statuses)
+
+
+def encode_batch_request(request_id: int, paths: List[str]) -> bytes:
+    """バッチリクエスト（JSON 1行）をエンコード"""
+    request = {"op": "batch", "id": request_id, "paths": paths}
+    return (json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def encode_frame(
+    request_id: int,
+    dim: int,
+    statuses: bytes,
+    payload: bytes,
+    errors: Dict[int, str]
+) -> bytes:
+    """バッチ結果をバイナリフレームにエンコード
+    
+    Args:
+        request_id: 対応するリクエストのID
+        dim: 埋め込みの次元数
+        statuses: 項目ごとのステータスバイト列
+        payload: 成功した項目の埋め込み（float32, リトルエンディアン）を連結したもの
+        errors: 失敗した項目のインデックス → エラーメッセージ
+    """
+    error_bytes = json.dumps({str(i): msg for i, msg in errors.items()}).encode("utf-8")
+    return b"".join([
+        FRAME_HEADER.pack(FRAME_MAGIC, request_id, len(statuses), dim),
+        statuses,
+        payload,
+        ERROR_LENGTH.pack(len(error_bytes)),
+        error_bytes,
+    ])
+
+
+def read_exact(stream: BinaryIO, size: int) -> Optional[bytes]:
+    """ストリームからちょうどsizeバイト読む（途中でEOFならNone）"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_frame(stream: BinaryIO) -> Optional[BatchFrame]:
+    """バイナリフレームを1つ読む（EOFならNone、形式不正ならValueError）"""
+    header = read_exact(stream, FRAME_HEADER.size)
+    if header is None:
+        return None
+    magic, request_id, count, dim = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC:
+        raise ValueError(f"Invalid frame magic: {magic!r}")
+    
+    statuses = read_exact(stream, count)
+    if statuses is None:
+        return None
+    ok_count = sum(1 for s in statuses if s == STATUS_OK)
+    payload = read_exact(stream, ok_count * dim * 4)
+    if payload is None:
+        return None
+    
+    length = read_exact(stream, ERROR_LENGTH.size)
+    if length is None:
+        return None
+    error_bytes = read_exact(stream, ERROR_LENGTH.unpack(length)[0])
+    if error_bytes is None:
+        return None
+    errors = {int(i): msg for i, msg in json.loads(error_bytes.decode("utf-8")).items()}
+    
+    return BatchFrame(request_id, dim, statuses, payload, errors)
@@ -19,50 +19,58 @@ if sys.platform == "win32":
     sys.stdin.reconfigure(encoding='utf-8')
     sys.stdout.reconfigure(encoding='utf-8')
 
-def main():
-    """メイン処理: stdinから画像パスを受け取り、特徴ベクトルを返す"""
-    import os
-    
-    # 環境情報をログ出力（デバッグ用）
-    print(json.dumps({
-        "status": "loading", 
-        "message": "Initializing worker...",
-        "python_version": sys.version,
-        "cwd": os.getcwd()
-    }), flush=True)
+# バッチ通信プロトコル（v2）。同じディレクトリの clip_protocol.py が無い場合はv1のみ対応
+try:
+    from clip_protocol import (
+        FP32_MODEL_TAG, HANDSHAKE, PROTOCOL_VERSION, STATUS_ERROR, STATUS_OK, TORCH_INT8_MODEL_TAG,
+        encode_frame
+    )
+except ImportError:
+    HANDSHAKE = None
+    FP32_MODEL_TAG, TORCH_INT8_MODEL_TAG = "fp32", "int8-dynamic-torch"
+
+# OpenCVによる前処理。clip_preprocess.py（とOpenCV）が無い場合は PIL + CLIPProcessor を使う
+try:
+    from clip_preprocess import CLIPPreprocessor, load_rgb, preprocess_model_tag
+except ImportError:
+    CLIPPreprocessor = None
+    preprocess_model_tag = lambda model_tag: model_tag
+
+
+def open_image(path):
+    """画像を推論用に読み込む（CLIPPreprocessorがあれば縮小デコードしたRGB配列、無ければPIL画像）"""
+    if CLIPPreprocessor is not None:
+        return load_rgb(path)
+    from PIL import Image
+    return Image.open(path).convert("RGB")
+
+def load_torch_forward(model_name: str, threads: int = 0, quantize: bool = False):
+    """PyTorch + transformers でCLIPを読み込み、(推論関数, デバイス, モデルタグ) を返す（失敗時はNone）
     
-    try:
-        import numpy as np
-        print(json.dumps({"status": "loading", "message": "numpy loaded"}), flush=True)
-    except ImportError as e:
-        print(json.dumps({"status": "fatal", "error": f"Failed to import numpy: {e}"}), flush=True)
-        return
+    quantize=True かつCPU実行の場合は、線形層をINT8に動的量子化する
+    （量子化済み線形層はCPU専用のため、GPUではfp32のまま）。
+    """
+    import numpy as np
     
     try:
         import torch
+        if threads > 0:
+            torch.set_num_threads(threads)
         print(json.dumps({
             "status": "loading", 
-            "message": f"torch loaded (version: {torch.__version__})"
+            "message": f"torch loaded (version: {torch.__version__}, threads: {torch.get_num_threads()})"
         }), flush=True)
     except ImportError as e:
         print(json.dumps({"status": "fatal", "error": f"Failed to import torch: {e}"}), flush=True)
-        return
-    
-    try:
-        from PIL import Image
-        print(json.dumps({"status": "loading", "message": "PIL loaded"}), flush=True)
-    except ImportError as e:
-        print(json.dumps({"status": "fatal", "error": f"Failed to import PIL: {e}"}), flush=True)
-        return
+        return None
     
     try:
         from transformers import CLIPProcessor, CLIPModel
         print(json.dumps({"status": "loading", "message": "transformers loaded"}), flush=True)
     except ImportError as e:
         print(json.dumps({"status": "fatal", "error": f"Failed to import transformers: {e}"}), flush=True)
-        return
+        return None
     
-    model_name = "openai/clip-vit-base-patch32"
     device = "cuda" if torch.cuda.is_available() else "cpu"
     
     print(json.dumps({
@@ -72,10 +80,20 @@ def main():
     
     try:
         model = CLIPModel.from_pretrained(model_name).to(device)
-        print(json.dumps({"status": "loading", "message": "CLIP model loaded, loading processor..."}), flush=True)
+        if CLIPPreprocessor is not None:
+            preprocess = CLIPPreprocessor()
+        else:
+            print(json.dumps({"status": "loading", "message": "CLIP model loaded, loading processor..."}), flush=True)
+            processor = CLIPProcessor.from_pretrained(model_name)
         
-        processor = CLIPProcessor.from_pretrained(model_name)
-        print(json.dumps({"status": "ready", "device": device}), flush=True)
+        model_tag = FP32_MODEL_TAG
+        if quantize and device == "cpu":
+            model = torch.ao.quantization.quantize_dynamic(
+                model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+            )
+            model_tag = TORCH_INT8_MODEL_TAG
+            print(json.dumps({"status": "loading", "message": "CLIP linear layers quantized to INT8"}), flush=True)
+        model_tag = preprocess_model_tag(model_tag)
     except Exception as e:
         import traceback
         print(json.dumps({
@@ -83,9 +101,188 @@ def main():
             "error": f"Failed to load CLIP model: {e}",
             "traceback": traceback.format_exc()
         }), flush=True)
+        return None
+    
+    def forward(batch):
+        """画像リストを1回の推論で処理し、L2正規化した行列を返す"""
+        if CLIPPreprocessor is not None:
+            inputs = {"pixel_values": torch.from_numpy(preprocess(batch)).to(device)}
+        else:
+            inputs = processor(images=batch, return_tensors="pt").to(device)
+        with torch.no_grad():
+            outputs = model.get_image_features(**inputs)
+        matrix = outputs.cpu().numpy().astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms > 1e-6, norms, 1.0)
+    
+    return forward, device, model_tag
+
+
+def load_onnx_forward(model_name: str, threads: int = 0, quantize: bool = False, calibration_paths=None):
+    """ONNX Runtime でCLIPを読み込み、(推論関数, モデルタグ) を返す（使えない場合はNone）"""
+    try:
+        from onnx_backend import ONNXCLIPBackend
+        backend = ONNXCLIPBackend(model_name, threads=threads, quantized=quantize)
+        progress = lambda msg: print(json.dumps({"status": "loading", "message": msg}), flush=True)
+        if backend.load(progress, calibration_paths):
+            return backend.embed, backend.model_tag
+    except Exception as e:
+        print(json.dumps({"status": "loading", "message": f"ONNX backend error: {e}"}), flush=True)
+    print(json.dumps({"status": "loading", "message": "ONNX backend unavailable, falling back to torch"}), flush=True)
+    return None
+
+
+def load_forward(model_name: str, threads: int = 0, backend: str = "torch", quantize: bool = False,
+                 calibration_paths=None):
+    """指定バックエンドでCLIPを読み込み、(推論関数, デバイス, モデルタグ) を返す（失敗時はNone）
+    
+    onnx が使えない場合は torch にフォールバックする。
+    """
+    if backend == "onnx":
+        loaded = load_onnx_forward(model_name, threads, quantize, calibration_paths)
+        if loaded is not None:
+            forward, model_tag = loaded
+            return forward, "cpu", model_tag
+    return load_torch_forward(model_name, threads, quantize)
+
+
+def load_images(paths):
+    """パスのリストから画像を読み込む（戻り値: 画像, 元のインデックス, {index: エラー}）"""
+    images = []
+    slots = []
+    errors = {}
+    for i, path in enumerate(paths):
+        try:
+            if not Path(path).exists():
+                errors[i] = "File not found"
+                continue
+            images.append(open_image(path))
+            slots.append(i)
+        except Exception as e:
+            errors[i] = str(e)
+    return images, slots, errors
+
+
+def encode_results(forward, request_id, count, images, slots, errors):
+    """読み込み済みのバッチを推論し、結果をv2のバイナリフレームとして返す
+    
+    clip_daemon.py からも使う（常駐デーモンはソケットに同じフレームを返す）。
+    """
+    import numpy as np
+    
+    embeddings = [None] * count
+    if images:
+        try:
+            for slot, embedding in zip(slots, forward(images)):
+                embeddings[slot] = embedding
+        except Exception:
+            # バッチ全体が失敗した場合は1枚ずつ処理して原因の画像を特定する
+            for slot, image in zip(slots, images):
+                try:
+                    embeddings[slot] = forward([image])[0]
+                except Exception as e:
+                    errors[slot] = str(e)
+    
+    ok = [e for e in embeddings if e is not None]
+    dim = len(ok[0]) if ok else 0
+    statuses = bytes(STATUS_OK if e is not None else STATUS_ERROR for e in embeddings)
+    payload = np.stack(ok).astype('<f4').tobytes() if ok else b""
+    return encode_frame(request_id, dim, statuses, payload, errors)
+
+
+def main(threads: int = 0, backend: str = "torch", quantize: bool = False, calibration_list: str = None):
+    """メイン処理: stdinから画像パスを受け取り、特徴ベクトルを返す
+    
+    Args:
+        threads: 演算スレッド数（0=既定値。プール実行時にコアを分け合うため指定）
+        backend: 推論バックエンド（"torch" または "onnx"。onnxが使えない場合はtorch）
+        quantize: INT8量子化モデルを使う
+        calibration_list: 静的量子化のキャリブレーション画像パスを1行ずつ書いたファイル
+    """
+    import os
+    
+    # 環境情報をログ出力（デバッグ用）
+    print(json.dumps({
+        "status": "loading", 
+        "message": "Initializing worker...",
+        "python_version": sys.version,
+        "cwd": os.getcwd()
+    }), flush=True)
+    
+    try:
+        import numpy as np
+        print(json.dumps({"status": "loading", "message": "numpy loaded"}), flush=True)
+    except ImportError as e:
+        print(json.dumps({"status": "fatal", "error": f"Failed to import numpy: {e}"}), flush=True)
         return
     
-    # stdinから画像パスを1行ずつ受け取って処理
+    try:
+        from PIL import Image
+        print(json.dumps({"status": "loading", "message": "PIL loaded"}), flush=True)
+    except ImportError as e:
+        print(json.dumps({"status": "fatal", "error": f"Failed to import PIL: {e}"}), flush=True)
+        return
+    
+    model_name = "openai/clip-vit-base-patch32"
+    
+    calibration_paths = None
+    if calibration_list:
+        with open(calibration_list, "r", encoding="utf-8") as f:
+            calibration_paths = [Path(line.strip()) for line in f if line.strip()]
+    
+    loaded = load_forward(model_name, threads, backend, quantize, calibration_paths)
+    if loaded is None:
+        return
+    forward, device, model_tag = loaded
+    
+    print(json.dumps({"status": "ready", "device": device, "model_tag": model_tag}), flush=True)
+    
+    def serve_batches():
+        """v2: 読み込みスレッドで次のバッチをデコードしつつ、メインスレッドで推論する"""
+        import queue
+        import threading
+        
+        # 推論中に先読みしておくバッチ数（画像を保持するためメモリとのトレードオフ）
+        prepared = queue.Queue(maxsize=2)
+        
+        def loader():
+            while True:
+                try:
+                    line = sys.stdin.readline()
+                except Exception:
+                    break
+                if not line or line.strip() == "QUIT":
+                    break
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if request.get("op") != "batch":
+                    continue
+                paths = [str(p) for p in request.get("paths", [])]
+                images, slots, errors = load_images(paths)
+                prepared.put((int(request.get("id", 0)), len(paths), images, slots, errors))
+            prepared.put(None)
+        
+        threading.Thread(target=loader, name="BatchLoader", daemon=True).start()
+        
+        while True:
+            item = prepared.get()
+            if item is None:
+                break
+            request_id, count = item[0], item[1]
+            try:
+                frame = encode_results(forward, *item)
+            except Exception as e:
+                failed = {i: str(e) for i in range(count)}
+                frame = encode_results(forward, request_id, count, [], [], failed)
+            try:
+                sys.stdout.buffer.write(frame)
+                sys.stdout.buffer.flush()
+            except (BrokenPipeError, OSError):
+                break
+    
+    # stdinから画像パス（v1）またはバッチリクエスト（v2）を1行ずつ受け取って処理
     while True:
         try:
             line = sys.stdin.readline()
@@ -104,6 +301,12 @@ def main():
         if line == "QUIT":
             break
         
+        if HANDSHAKE is not None and line == HANDSHAKE:
+            # 以降のリクエストはバッチで受け取り、レスポンスはバイナリフレームで返す
+            print(json.dumps({"status": "protocol", "version": PROTOCOL_VERSION}), flush=True)
+            serve_batches()
+            break
+        
         try:
             image_path = Path(line)
             if not image_path.exists():
@@ -111,16 +314,7 @@ def main():
                 print(json.dumps(result), flush=True)
                 continue
             
-            image = Image.open(image_path).convert("RGB")
-            inputs = processor(images=image, return_tensors="pt").to(device)
-            
-            with torch.no_grad():
-                outputs = model.get_image_features(**inputs)
-            
-            embedding = outputs.cpu().numpy()[0]
-            norm = np.linalg.norm(embedding)
-            if norm > 1e-6:
-                embedding = embedding / norm
+            embedding = forward([open_image(image_path)])[0]
             
             # numpy配列をbase64でエンコード
             embedding_bytes = embedding.astype(np.float32).tobytes()
@@ -145,8 +339,20 @@ def main():
             print(json.dumps(result), flush=True)
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="SpectraMatch CLIP worker")
+    parser.add_argument("--threads", type=int, default=0, help="演算スレッド数")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch", help="推論バックエンド")
+    parser.add_argument("--quantize", action="store_true", help="INT8量子化モデルを使う")
+    parser.add_argument("--calibration-list", default=None, help="キャリブレーション画像の一覧ファイル")
+    args, _ = parser.parse_known_args()
     try:
-        main()
+        main(
+            threads=args.threads,
+            backend=args.backend,
+            quantize=args.quantize,
+            calibration_list=args.calibration_list
+        )
     except Exception as e:
         import traceback
         result = {"status": "fatal", "error": str(e), "traceback": traceback.format_exc()}
@@ -16,7 +16,23 @@ class ConfigManager:
         "scan_folders": [],
         "similarity_threshold": 85,
         "theme": "dark",
-        "cache_enabled": True
+        "cache_enabled": True,
+        # CLIPワーカープロセス数（1=単一プロセス、0=初回スキャン時に計測して自動決定）
+        "clip_pool_size": 1,
+        # ワーカー1つあたりのPyTorchスレッド数（0=既定値）
+        "clip_worker_threads": 0,
+        # CLIP推論バックエンド（"torch" または "onnx"）
+        "clip_backend": "torch",
+        # ビジョンエンコーダーのINT8量子化（CPU向け。埋め込みはfp32と別扱いになる）
+        "clip_quantize": False,
+        # 常駐CLIPデーモンを使う（アプリを閉じてもモデルを保持し、次回のスキャンで読み込みを省く）
+        "clip_daemon": False,
+        # 接続が無い状態でデーモンが終了するまでの分数（0=終了しない）
+        "clip_daemon_idle_minutes": 30,
+        # DBに保存する埋め込みの型（"float32" または "float16"。float16はサイズ半分）
+        "embedding_storage": "float32",
+        # 更新日時が前回と同じフォルダは一覧を取得せずDBの記録を使う（Falseで毎回全フォルダを探索）
+        "incremental_discovery": True
     }
     
     def __init__(self):
@@ -66,3 +82,61 @@ class ConfigManager:
         """類似度閾値を設定"""
         self.config["similarity_threshold"] = threshold
         self.save()
+    
+    def get_clip_pool_size(self) -> int:
+        """CLIPワーカープロセス数を取得（0=自動）"""
+        return int(self.config.get("clip_pool_size", 1))
+    
+    def get_clip_worker_threads(self) -> int:
+        """ワーカー1つあたりのPyTorchスレッド数を取得（0=既定値）"""
+        return int(self.config.get("clip_worker_threads", 0))
+    
+    def set_clip_pool(self, pool_size: int, worker_threads: int):
+        """CLIPワーカープールの構成を設定"""
+        self.config["clip_pool_size"] = pool_size
+        self.config["clip_worker_threads"] = worker_threads
+        self.save()
+    
+    def get_clip_backend(self) -> str:
+        """CLIP推論バックエンドを取得"""
+        return self.config.get("clip_backend", "torch")
+    
+    def set_clip_backend(self, backend: str):
+        """CLIP推論バックエンドを設定"""
+        self.config["clip_backend"] = backend
+        self.save()
+    
+    def get_clip_quantize(self) -> bool:
+        """INT8量子化を使うかを取得"""
+        return bool(self.config.get("clip_quantize", False))
+    
+    def set_clip_quantize(self, quantize: bool):
+        """INT8量子化を使うかを設定"""
+        self.config["clip_quantize"] = quantize
+        self.save()
+    
+    def get_clip_daemon(self) -> bool:
+        """常駐CLIPデーモンを使うかを取得"""
+        return bool(self.config.get("clip_daemon", False))
+    
+    def set_clip_daemon(self, enabled: bool):
+        """常駐CLIPデーモンを使うかを設定"""
+        self.config["clip_daemon"] = enabled
+        self.save()
+    
+    def get_clip_daemon_idle_minutes(self) -> int:
+        """常駐CLIPデーモンのアイドル終了時間（分）を取得"""
+        return max(0, int(self.config.get("clip_daemon_idle_minutes", 30)))
+    
+    def get_embedding_storage(self) -> str:
+        """DBに保存する埋め込みの型を取得"""
+        return self.config.get("embedding_storage", "float32")
+    
+    def get_incremental_discovery(self) -> bool:
+        """変更の無いフォルダの探索を省くかを取得"""
+        return bool(self.config.get("incremental_discovery", True))
+    
+    def set_incremental_discovery(self, enabled: bool):
+        """変更の無いフォルダの探索を省くかを設定"""
+        self.config["incremental_discovery"] = enabled
+        self.save()
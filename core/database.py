@@ -2,35 +2,254 @@
 """
 SpectraMatch - Database Module
 SQLiteを使用した永続化層
+
+埋め込みの保存形式（DB_VERSION 4）:
+    embedding カラムにはリトルエンディアンの float32（または float16）を連結した生バイト列を保存し、
+    embedding_dtype / embedding_dim カラムに型と次元数を記録する。読み込みは np.frombuffer で
+    バイト列をそのまま配列として扱うため、pickle の復元処理（とベクトルごとの約150バイトの
+    オーバーヘッド）が無い。float16 はサイズが半分になり、コサイン類似度の誤差は1e-3程度。
+    
+    バージョン3以前の pickle 形式の行は embedding_dtype が NULL のまま残り、起動時に
+    バックグラウンドで変換する。変換前の行は numpy 配列以外を復元しない制限付きの
+    Unpickler で読む（共有されたDBファイルから任意のオブジェクトを復元しない）。
+
+パスの保存形式（DB_VERSION 5）:
+    フォルダは directories テーブル（id, parent_id, path, mtime）に1回だけ保存し、images には
+    dir_id とファイル名だけを持たせる。directories.path は末尾に区切り文字を含むので
+    「フォルダのパス + ファイル名」が元のパスになる。読み込みはこの連結を path 列として返す
+    image_files ビューを使う。スキャン対象フォルダ以下の検索は directories.path の範囲検索になる。
+    
+    バージョン4以前の images.path は起動時にテーブルを作り直して変換し、VACUUMで領域を返す。
 """
 
+import io
+import os
 import sqlite3
 import logging
 import pickle
+import re
+import threading
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Iterator
 import numpy as np
 
+from .clip_protocol import FP32_MODEL_TAG
+from .embedding_store import EmbeddingSnapshot, EmbeddingStore
+
 logger = logging.getLogger(__name__)
 
+# 埋め込みの保存型（設定値 → リトルエンディアンのnumpy型）
+EMBEDDING_DTYPES = {
+    "float32": "<f4",
+    "float16": "<f2",
+}
+DEFAULT_EMBEDDING_DTYPE = "float32"
+
+# pickle形式の行をバックグラウンドで変換する際の1トランザクションあたりの行数
+LEGACY_CONVERSION_BATCH = 500
+
+# iter_* でDBから一度に取り出す行数（fetchmany）の既定値
+STREAM_CHUNK_SIZE = 1000
+
+# image_filesビュー（images + フォルダのパス）の列のうち埋め込み（BLOB）以外
+IMAGE_COLUMNS = (
+    "id, path, dir_id, name, file_size, last_modified, width, height, blur_score, phash, "
+    "content_hash, model_tag, embedding_dtype, embedding_dim, embedding_row, created_at, updated_at"
+)
+
+# 埋め込みストアへの追記を1トランザクションにまとめる行数
+STORE_SYNC_BATCH = 4096
+
+# 削除済み行がこの数以上かつ全体のこの割合以上になったら同期時に自動でコンパクションする
+STORE_COMPACT_MIN_ROWS = 1024
+STORE_COMPACT_RATIO = 0.5
+
+# パスの区切り文字（Windowsでは "\\" と "/"）
+PATH_SEPARATORS = tuple(sep for sep in (os.sep, os.altsep) if sep)
+
+# imagesテーブルの定義（DB_VERSION 5、移行時は別名で作ってから置き換える）
+_IMAGES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dir_id INTEGER NOT NULL REFERENCES directories(id),
+        name TEXT NOT NULL,
+        file_size INTEGER,
+        last_modified REAL,
+        width INTEGER,
+        height INTEGER,
+        blur_score REAL,
+        phash INTEGER,
+        embedding BLOB,
+        embedding_dtype TEXT,
+        embedding_dim INTEGER,
+        embedding_row INTEGER,
+        content_hash TEXT,
+        model_tag TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (dir_id, name)
+    )
+"""
+
+# パス以外で移行時にそのまま複製するimagesの列
+_IMAGE_DATA_COLUMNS = (
+    "file_size, last_modified, width, height, blur_score, phash, embedding, embedding_dtype, "
+    "embedding_dim, embedding_row, content_hash, model_tag, created_at, updated_at"
+)
+
+# 旧形式の埋め込み（pickleされたnumpy配列）の復元に必要なクラス
+_ALLOWED_PICKLE_GLOBALS = {
+    ("numpy", "ndarray"),
+    ("numpy", "dtype"),
+    ("numpy.core.multiarray", "_reconstruct"),
+    ("numpy._core.multiarray", "_reconstruct"),
+    ("numpy.core.multiarray", "scalar"),
+    ("numpy._core.multiarray", "scalar"),
+}
+
+
+class _EmbeddingUnpickler(pickle.Unpickler):
+    """numpy配列の復元に必要なクラスだけを許可するUnpickler"""
+    
+    def find_class(self, module, name):
+        if (module, name) in _ALLOWED_PICKLE_GLOBALS:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"Disallowed global in embedding blob: {module}.{name}")
+
+
+def encode_embedding(
+    embedding: np.ndarray,
+    dtype: str = DEFAULT_EMBEDDING_DTYPE
+) -> Tuple[bytes, str, int]:
+    """埋め込みを保存用の生バイト列に変換し、(blob, dtype, dim) を返す"""
+    vector = np.asarray(embedding).reshape(-1)
+    return vector.astype(EMBEDDING_DTYPES[dtype], copy=False).tobytes(), dtype, vector.size
+
+
+def decode_embedding(
+    blob: bytes,
+    dtype: Optional[str] = None,
+    dim: Optional[int] = None
+) -> np.ndarray:
+    """保存されたバイト列を float32 の埋め込みに戻す
+    
+    float32 の行はコピーせずバイト列のビュー（読み取り専用）を返す。
+    dtype が None の行は旧形式（pickle）として制限付きで復元する。
+    """
+    if dtype is None:
+        return np.asarray(_EmbeddingUnpickler(io.BytesIO(blob)).load(), dtype=np.float32).reshape(-1)
+    vector = np.frombuffer(blob, dtype=EMBEDDING_DTYPES[dtype], count=dim if dim else -1)
+    return vector.astype(np.float32, copy=False)
+
+
+def split_path(path: str) -> Tuple[str, str]:
+    """パスを (フォルダ部分（末尾の区切り文字を含む）, ファイル名) に分ける（連結すると元のパスに戻る）"""
+    path = str(path)
+    cut = max(path.rfind(sep) for sep in PATH_SEPARATORS) + 1
+    return path[:cut], path[cut:]
+
+
+def folder_range(root: str) -> Tuple[str, str]:
+    """フォルダ以下（自身を含む）の directories.path が入る範囲 [lower, upper)
+    
+    lower（末尾に区切り文字を付けたパス）で始まる文字列は、その区切り文字を1つ進めた
+    文字列 upper 未満に収まる。兄弟フォルダ（/photos と /photos2）は範囲に入らない。
+    """
+    lower = str(root).rstrip("/\\") + os.sep
+    return lower, lower[:-1] + chr(ord(os.sep) + 1)
+
+
+def ensure_directories(conn, dir_paths) -> None:
+    """フォルダとその祖先を directories に登録（登録済みなら何もしない。コミットは呼び出し側）"""
+    needed = set()
+    for path in dir_paths:
+        while path not in needed:
+            needed.add(path)
+            parent = split_path(path[:-1])[0] if path else ""
+            if not parent:
+                break
+            path = parent
+    # 親フォルダが先に登録されるよう短い順に挿入する
+    conn.executemany(
+        "INSERT OR IGNORE INTO directories (path, parent_id)"
+        " VALUES (?, (SELECT id FROM directories WHERE path = ?))",
+        [(path, split_path(path[:-1])[0] if path else "") for path in sorted(needed, key=len)]
+    )
+
+
+def embedding_from_row(row) -> Optional[np.ndarray]:
+    """imagesテーブルの行（dict / sqlite3.Row）から埋め込みを取り出す（無い・復元できなければNone）"""
+    if not row['embedding']:
+        return None
+    try:
+        return decode_embedding(row['embedding'], row['embedding_dtype'], row['embedding_dim'])
+    except Exception as e:
+        logger.warning(f"Unreadable embedding in database (id={row['id']}): {e}")
+        return None
+
 
 class ImageDatabase:
     """
     画像情報を管理するSQLiteデータベースクラス
     """
     
-    DB_VERSION = 3  # pHash復活（ハイブリッド検出用）
+    DB_VERSION = 5  # パスを directories テーブル + ファイル名に分割
     
-    def __init__(self, db_path: Optional[Path] = None):
+    # imagesテーブルへのUPSERT（パスが既存なら上書き。フォルダは ensure_directories で登録しておく）
+    _UPSERT_SQL = """
+        INSERT INTO images 
+            (dir_id, name, file_size, last_modified, width, height, blur_score, phash, embedding,
+             embedding_dtype, embedding_dim, content_hash, model_tag, updated_at)
+        VALUES ((SELECT id FROM directories WHERE path = ?), ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                CURRENT_TIMESTAMP)
+        ON CONFLICT(dir_id, name) DO UPDATE SET
+            file_size = excluded.file_size,
+            last_modified = excluded.last_modified,
+            width = excluded.width,
+            height = excluded.height,
+            blur_score = excluded.blur_score,
+            phash = excluded.phash,
+            embedding = excluded.embedding,
+            embedding_dtype = excluded.embedding_dtype,
+            embedding_dim = excluded.embedding_dim,
+            embedding_row = NULL,
+            content_hash = excluded.content_hash,
+            model_tag = excluded.model_tag,
+            updated_at = CURRENT_TIMESTAMP
+    """
+    
+    def __init__(
+        self,
+        db_path: Optional[Path] = None,
+        embedding_dtype: str = DEFAULT_EMBEDDING_DTYPE,
+        convert_legacy: bool = True
+    ):
+        """
+        Args:
+            db_path: DBファイルのパス（省略時は ~/.spectramatch/cache_v2.db）
+            embedding_dtype: 新しく保存する埋め込みの型（"float32" または "float16"）
+            convert_legacy: 旧形式（pickle）の埋め込みをバックグラウンドで変換する
+        """
         if db_path is None:
             db_dir = Path.home() / ".spectramatch"
             db_dir.mkdir(parents=True, exist_ok=True)
             db_path = db_dir / "cache_v2.db"
         
+        if embedding_dtype not in EMBEDDING_DTYPES:
+            logger.warning(f"Unknown embedding dtype {embedding_dtype!r}, using {DEFAULT_EMBEDDING_DTYPE}")
+            embedding_dtype = DEFAULT_EMBEDDING_DTYPE
+        
         self.db_path = db_path
+        self.embedding_dtype = embedding_dtype
         self.conn: Optional[sqlite3.Connection] = None
+        self._conversion_thread: Optional[threading.Thread] = None
+        self._conversion_stop = threading.Event()
+        self._embedding_stores: Dict[str, EmbeddingStore] = {}
+        self._store_lock = threading.RLock()
         self._connect()
         self._init_schema()
+        if convert_legacy and self.count_legacy_embeddings() > 0:
+            self.start_legacy_conversion()
     
     def _connect(self):
         self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
@@ -41,23 +260,19 @@ class ImageDatabase:
     def _init_schema(self):
         cursor = self.conn.cursor()
         
-        # imagesテーブル (phashを復活 - ハイブリッド検出用)
+        # フォルダ（パスは末尾に区切り文字を含む。mtime はフォルダの更新日時）
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS images (
+            CREATE TABLE IF NOT EXISTS directories (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                parent_id INTEGER REFERENCES directories(id),
                 path TEXT UNIQUE NOT NULL,
-                file_size INTEGER,
-                last_modified REAL,
-                width INTEGER,
-                height INTEGER,
-                blur_score REAL,
-                phash INTEGER,
-                embedding BLOB,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                mtime REAL
             )
         """)
         
+        # imagesテーブル (phashを復活 - ハイブリッド検出用)
+        cursor.execute(_IMAGES_TABLE_SQL.format(name="images"))
+        
         # pHashカラムが無い場合は追加（マイグレーション）
         try:
             cursor.execute("SELECT phash FROM images LIMIT 1")
@@ -65,7 +280,54 @@ class ImageDatabase:
             logger.info("Adding phash column to images table")
             cursor.execute("ALTER TABLE images ADD COLUMN phash INTEGER")
         
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_path ON images(path)")
+        # 完全一致検出用のコンテンツハッシュ（ファイル全体のMD5）
+        try:
+            cursor.execute("SELECT content_hash FROM images LIMIT 1")
+        except sqlite3.OperationalError:
+            logger.info("Adding content_hash column to images table")
+            cursor.execute("ALTER TABLE images ADD COLUMN content_hash TEXT")
+        
+        # 埋め込みを計算したモデルの種類（fp32 / INT8量子化）。既存の埋め込みは全てfp32
+        try:
+            cursor.execute("SELECT model_tag FROM images LIMIT 1")
+        except sqlite3.OperationalError:
+            logger.info("Adding model_tag column to images table")
+            cursor.execute("ALTER TABLE images ADD COLUMN model_tag TEXT")
+            cursor.execute(
+                "UPDATE images SET model_tag = ? WHERE embedding IS NOT NULL",
+                (FP32_MODEL_TAG,)
+            )
+        
+        # 埋め込みの保存型と次元数（NULLは旧形式のpickle）
+        try:
+            cursor.execute("SELECT embedding_dtype, embedding_dim FROM images LIMIT 1")
+        except sqlite3.OperationalError:
+            logger.info("Adding embedding_dtype/embedding_dim columns to images table")
+            cursor.execute("ALTER TABLE images ADD COLUMN embedding_dtype TEXT")
+            cursor.execute("ALTER TABLE images ADD COLUMN embedding_dim INTEGER")
+        
+        # 埋め込みストア（embedding_store）での行番号（NULLは未登録）
+        try:
+            cursor.execute("SELECT embedding_row FROM images LIMIT 1")
+        except sqlite3.OperationalError:
+            logger.info("Adding embedding_row column to images table")
+            cursor.execute("ALTER TABLE images ADD COLUMN embedding_row INTEGER")
+        
+        # パスの列がある（DB_VERSION 4以前）なら directories に分割
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(images)")}
+        if "path" in columns:
+            self._migrate_paths_to_directories()
+        
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_directories_parent ON directories(parent_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_file_size ON images(file_size)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_content_hash ON images(content_hash)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_embedding_row ON images(embedding_row)")
+        
+        cursor.execute("""
+            CREATE VIEW IF NOT EXISTS image_files AS
+            SELECT images.*, directories.path || images.name AS path, directories.path AS dir_path
+            FROM images JOIN directories ON directories.id = images.dir_id
+        """)
         
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS metadata (
@@ -81,108 +343,812 @@ class ImageDatabase:
         
         self.conn.commit()
     
+    def _migrate_paths_to_directories(self):
+        """images.path をフォルダ（directories）とファイル名に分割してテーブルを作り直す
+        
+        1つのトランザクションで行い、途中で失敗すれば元のテーブルのまま残る。
+        IDと埋め込みストアの行番号はそのまま引き継ぐ。
+        """
+        logger.info("Migrating images.path to the directories table")
+        conn = self.conn
+        conn.create_function("split_dir", 1, lambda path: split_path(path)[0], deterministic=True)
+        conn.create_function("split_name", 1, lambda path: split_path(path)[1], deterministic=True)
+        conn.commit()
+        
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            cursor.execute("DROP VIEW IF EXISTS image_files")
+            dir_paths = [row[0] for row in cursor.execute("SELECT DISTINCT split_dir(path) FROM images")]
+            ensure_directories(cursor, dir_paths)
+            cursor.execute(_IMAGES_TABLE_SQL.format(name="images_v5"))
+            cursor.execute(
+                f"INSERT INTO images_v5 (id, dir_id, name, {_IMAGE_DATA_COLUMNS})"
+                f" SELECT images.id, directories.id, split_name(images.path), {_IMAGE_DATA_COLUMNS}"
+                " FROM images JOIN directories ON directories.path = split_dir(images.path)"
+            )
+            migrated = cursor.rowcount
+            cursor.execute("DROP TABLE images")
+            cursor.execute("ALTER TABLE images_v5 RENAME TO images")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        
+        # 削除した旧テーブルの領域をファイルから返す
+        conn.execute("VACUUM")
+        logger.info(f"Migrated {migrated} images into {len(dir_paths)} directories")
+    
     def close(self):
+        self.stop_legacy_conversion()
+        with self._store_lock:
+            for store in self._embedding_stores.values():
+                store.close()
+            self._embedding_stores.clear()
         if self.conn:
             self.conn.close()
             self.conn = None
     
     def get_file_info(self, path: Path) -> Optional[Dict]:
         cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM images WHERE path = ?", (str(path),))
+        cursor.execute("SELECT * FROM image_files WHERE dir_path = ? AND name = ?", split_path(path))
         row = cursor.fetchone()
         return dict(row) if row else None
     
-    def is_file_changed(self, path: Path) -> bool:
+    def is_file_changed(self, path: Path, model_tag: Optional[str] = None) -> bool:
+        """ファイルが未登録・変更済みか
+        
+        Args:
+            path: ファイルパス
+            model_tag: 指定時は、埋め込みが別のモデル（fp32 / INT8）で計算されていれば変更扱い
+        """
         try:
             stat = path.stat()
-            current_mtime = stat.st_mtime
-            current_size = stat.st_size
         except OSError:
             return True
         
-        info = self.get_file_info(path)
-        if info is None:
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT file_size, last_modified, model_tag FROM image_files WHERE dir_path = ? AND name = ?",
+            split_path(path)
+        )
+        row = cursor.fetchone()
+        if row is None:
             return True
+        return self.is_entry_changed(tuple(row), stat.st_size, stat.st_mtime, model_tag)
         
-        if info['file_size'] != current_size:
+    @staticmethod
+    def is_entry_changed(
+        entry: Tuple[int, float, Optional[str]],
+        file_size: int,
+        last_modified: float,
+        model_tag: Optional[str] = None
+    ) -> bool:
+        """登録済みの (サイズ, 更新日時, モデルタグ) と現在のファイルを比較（is_file_changed と同じ判定）"""
+        db_size, db_mtime, db_tag = entry
+        if db_size != file_size:
             return True
-        if abs(info['last_modified'] - current_mtime) > 1:
+        if db_mtime is None or abs(db_mtime - last_modified) > 1:
+            return True
+        if model_tag is not None and (db_tag or FP32_MODEL_TAG) != model_tag:
             return True
-        
         return False
+        
+    def get_file_index(self, root: str) -> Dict[str, Tuple[int, float, Optional[str]]]:
+        """フォルダ以下の登録済みファイルの {パス: (サイズ, 更新日時, モデルタグ)} を取得（iter_file_index 参照）"""
+        return {path: (size, mtime, tag) for path, size, mtime, tag in self.iter_file_index(root)}
     
-    def batch_upsert(self, records: List[Dict]):
+    def iter_file_index(
+        self,
+        root: str,
+        chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> Iterator[Tuple[str, int, float, Optional[str]]]:
+        """フォルダ以下の登録済みファイルの (パス, サイズ, 更新日時, モデルタグ) を順に返す
+        
+        ファイルごとに問い合わせる代わりに、フォルダのパスの範囲検索（directories.path の
+        インデックスを使う）1回でキャッシュ確認に必要な列だけを読む。埋め込みのBLOBは読まない。
+        """
+        return self._iter_rows(
+            "SELECT path, file_size, last_modified, model_tag FROM image_files"
+            " WHERE dir_path >= ? AND dir_path < ?",
+            folder_range(root),
+            chunk_size
+        )
+    
+    def iter_directories(
+        self,
+        root: str
+    ) -> Iterator[Tuple[int, Optional[int], str, Optional[float]]]:
+        """フォルダ以下（自身を含む）の登録済みフォルダを (id, parent_id, パス, 更新日時) として順に返す"""
+        return self._iter_rows(
+            "SELECT id, parent_id, path, mtime FROM directories WHERE path >= ? AND path < ?",
+            folder_range(root),
+            STREAM_CHUNK_SIZE
+        )
+    
+    def get_directory_files(self, dir_id: int) -> List[Tuple[str, int, float]]:
+        """フォルダに登録済みのファイルを [(ファイル名, サイズ, 更新日時), ...] で取得"""
         cursor = self.conn.cursor()
-        for rec in records:
-            embedding_blob = None
-            if rec.get('embedding') is not None:
-                embedding_blob = pickle.dumps(rec['embedding'])
-            
-            cursor.execute("""
-                INSERT INTO images 
-                    (path, file_size, last_modified, width, height, blur_score, phash, embedding, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ON CONFLICT(path) DO UPDATE SET
-                    file_size = excluded.file_size,
-                    last_modified = excluded.last_modified,
-                    width = excluded.width,
-                    height = excluded.height,
-                    blur_score = excluded.blur_score,
-                    phash = excluded.phash,
-                    embedding = excluded.embedding,
-                    updated_at = CURRENT_TIMESTAMP
-            """, (
-                str(rec['path']),
-                rec.get('file_size', 0),
-                rec.get('last_modified', 0),
-                rec.get('width', 0),
-                rec.get('height', 0),
-                rec.get('blur_score', 0),
-                rec.get('phash'),
-                embedding_blob
-            ))
+        cursor.execute("SELECT name, file_size, last_modified FROM images WHERE dir_id = ?", (dir_id,))
+        return [tuple(row) for row in cursor.fetchall()]
+    
+    def set_directory_mtimes(self, mtimes: Dict[str, Optional[float]]):
+        """フォルダの更新日時を記録（キーは末尾に区切り文字を含むパス。Noneは次回の探索で必ず一覧を取得させる）"""
+        if not mtimes:
+            return
+        ensure_directories(self.conn, mtimes.keys())
+        self.conn.executemany(
+            "UPDATE directories SET mtime = ? WHERE path = ?",
+            [(mtime, path) for path, mtime in mtimes.items()]
+        )
         self.conn.commit()
     
-    def get_all_embeddings(self) -> List[Tuple[int, str, np.ndarray]]:
+    def prune_directories(self, root: str, keep) -> int:
+        """フォルダ以下の登録済みフォルダのうち keep に無く、画像も登録されていないものを削除し、件数を返す"""
+        removed = [
+            (dir_id,) for dir_id, _, dir_path, _ in list(self.iter_directories(root))
+            if dir_path not in keep
+        ]
         cursor = self.conn.cursor()
-        cursor.execute("SELECT id, path, embedding FROM images WHERE embedding IS NOT NULL")
+        cursor.executemany(
+            "DELETE FROM directories WHERE id = ?"
+            " AND NOT EXISTS (SELECT 1 FROM images WHERE dir_id = directories.id)",
+            removed
+        )
+        self.conn.commit()
+        return cursor.rowcount
+    
+    def batch_upsert(self, records: List[Dict]):
+        self._write_records(self.conn, records)
+        self.conn.commit()
+    
+    def _write_records(self, conn: sqlite3.Connection, records: List[Dict]):
+        """フォルダを登録してからレコードをUPSERT（コミットは呼び出し側。DatabaseWriterは自分の接続を渡す）"""
+        params = [self._upsert_params(rec) for rec in records]
+        ensure_directories(conn, {param[0] for param in params})
+        conn.executemany(self._UPSERT_SQL, params)
+            
+    def _upsert_params(self, rec: Dict) -> tuple:
+        """レコード（dict）を _UPSERT_SQL のパラメータに変換（埋め込みは保存形式にエンコード）"""
+        embedding_blob, embedding_dtype, embedding_dim = None, None, None
+        if rec.get('embedding') is not None:
+            embedding_blob, embedding_dtype, embedding_dim = encode_embedding(
+                rec['embedding'], self.embedding_dtype
+            )
+        
+        return (
+            *split_path(rec['path']),
+            rec.get('file_size', 0),
+            rec.get('last_modified', 0),
+            rec.get('width', 0),
+            rec.get('height', 0),
+            rec.get('blur_score', 0),
+            rec.get('phash'),
+            embedding_blob,
+            embedding_dtype,
+            embedding_dim,
+            rec.get('content_hash'),
+            rec.get('model_tag', FP32_MODEL_TAG) if embedding_blob is not None else None
+        )
+    
+    def get_files_by_sizes(self, sizes: List[int]) -> List[Dict]:
+        """指定サイズのいずれかに一致する登録済みファイルを取得（完全一致検出用）
+        
+        Returns:
+            [{'path', 'file_size', 'content_hash', 'has_embedding', 'model_tag'}, ...]
+        """
+        if not sizes:
+            return []
+        
+        cursor = self.conn.cursor()
+        BATCH_SIZE = 999
         result = []
-        for row in cursor.fetchall():
-            if row['embedding']:
-                embedding = pickle.loads(row['embedding'])
-                result.append((row['id'], row['path'], embedding))
+        for i in range(0, len(sizes), BATCH_SIZE):
+            batch = sizes[i:i + BATCH_SIZE]
+            placeholders = ','.join(['?' for _ in batch])
+            cursor.execute(f"""
+                SELECT path, file_size, content_hash, embedding IS NOT NULL AS has_embedding,
+                       model_tag
+                FROM image_files WHERE file_size IN ({placeholders})
+            """, batch)
+            result.extend(dict(row) for row in cursor.fetchall())
         return result
     
-    def get_all_embeddings_with_phash(self) -> List[Tuple[int, str, np.ndarray, Optional[int]]]:
-        """CLIP埋め込みとpHashを両方取得（ハイブリッド検出用）"""
+    def update_content_hashes(self, hashes: List[Tuple[str, str]]):
+        """登録済みファイルのコンテンツハッシュを保存
+        
+        Args:
+            hashes: [(path, content_hash), ...]
+        """
+        if not hashes:
+            return
         cursor = self.conn.cursor()
-        cursor.execute("SELECT id, path, embedding, phash FROM images WHERE embedding IS NOT NULL")
-        result = []
+        cursor.executemany(
+            "UPDATE images SET content_hash = ?"
+            " WHERE dir_id = (SELECT id FROM directories WHERE path = ?) AND name = ?",
+            [(h, *split_path(p)) for p, h in hashes]
+        )
+        self.conn.commit()
+    
+    def clone_features(self, source_path: str, targets: List[Dict]) -> int:
+        """バイト単位で同一のファイルに、元ファイルの解析結果（埋め込み・各種指標）を複製
+        
+        Args:
+            source_path: 解析済みの元ファイルパス
+            targets: [{'path', 'file_size', 'last_modified', 'content_hash'}, ...]
+        
+        Returns:
+            複製したレコード数（元ファイルが未登録の場合は0）
+        """
+        if not targets:
+            return 0
+        
+        source = self.get_image_by_path(str(source_path))
+        if source is None or source.get('embedding') is None:
+            return 0
+        
+        params = [
+            (
+                *split_path(target['path']),
+                target.get('file_size', 0),
+                target.get('last_modified', 0),
+                source['width'],
+                source['height'],
+                source['blur_score'],
+                source['phash'],
+                source['embedding'],
+                source['embedding_dtype'],
+                source['embedding_dim'],
+                target.get('content_hash') or source['content_hash'],
+                source['model_tag']
+            )
+            for target in targets
+        ]
+        ensure_directories(self.conn, {param[0] for param in params})
+        self.conn.executemany(self._UPSERT_SQL, params)
+        self.conn.commit()
+        return len(targets)
+    
+    def get_exact_duplicate_groups(self, path_prefix: str = "") -> List[List[Dict]]:
+        """コンテンツハッシュが一致するファイルのグループを取得
+        
+        Args:
+            path_prefix: このフォルダ以下のファイルのみ対象（スキャン対象フォルダ、空なら全て）
+        
+        Returns:
+            グループ（パス順のレコードのリスト）のリスト
+        """
+        scope_sql, params = "", ()
+        if path_prefix:
+            scope_sql, params = " AND dir_path >= ? AND dir_path < ?", folder_range(path_prefix)
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            SELECT id, path, file_size, width, height, blur_score, phash, content_hash
+            FROM image_files
+            WHERE content_hash IN (
+                SELECT content_hash FROM image_files
+                WHERE content_hash IS NOT NULL{scope_sql}
+                GROUP BY content_hash HAVING COUNT(*) > 1
+            ){scope_sql}
+            ORDER BY content_hash, path
+        """, params * 2)
+        
+        groups: List[List[Dict]] = []
+        current_hash = None
         for row in cursor.fetchall():
-            if row['embedding']:
-                embedding = pickle.loads(row['embedding'])
-                result.append((row['id'], row['path'], embedding, row['phash']))
-        return result
+            if row['content_hash'] != current_hash:
+                groups.append([])
+                current_hash = row['content_hash']
+            groups[-1].append(dict(row))
+        return groups
+    
+    def get_all_embeddings(self, model_tag: Optional[str] = None) -> List[Tuple[int, str, np.ndarray]]:
+        """CLIP埋め込みを取得（model_tag指定時はそのモデルで計算したもののみ）"""
+        return list(self.iter_embeddings(model_tag))
+    
+    def iter_embeddings(
+        self,
+        model_tag: Optional[str] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> Iterator[Tuple[int, str, np.ndarray]]:
+        """CLIP埋め込みを (id, path, embedding) として順に返す（get_all_embeddings のジェネレーター版）"""
+        rows = self._iter_rows(
+            "SELECT id, path, embedding, embedding_dtype, embedding_dim FROM image_files"
+            " WHERE embedding IS NOT NULL" + self._model_tag_filter(model_tag),
+            () if model_tag is None else (model_tag,),
+            chunk_size
+        )
+        for row in rows:
+            embedding = embedding_from_row(row)
+            if embedding is not None:
+                yield row['id'], row['path'], embedding
+    
+    def get_all_embeddings_with_phash(
+        self,
+        model_tag: Optional[str] = None
+    ) -> List[Tuple[int, str, np.ndarray, Optional[int]]]:
+        """CLIP埋め込みとpHashを両方取得（ハイブリッド検出用、model_tagはget_all_embeddingsと同じ）"""
+        return list(self.iter_embeddings_with_phash(model_tag))
+    
+    def iter_embeddings_with_phash(
+        self,
+        model_tag: Optional[str] = None,
+        chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> Iterator[Tuple[int, str, np.ndarray, Optional[int]]]:
+        """CLIP埋め込みとpHashを (id, path, embedding, phash) として順に返す"""
+        rows = self._iter_rows(
+            "SELECT id, path, embedding, embedding_dtype, embedding_dim, phash FROM image_files"
+            " WHERE embedding IS NOT NULL" + self._model_tag_filter(model_tag),
+            () if model_tag is None else (model_tag,),
+            chunk_size
+        )
+        for row in rows:
+            embedding = embedding_from_row(row)
+            if embedding is not None:
+                yield row['id'], row['path'], embedding, row['phash']
+    
+    def iter_embedding_blocks(
+        self,
+        model_tag: Optional[str] = None,
+        block_rows: int = STREAM_CHUNK_SIZE
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """CLIP埋め込みを (ids, (n, dim) float32 行列) のブロックとして順に返す
+        
+        ブロックごとに行列を1つ確保して各行のバイト列を直接書き込む。
+        次元数が最初の埋め込みと異なる行は除外する（get_embedding_matrix と同じ扱い）。
+        """
+        block_ids: List[int] = []
+        block: Optional[np.ndarray] = None
+        dim = None
+        for row_id, _, embedding in self.iter_embeddings(model_tag, block_rows):
+            if dim is None:
+                dim = embedding.size
+            if embedding.size != dim:
+                continue
+            if block is None:
+                block = np.empty((block_rows, dim), dtype=np.float32)
+            block[len(block_ids)] = embedding
+            block_ids.append(row_id)
+            if len(block_ids) == block_rows:
+                yield np.array(block_ids, dtype=np.int64), block
+                block_ids, block = [], None
+        if block_ids:
+            yield np.array(block_ids, dtype=np.int64), block[:len(block_ids)]
+    
+    def get_embedding_matrix(
+        self,
+        model_tag: Optional[str] = None
+    ) -> Tuple[List[int], List[str], np.ndarray]:
+        """CLIP埋め込みを1つの (N, dim) float32 行列として取得
+        
+        行列は最初に1回だけ確保し、各行のバイト列を np.frombuffer のビューから直接書き込む
+        （ベクトルごとの配列を作って np.stack する必要が無い）。
+        次元数が多数派と異なる行（別モデルの残骸など）は除外する。
+        
+        Returns:
+            (ids, paths, matrix)。埋め込みが無ければ matrix は (0, 0)
+        """
+        cursor = self.conn.cursor()
+        filter_sql = self._model_tag_filter(model_tag)
+        params = () if model_tag is None else (model_tag,)
+        cursor.execute(
+            "SELECT embedding_dim, COUNT(*) FROM images WHERE embedding IS NOT NULL"
+            " AND embedding_dim IS NOT NULL" + filter_sql
+            + " GROUP BY embedding_dim ORDER BY COUNT(*) DESC LIMIT 1",
+            params
+        )
+        row = cursor.fetchone()
+        dim = row[0] if row else None
+        cursor.execute(
+            "SELECT COUNT(*) FROM images WHERE embedding IS NOT NULL" + filter_sql, params
+        )
+        capacity = cursor.fetchone()[0]
+        
+        ids: List[int] = []
+        paths: List[str] = []
+        matrix: Optional[np.ndarray] = None
+        if dim is not None:
+            matrix = np.empty((capacity, dim), dtype=np.float32)
+        
+        cursor.execute(
+            "SELECT id, path, embedding, embedding_dtype, embedding_dim FROM image_files"
+            " WHERE embedding IS NOT NULL" + filter_sql,
+            params
+        )
+        for row in cursor:
+            blob, dtype = row['embedding'], row['embedding_dtype']
+            if not blob:
+                continue
+            if dtype is None:
+                # 変換前の旧形式の行
+                vector = embedding_from_row(row)
+                if vector is None:
+                    continue
+            else:
+                vector = np.frombuffer(blob, dtype=EMBEDDING_DTYPES[dtype])
+            if matrix is None:
+                dim = vector.size
+                matrix = np.empty((capacity, dim), dtype=np.float32)
+            if vector.size != dim or len(ids) >= capacity:
+                continue
+            matrix[len(ids)] = vector
+            ids.append(row['id'])
+            paths.append(row['path'])
+        
+        if matrix is None:
+            return [], [], np.empty((0, 0), dtype=np.float32)
+        return ids, paths, matrix[:len(ids)]
+    
+    @property
+    def embedding_store_dir(self) -> Path:
+        """埋め込みストアのファイルを置くフォルダ（DBファイルと同じ場所）"""
+        return Path(self.db_path).parent / f"{Path(self.db_path).stem}_embeddings"
+    
+    def load_embedding_snapshot(self, model_tag: Optional[str] = None) -> EmbeddingSnapshot:
+        """埋め込みストアを同期し、グループ化用のスナップショットを返す
+        
+        ベクトルはストアのmemmapを参照するだけでコピーしない。DBから読むのは
+        id・パス・pHash・行番号のみ（埋め込みのBLOBは読まない）。
+        model_tag を省略した場合はfp32の埋め込みを対象にする。
+        """
+        model_tag = model_tag or FP32_MODEL_TAG
+        with self._store_lock:
+            store = self.sync_embedding_store(model_tag)
+            if store is None:
+                return EmbeddingSnapshot()
+            
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT id, path, phash, embedding_row FROM image_files"
+                " WHERE embedding_row IS NOT NULL AND embedding IS NOT NULL"
+                + self._model_tag_filter(model_tag) + " ORDER BY embedding_row",
+                (model_tag,)
+            )
+            snapshot = EmbeddingSnapshot(matrix=store.matrix())
+            rows = []
+            for row_id, path, phash, embedding_row in cursor:
+                snapshot.ids.append(row_id)
+                snapshot.paths.append(path)
+                snapshot.phashes.append(phash)
+                rows.append(embedding_row)
+            snapshot.rows = np.array(rows, dtype=np.int64)
+            return snapshot
+    
+    def sync_embedding_store(self, model_tag: str = FP32_MODEL_TAG) -> Optional[EmbeddingStore]:
+        """DBの埋め込みをストアに反映し、ストアを返す（埋め込みが1件も無ければNone）
+        
+        1. ストアの範囲外を指す行番号（ストアが消えた・切り詰められた場合）を解除
+        2. 行番号の無い埋め込みをストアに追記して行番号を記録
+        3. どの画像からも参照されない行を削除済みとして記録（必要ならコンパクション）
+        """
+        with self._store_lock:
+            store = self._open_embedding_store(model_tag)
+            filter_sql = self._model_tag_filter(model_tag)
+            cursor = self.conn.cursor()
+            
+            cursor.execute(
+                "UPDATE images SET embedding_row = NULL WHERE embedding_row >= ?" + filter_sql,
+                (store.rows if store else 0, model_tag)
+            )
+            if cursor.rowcount:
+                logger.warning(f"Embedding store for {model_tag} lost {cursor.rowcount} rows, rebuilding them")
+            self.conn.commit()
+            
+            appended = 0
+            skipped = 0
+            last_id = 0
+            while True:
+                rows = cursor.execute(
+                    "SELECT id, embedding, embedding_dtype, embedding_dim FROM images"
+                    " WHERE id > ? AND embedding IS NOT NULL AND embedding_row IS NULL" + filter_sql
+                    + " ORDER BY id LIMIT ?",
+                    (last_id, model_tag, STORE_SYNC_BATCH)
+                ).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1]['id']
+                
+                ids = []
+                vectors = []
+                for row in rows:
+                    vector = embedding_from_row(row)
+                    if vector is None:
+                        continue
+                    if store is None:
+                        store = self._create_embedding_store(model_tag, vector.size)
+                    if vector.size != store.dim:
+                        skipped += 1
+                        continue
+                    ids.append(row['id'])
+                    vectors.append(vector)
+                if not vectors:
+                    continue
+                
+                first = store.append(np.stack(vectors))
+                cursor.executemany(
+                    "UPDATE images SET embedding_row = ? WHERE id = ?",
+                    [(first + i, row_id) for i, row_id in enumerate(ids)]
+                )
+                self.conn.commit()
+                appended += len(ids)
+            
+            if store is None:
+                return None
+            if appended or skipped:
+                logger.info(
+                    f"Embedding store ({model_tag}): appended {appended} vectors"
+                    + (f", skipped {skipped} with a different dim" if skipped else "")
+                )
+            
+            cursor.execute(
+                "SELECT embedding_row FROM images WHERE embedding_row IS NOT NULL" + filter_sql,
+                (model_tag,)
+            )
+            store.set_live_rows(np.fromiter((row[0] for row in cursor), dtype=np.int64))
+            
+            if store.deleted_count >= max(STORE_COMPACT_MIN_ROWS, store.rows * STORE_COMPACT_RATIO):
+                store = self.compact_embedding_store(model_tag) or store
+            return store
+    
+    def compact_embedding_store(self, model_tag: str = FP32_MODEL_TAG) -> Optional[EmbeddingStore]:
+        """削除済み行を詰めた新しい世代のストアを作り、行番号を振り直す
+        
+        新しいファイルを書き終えてから、行番号と世代番号を1つのトランザクションで更新する。
+        途中で落ちても古い世代のファイルと行番号の組はそのまま残る。
+        """
+        with self._store_lock:
+            store = self._open_embedding_store(model_tag)
+            if store is None:
+                return None
+            
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT id, embedding_row FROM images WHERE embedding_row IS NOT NULL"
+                " AND embedding_row < ?" + self._model_tag_filter(model_tag) + " ORDER BY embedding_row",
+                (store.rows, model_tag)
+            )
+            refs = cursor.fetchall()
+            keep_rows = np.array([row[1] for row in refs], dtype=np.int64)
+            
+            generation = self._store_generation(model_tag) + 1
+            compacted = store.compact_to(self._store_path(model_tag, generation), keep_rows)
+            
+            # 途中でスキャンが行を書き換えていた場合（行番号がNULLに戻っている）は更新しない
+            cursor.executemany(
+                "UPDATE images SET embedding_row = ? WHERE id = ? AND embedding_row = ?",
+                [(new_row, row_id, old_row) for new_row, (row_id, old_row) in enumerate(refs)]
+            )
+            cursor.execute(
+                "INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                (f"embedding_store:{model_tag}", str(generation))
+            )
+            self.conn.commit()
+            
+            logger.info(
+                f"Compacted embedding store ({model_tag}): {store.rows} -> {compacted.rows} rows"
+            )
+            store.delete_files()
+            self._embedding_stores[model_tag] = compacted
+            return compacted
+    
+    def compact_embedding_stores(self) -> int:
+        """全てのモデルタグのストアをコンパクションし、削除した行数の合計を返す"""
+        removed = 0
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT key FROM metadata WHERE key LIKE 'embedding_store:%'")
+        for (key,) in cursor.fetchall():
+            model_tag = key.split(":", 1)[1]
+            store = self.sync_embedding_store(model_tag)
+            if store is None or store.deleted_count == 0:
+                continue
+            before = store.rows
+            compacted = self.compact_embedding_store(model_tag)
+            removed += before - compacted.rows
+        return removed
+    
+    def _store_generation(self, model_tag: str) -> int:
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT value FROM metadata WHERE key = ?", (f"embedding_store:{model_tag}",))
+        row = cursor.fetchone()
+        return int(row[0]) if row else 0
+    
+    def _store_path(self, model_tag: str, generation: int) -> Path:
+        safe_tag = re.sub(r"[^A-Za-z0-9_-]", "_", model_tag)
+        return self.embedding_store_dir / f"{safe_tag}.{generation}.npy"
+    
+    def _open_embedding_store(self, model_tag: str) -> Optional[EmbeddingStore]:
+        """現在の世代のストアを開く（無い・壊れている場合はNone）。古い世代のファイルは削除する"""
+        store = self._embedding_stores.get(model_tag)
+        if store is not None:
+            return store
+        
+        path = self._store_path(model_tag, self._store_generation(model_tag))
+        safe_tag = path.name.split(".", 1)[0]
+        for other in self.embedding_store_dir.glob(f"{safe_tag}.*"):
+            if other.name.split(".")[1] != path.name.split(".")[1]:
+                try:
+                    other.unlink()
+                except OSError:
+                    pass
+        
+        if not path.exists():
+            return None
+        try:
+            store = EmbeddingStore(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Discarding unreadable embedding store {path}: {e}")
+            for broken in (path, path.with_suffix(".tomb")):
+                try:
+                    broken.unlink()
+                except OSError:
+                    pass
+            return None
+        self._embedding_stores[model_tag] = store
+        return store
+    
+    def _create_embedding_store(self, model_tag: str, dim: int) -> EmbeddingStore:
+        """新しい世代の空のストアを作る"""
+        generation = self._store_generation(model_tag) + 1
+        store = EmbeddingStore(self._store_path(model_tag, generation), dim)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+            (f"embedding_store:{model_tag}", str(generation))
+        )
+        self.conn.commit()
+        self._embedding_stores[model_tag] = store
+        return store
+    
+    def count_legacy_embeddings(self) -> int:
+        """旧形式（pickle）のまま残っている埋め込みの数"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT COUNT(*) FROM images WHERE embedding IS NOT NULL AND embedding_dtype IS NULL"
+        )
+        return cursor.fetchone()[0]
+    
+    def start_legacy_conversion(self):
+        """旧形式の埋め込みの変換をバックグラウンドスレッドで開始"""
+        if self._conversion_thread is not None and self._conversion_thread.is_alive():
+            return
+        self._conversion_stop.clear()
+        self._conversion_thread = threading.Thread(
+            target=self.convert_legacy_embeddings,
+            name="EmbeddingConversion",
+            daemon=True
+        )
+        self._conversion_thread.start()
+    
+    def stop_legacy_conversion(self, timeout: float = 10.0):
+        """バックグラウンド変換を止める（変換済みのバッチはコミット済み）"""
+        if self._conversion_thread is None:
+            return
+        self._conversion_stop.set()
+        self._conversion_thread.join(timeout=timeout)
+        self._conversion_thread = None
+    
+    def wait_for_legacy_conversion(self, timeout: Optional[float] = None) -> bool:
+        """バックグラウンド変換の完了を待つ（完了していればTrue）"""
+        thread = self._conversion_thread
+        if thread is not None:
+            thread.join(timeout=timeout)
+            return not thread.is_alive()
+        return True
+    
+    def convert_legacy_embeddings(self, batch_size: int = LEGACY_CONVERSION_BATCH) -> int:
+        """旧形式（pickle）の埋め込みを生バイト列に変換し、変換した行数を返す
+        
+        スキャンと並行して動かせるよう専用の接続を使い、batch_size行ごとにコミットする。
+        復元できない行（numpy配列以外を含むpickleなど）は埋め込みを削除し、次回のスキャンで再計算させる。
+        """
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        converted = 0
+        failed = 0
+        last_id = 0
+        try:
+            while not self._conversion_stop.is_set():
+                rows = conn.execute(
+                    "SELECT id, embedding FROM images"
+                    " WHERE id > ? AND embedding IS NOT NULL AND embedding_dtype IS NULL"
+                    " ORDER BY id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                
+                updates = []
+                broken = []
+                for row_id, blob in rows:
+                    last_id = row_id
+                    try:
+                        updates.append((*encode_embedding(decode_embedding(blob), self.embedding_dtype), row_id))
+                    except Exception as e:
+                        logger.warning(f"Dropping unreadable legacy embedding (id={row_id}): {e}")
+                        broken.append((row_id,))
+                
+                # スキャンが同じ行を新形式で書き直していた場合は上書きしない
+                conn.executemany(
+                    "UPDATE images SET embedding = ?, embedding_dtype = ?, embedding_dim = ?"
+                    " WHERE id = ? AND embedding_dtype IS NULL",
+                    updates
+                )
+                conn.executemany(
+                    "UPDATE images SET embedding = NULL, model_tag = NULL, embedding_row = NULL"
+                    " WHERE id = ? AND embedding_dtype IS NULL",
+                    broken
+                )
+                conn.commit()
+                converted += len(updates)
+                failed += len(broken)
+        except sqlite3.Error as e:
+            logger.error(f"Legacy embedding conversion failed: {e}")
+        finally:
+            conn.close()
+        
+        if converted or failed:
+            logger.info(f"Converted {converted} legacy embeddings to {self.embedding_dtype} ({failed} dropped)")
+        return converted
+    
+    @staticmethod
+    def _model_tag_filter(model_tag: Optional[str]) -> str:
+        """model_tagで絞り込むWHERE条件（タグ未設定の古い行はfp32として扱う）"""
+        if model_tag is None:
+            return ""
+        return f" AND COALESCE(model_tag, '{FP32_MODEL_TAG}') = ?"
     
     def get_all_phashes(self) -> List[Tuple[int, str, int]]:
         """全てのpHashを取得"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT id, path, phash FROM images WHERE phash IS NOT NULL")
-        result = []
-        for row in cursor.fetchall():
-            result.append((row['id'], row['path'], row['phash']))
-        return result
+        return list(self.iter_phashes())
+    
+    def iter_phashes(self, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[Tuple[int, str, int]]:
+        """pHashを (id, path, phash) として順に返す"""
+        return self._iter_rows(
+            "SELECT id, path, phash FROM image_files WHERE phash IS NOT NULL", (), chunk_size
+        )
     
     def get_image_by_path(self, path: str) -> Optional[Dict]:
         cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM images WHERE path = ?", (path,))
+        cursor.execute("SELECT * FROM image_files WHERE dir_path = ? AND name = ?", split_path(path))
         row = cursor.fetchone()
         return dict(row) if row else None
     
-    def get_all_images(self) -> List[Dict]:
+    def get_images_by_ids(self, ids: List[int]) -> Dict[int, Dict]:
+        """指定IDの画像の行（埋め込みのBLOBを除く）を {id: dict} で取得
+        
+        グループの表示用。1件ずつ問い合わせる代わりに、SQLiteのパラメータ制限に合わせて
+        分割した IN 句でまとめて読む。
+        """
+        if not ids:
+            return {}
+        
         cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM images ORDER BY blur_score ASC")
-        return [dict(row) for row in cursor.fetchall()]
+        BATCH_SIZE = 999
+        ids = list(dict.fromkeys(int(i) for i in ids))
+        result = {}
+        for i in range(0, len(ids), BATCH_SIZE):
+            batch = ids[i:i + BATCH_SIZE]
+            placeholders = ','.join(['?' for _ in batch])
+            cursor.execute(f"SELECT {IMAGE_COLUMNS} FROM image_files WHERE id IN ({placeholders})", batch)
+            for row in cursor.fetchall():
+                result[row['id']] = dict(row)
+        return result
+    
+    def get_all_images(self) -> List[Dict]:
+        return list(self.iter_images(with_embedding=True))
+    
+    def iter_images(
+        self,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+        with_embedding: bool = False
+    ) -> Iterator[Dict]:
+        """全画像の行をブレスコア順（昇順）に dict として順に返す
+        
+        Args:
+            chunk_size: 一度にDBから取り出す行数
+            with_embedding: Falseなら埋め込みのBLOBを読まない（一覧表示用）
+        """
+        columns = "*" if with_embedding else IMAGE_COLUMNS
+        for row in self._iter_rows(f"SELECT {columns} FROM image_files ORDER BY blur_score ASC", (), chunk_size):
+            yield dict(row)
 
     def count_images(self) -> int:
         cursor = self.conn.cursor()
@@ -192,16 +1158,49 @@ class ImageDatabase:
     def clear_all(self):
         cursor = self.conn.cursor()
         cursor.execute("DELETE FROM images")
+        cursor.execute("DELETE FROM directories")
+        cursor.execute("DELETE FROM metadata WHERE key LIKE 'embedding_store:%'")
         self.conn.commit()
+        
+        # 埋め込みストアも空にする
+        with self._store_lock:
+            for store in self._embedding_stores.values():
+                store.delete_files()
+            self._embedding_stores.clear()
+            for path in self.embedding_store_dir.glob("*.*"):
+                try:
+                    path.unlink()
+                except OSError as e:
+                    logger.warning(f"Could not remove embedding store file {path}: {e}")
     
     def vacuum(self):
         self.conn.execute("VACUUM")
     
     def get_all_paths(self) -> List[str]:
         """DBに登録されている全ての画像パスを取得"""
+        return list(self.iter_paths())
+    
+    def iter_paths(self, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+        """DBに登録されている画像パスを順に返す"""
+        for row in self._iter_rows("SELECT path FROM image_files", (), chunk_size):
+            yield row[0]
+    
+    def _iter_rows(self, sql: str, params: tuple, chunk_size: int) -> Iterator[sqlite3.Row]:
+        """クエリ結果を chunk_size 行ずつ fetchmany して1行ずつ返す
+        
+        専用のカーソルを使うため、途中で他のクエリを実行してもよい。
+        ただし読み終わる前に同じテーブルを書き換えた場合、変更した行が結果に含まれるかは不定。
+        """
         cursor = self.conn.cursor()
-        cursor.execute("SELECT path FROM images")
-        return [row[0] for row in cursor.fetchall()]
+        cursor.execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(max(1, chunk_size))
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
     
     def delete_by_paths(self, paths: List[str]) -> int:
         """指定されたパスのレコードを一括削除
@@ -216,15 +1215,11 @@ class ImageDatabase:
             return 0
         
         cursor = self.conn.cursor()
-        # SQLiteのパラメータ制限に注意して分割処理
-        BATCH_SIZE = 999
-        deleted_count = 0
-        
-        for i in range(0, len(paths), BATCH_SIZE):
-            batch = paths[i:i + BATCH_SIZE]
-            placeholders = ','.join(['?' for _ in batch])
-            cursor.execute(f"DELETE FROM images WHERE path IN ({placeholders})", batch)
-            deleted_count += cursor.rowcount
+        cursor.executemany(
+            "DELETE FROM images WHERE dir_id = (SELECT id FROM directories WHERE path = ?) AND name = ?",
+            [split_path(path) for path in paths]
+        )
+        deleted_count = cursor.rowcount
         
         self.conn.commit()
         logger.info(f"Deleted {deleted_count} stale records from database")
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - Database Writer Module
+スキャン結果のDB保存を専用スレッドで行うライター
+
+ImageDatabase.batch_upsert をスキャンスレッドで呼ぶと、SQLiteの書き込みとコミット
+（fsync）の間はCLIPの結果回収と次バッチの送信が止まる。ライターは自分の接続を持つ
+スレッドでキューからレコードを受け取り、行数または経過時間の上限に達するまで溜めてから
+1回の executemany + コミットで書き込む。
+
+WALモードのため、書き込み中もメインの接続からの読み込みはブロックされない。
+コミット前のレコードは他の接続から見えないので、DBを読む処理（完全一致の複製元の取得、
+類似度分析など）の前に flush() を呼ぶこと。
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from queue import Empty, Queue
+from typing import Dict, List, Optional
+
+from .database import ImageDatabase
+
+logger = logging.getLogger(__name__)
+
+
+# 1トランザクションにまとめる最大行数と、最初のレコードを受け取ってからコミットまでの最大秒数
+FLUSH_ROWS = 2000
+FLUSH_INTERVAL = 1.0
+
+# キューに溜められるバッチ数（書き込みが追いつかない場合は put が待つ）
+MAX_QUEUED_BATCHES = 64
+
+# 他の接続が書き込み中の場合に待つ秒数
+BUSY_TIMEOUT = 30.0
+
+_CLOSE = object()
+
+
+class DatabaseWriter:
+    """
+    ImageDatabase への書き込みを専用スレッドでまとめて行うライター
+    
+    使い方:
+        writer = DatabaseWriter(db)
+        writer.put(records)     # すぐ戻る（書き込みはライタースレッドで行う）
+        writer.flush()          # ここまでに put したレコードのコミットを待つ
+        writer.close()          # 残りを書き込んでスレッドと接続を閉じる
+    
+    レコードの形式は batch_upsert と同じ。書き込みに失敗したレコード数は failed_records に数える。
+    """
+    
+    def __init__(
+        self,
+        db: ImageDatabase,
+        flush_rows: int = FLUSH_ROWS,
+        flush_interval: float = FLUSH_INTERVAL
+    ):
+        self.db = db
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = flush_interval
+        self.written_records = 0
+        self.failed_records = 0
+        self.transactions = 0
+        
+        self._queue: Queue = Queue(maxsize=MAX_QUEUED_BATCHES)
+        self._closed = False
+        self._conn = sqlite3.connect(str(db.db_path), timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._thread = threading.Thread(target=self._run, name="DatabaseWriter", daemon=True)
+        self._thread.start()
+    
+    @property
+    def closed(self) -> bool:
+        return self._closed
+    
+    def put(self, records: List[Dict]):
+        """レコードを書き込みキューに積む"""
+        if self._closed:
+            raise RuntimeError("DatabaseWriter is closed")
+        if records:
+            self._queue.put(list(records))
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """ここまでに put したレコードが全てコミットされるまで待つ（時間内に終わればTrue）"""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+    
+    def close(self):
+        """残りのレコードを書き込み、スレッドと接続を閉じる（複数回呼んでもよい）"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self._conn.close()
+        logger.info(
+            f"Database writer closed: {self.written_records} records in {self.transactions} transactions"
+            + (f", {self.failed_records} failed" if self.failed_records else "")
+        )
+    
+    def _run(self):
+        """キューからレコードを受け取り、まとめて書き込む（ライタースレッド本体）"""
+        pending: List[Dict] = []
+        waiters: List[threading.Event] = []
+        deadline: Optional[float] = None
+        closing = False
+        
+        while not closing:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Empty:
+                item = None
+            
+            if item is _CLOSE:
+                closing = True
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item:
+                pending.extend(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            
+            if pending and (
+                closing or waiters
+                or len(pending) >= self.flush_rows
+                or time.monotonic() >= deadline
+            ):
+                self._write(pending)
+                pending = []
+                deadline = None
+            
+            for waiter in waiters:
+                waiter.set()
+            waiters = []
+    
+    def _write(self, records: List[Dict]):
+        """1トランザクションで書き込む"""
+        try:
+            self.db._write_records(self._conn, records)
+            self._conn.commit()
+            self.written_records += len(records)
+            self.transactions += 1
+        except Exception as e:
+            logger.error(f"Database writer failed to save {len(records)} records: {e}")
+            self._conn.rollback()
+            self.failed_records += len(records)
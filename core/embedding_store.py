@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - Embedding Store Module
+CLIP埋め込みをメモリマップした行列ファイルに保持するストア
+
+グループ化のたびにSQLiteから全行を読み、Pythonのリストから np.stack で行列を作ると、
+100万枚では検索インデックスに渡す前に約2GBの一時領域が必要になる。ストアは埋め込みを
+追記専用の float32 行列ファイルに保存し、np.memmap でコピーせずに参照する。
+
+ファイル（モデルタグごと、ImageDatabase が <DB名>_embeddings/ 以下に置く）:
+    <tag>.<世代>.npy   float32 (rows, dim) の .npy 形式（L2正規化済み）。ヘッダは HEADER_SIZE バイト
+                       固定で、追記のたびに shape だけ書き換える。np.load(mmap_mode='r') でも読める
+    <tag>.<世代>.tomb  削除済み行のビットマップ（np.packbits、bitorder='little'）
+
+SQLite側の images.embedding_row が行番号を持つ。どの画像からも参照されない行（削除・再計算された
+画像の古い埋め込み）は同期時に削除済みとして記録し、コンパクションで詰める。
+埋め込みの正本はSQLiteのBLOBで、ストアはいつでも作り直せる派生データとして扱う。
+"""
+
+import logging
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# .npy ヘッダの固定長（マジック + バージョン + 長さ + 辞書。64の倍数）
+HEADER_SIZE = 128
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+STORE_DTYPE = np.dtype("<f4")
+
+# 検索インデックスへの追加・検索を分割する行数（削除済み行を除く場合の一時コピーの上限）
+BLOCK_ROWS = 65536
+
+
+def _encode_header(rows: int, dim: int) -> bytes:
+    """shape を (rows, dim) とした固定長の .npy v1.0 ヘッダ"""
+    body = "{'descr': '%s', 'fortran_order': False, 'shape': (%d, %d), }" % (STORE_DTYPE.str, rows, dim)
+    body = body.ljust(HEADER_SIZE - len(NPY_MAGIC) - 3) + "\n"
+    return NPY_MAGIC + len(body).to_bytes(2, "little") + body.encode("latin1")
+
+
+def _read_header(path: Path):
+    """ファイルのヘッダから (rows, dim) を読む（形式が違えばValueError）"""
+    with open(path, "rb") as f:
+        np.lib.format.read_magic(f)
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        if f.tell() != HEADER_SIZE or fortran_order or dtype != STORE_DTYPE or len(shape) != 2:
+            raise ValueError(f"Unexpected embedding store header: {path}")
+    return shape
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """行ごとにL2正規化した float32 の行列を返す"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 1e-12, norms, 1.0)
+
+
+class EmbeddingStore:
+    """
+    追記専用の埋め込み行列ファイル（1つのモデルタグ分）
+    
+    使い方:
+        store = EmbeddingStore(path, dim=512)   # 無ければ作成
+        first_row = store.append(vectors)       # 追記した先頭の行番号
+        matrix = store.matrix()                 # (rows, dim) 読み取り専用のmemmap
+    
+    同じファイルを複数のインスタンス・プロセスから同時に書き込んではいけない。
+    """
+    
+    def __init__(self, path: Path, dim: Optional[int] = None):
+        self.path = path
+        self.tomb_path = path.with_suffix(".tomb")
+        self._matrix: Optional[np.ndarray] = None
+        
+        if path.exists():
+            rows, self.dim = _read_header(path)
+            if dim is not None and dim != self.dim:
+                raise ValueError(f"Embedding store {path} has dim {self.dim}, expected {dim}")
+            self.rows = self._recover(rows)
+        else:
+            if dim is None:
+                raise FileNotFoundError(path)
+            self.dim = dim
+            self.rows = 0
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(_encode_header(0, dim))
+        
+        self._deleted = self._load_tombstones()
+    
+    @property
+    def row_bytes(self) -> int:
+        return self.dim * STORE_DTYPE.itemsize
+    
+    @property
+    def deleted_count(self) -> int:
+        return int(self._deleted.sum())
+    
+    @property
+    def live_count(self) -> int:
+        return self.rows - self.deleted_count
+    
+    def matrix(self) -> np.ndarray:
+        """全行（削除済みを含む）を読み取り専用のmemmapとして返す"""
+        if self.rows == 0:
+            return np.empty((0, self.dim), dtype=STORE_DTYPE)
+        if self._matrix is None or len(self._matrix) != self.rows:
+            self._matrix = np.memmap(
+                self.path, dtype=STORE_DTYPE, mode="r", offset=HEADER_SIZE, shape=(self.rows, self.dim)
+            )
+        return self._matrix
+    
+    def append(self, vectors: np.ndarray) -> int:
+        """ベクトルを正規化して末尾に追記し、先頭の行番号を返す
+        
+        データを書いて同期してからヘッダの行数を更新するため、途中で落ちても
+        ヘッダが指す範囲は常に書き込み済み（余分な末尾は次に開いたときに切り詰める）。
+        """
+        vectors = normalize_rows(vectors).astype(STORE_DTYPE, copy=False)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected (n, {self.dim}) vectors, got {vectors.shape}")
+        first = self.rows
+        if len(vectors) == 0:
+            return first
+        
+        with open(self.path, "r+b") as f:
+            f.seek(HEADER_SIZE + first * self.row_bytes)
+            f.write(np.ascontiguousarray(vectors).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+            f.seek(0)
+            f.write(_encode_header(first + len(vectors), self.dim))
+            f.flush()
+            os.fsync(f.fileno())
+        
+        self.rows += len(vectors)
+        self._deleted = np.concatenate([self._deleted, np.zeros(len(vectors), dtype=bool)])
+        return first
+    
+    def set_live_rows(self, live_rows: np.ndarray):
+        """live_rows 以外の行を削除済みとして記録（変化があればビットマップを保存）"""
+        deleted = np.ones(self.rows, dtype=bool)
+        live_rows = np.asarray(live_rows, dtype=np.int64)
+        deleted[live_rows[(live_rows >= 0) & (live_rows < self.rows)]] = False
+        if np.array_equal(deleted, self._deleted):
+            return
+        self._deleted = deleted
+        temp_path = self.tomb_path.with_suffix(".tomb.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(np.packbits(deleted, bitorder="little").tobytes())
+        os.replace(temp_path, self.tomb_path)
+    
+    def compact_to(self, path: Path, keep_rows: np.ndarray) -> "EmbeddingStore":
+        """keep_rows の行だけを順に詰めた新しいストアを path に作る（新しい行番号 = keep_rows 内の位置）"""
+        keep_rows = np.asarray(keep_rows, dtype=np.int64)
+        source = self.matrix()
+        temp_path = path.with_suffix(".npy.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(_encode_header(len(keep_rows), self.dim))
+            for start in range(0, len(keep_rows), BLOCK_ROWS):
+                f.write(np.ascontiguousarray(source[keep_rows[start:start + BLOCK_ROWS]]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        return EmbeddingStore(path)
+    
+    def close(self):
+        """memmapの参照を手放す（取得済みのスナップショットは引き続き使える）"""
+        self._matrix = None
+    
+    def delete_files(self):
+        """ストアのファイルを削除（Windowsで使用中なら次回の起動時に掃除される）"""
+        self.close()
+        for path in (self.path, self.tomb_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove embedding store file {path}: {e}")
+    
+    def _recover(self, rows: int) -> int:
+        """ヘッダ更新前に落ちた追記の残骸を切り詰め、実際に読める行数を返す"""
+        size = self.path.stat().st_size
+        available = max(0, size - HEADER_SIZE) // self.row_bytes
+        if available < rows:
+            logger.warning(f"Embedding store {self.path} is truncated ({available}/{rows} rows)")
+            rows = available
+            with open(self.path, "r+b") as f:
+                f.write(_encode_header(rows, self.dim))
+        if size > HEADER_SIZE + rows * self.row_bytes:
+            with open(self.path, "r+b") as f:
+                f.truncate(HEADER_SIZE + rows * self.row_bytes)
+        return rows
+    
+    def _load_tombstones(self) -> np.ndarray:
+        try:
+            packed = np.fromfile(self.tomb_path, dtype=np.uint8)
+        except (FileNotFoundError, OSError):
+            return np.zeros(self.rows, dtype=bool)
+        deleted = np.unpackbits(packed, bitorder="little")[:self.rows].astype(bool)
+        # 後から追記された行はビットマップに無いので生存扱い
+        return np.concatenate([deleted, np.zeros(self.rows - len(deleted), dtype=bool)])
+
+
+@dataclass
+class EmbeddingSnapshot:
+    """
+    グループ化に使う埋め込みの一覧（ストアの行列を参照し、ベクトルはコピーしない）
+    
+    i番目の画像（ids[i], paths[i], phashes[i]）の埋め込みは matrix[rows[i]]。
+    rows は昇順なので、削除済み行が無ければ vectors() は matrix のビューになる。
+    """
+    ids: List[int] = field(default_factory=list)
+    paths: List[str] = field(default_factory=list)
+    phashes: List[Optional[int]] = field(default_factory=list)
+    rows: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    matrix: np.ndarray = field(default_factory=lambda: np.empty((0, 0), dtype=STORE_DTYPE))
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+    
+    def vectors(self) -> np.ndarray:
+        """全画像の埋め込み (N, dim)。行が連続していればコピーしない"""
+        return self._select(self.rows)
+    
+    def iter_blocks(self, block_rows: int = BLOCK_ROWS) -> Iterator[np.ndarray]:
+        """埋め込みを block_rows 行ずつ返す（連続した範囲はビュー、それ以外はそのブロックだけコピー）"""
+        for start in range(0, len(self.rows), block_rows):
+            yield self._select(self.rows[start:start + block_rows])
+    
+    def _select(self, rows: np.ndarray) -> np.ndarray:
+        if len(rows) == 0:
+            return self.matrix[:0]
+        first, last = int(rows[0]), int(rows[-1])
+        if last - first + 1 == len(rows):
+            return self.matrix[first:last + 1]
+        return self.matrix[rows]
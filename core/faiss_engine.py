@@ -5,9 +5,12 @@ Faissによる高速類似検索エンジン (CLIP専用)
 """
 
 import logging
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 import numpy as np
 
+from .embedding_store import EmbeddingSnapshot
+from .hamming import as_uint64, hamming_distance, hamming_pairs
+
 logger = logging.getLogger(__name__)
 
 # Faiss遅延インポート
@@ -95,32 +98,59 @@ class FaissSearchEngine:
         self.clip_ids = []
 
 
+def _search_input(
+    data: Union[List[tuple], EmbeddingSnapshot]
+) -> Tuple[List[int], List[str], Callable[[], Iterator[np.ndarray]]]:
+    """リスト形式のデータまたはEmbeddingSnapshotから (ids, paths, 正規化済み埋め込みのブロック列) を取り出す
+    
+    EmbeddingSnapshot はストアのmemmapをブロック単位で渡すため、全体をコピーした行列は作らない。
+    """
+    if isinstance(data, EmbeddingSnapshot):
+        return data.ids, data.paths, data.iter_blocks
+    
+    ids = [item[0] for item in data]
+    paths = [item[1] for item in data]
+    embeddings = np.stack([item[2] for item in data], axis=0).astype(np.float32)
+    _faiss.normalize_L2(embeddings)
+    return ids, paths, lambda: iter([embeddings])
+
+
+def _knn_search(blocks: Callable[[], Iterator[np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """内積インデックスを作り、全ベクトルのk近傍を返す（インデックスへの追加と検索はブロックごと）"""
+    index = None
+    for block in blocks():
+        if index is None:
+            # IndexFlatIP: 内積による検索（正規化済みなのでコサイン類似度）
+            index = _faiss.IndexFlatIP(block.shape[1])
+        index.add(np.ascontiguousarray(block, dtype=np.float32))
+    
+    similarities = []
+    indices = []
+    for block in blocks():
+        sims, idx = index.search(np.ascontiguousarray(block, dtype=np.float32), k)
+        similarities.append(sims)
+        indices.append(idx)
+    return np.vstack(similarities), np.vstack(indices)
+
+
 def find_similar_groups_faiss_clip(
-    clip_data: List[Tuple[int, str, np.ndarray]],
+    clip_data: Union[List[Tuple[int, str, np.ndarray]], EmbeddingSnapshot],
     threshold: float = 0.85
 ) -> List[List[Tuple[int, str, float]]]:
     """
     Faissを使用したCLIP類似グループ検出（連鎖防止版）
+    
+    clip_data は [(id, path, embedding), ...] またはDBの埋め込みストアのスナップショット
     """
     if not _check_faiss_available() or len(clip_data) < 2:
         return []
     
     n = len(clip_data)
-    ids = [item[0] for item in clip_data]
-    paths = [item[1] for item in clip_data]
-    embeddings = np.stack([item[2] for item in clip_data], axis=0).astype(np.float32)
-    
-    # 正規化
-    _faiss.normalize_L2(embeddings)
-    
-    # インデックス構築
-    dim = embeddings.shape[1]
-    index = _faiss.IndexFlatIP(dim)
-    index.add(embeddings)
+    ids, paths, blocks = _search_input(clip_data)
     
     # k近傍検索
     k = min(21, n)
-    similarities, indices = index.search(embeddings, k)
+    similarities, indices = _knn_search(blocks, k)
     
     # 各画像の直接類似画像を収集
     direct_neighbors: Dict[int, List[Tuple[int, float]]] = {}
@@ -200,13 +230,63 @@ def find_similar_groups_faiss_clip(
 
 def compute_phash_distance(hash1: int, hash2: int) -> int:
     """2つのpHashのハミング距離を計算（符号付き整数対応）"""
-    # 負の値は64ビットのビットパターンとして扱う
-    xor = (hash1 ^ hash2) & 0xFFFFFFFFFFFFFFFF
-    return bin(xor).count('1')
+    return hamming_distance(hash1, hash2)
+
+
+def _filter_hybrid_neighbors(
+    similarities: np.ndarray,
+    indices: np.ndarray,
+    phashes: List[Optional[int]],
+    clip_threshold: float,
+    max_phash_distance: int,
+    require_both: bool
+) -> Dict[int, List[Tuple[int, float]]]:
+    """
+    kNN候補ペア全体にCLIP/pHash条件を一括適用し、各画像の直接類似画像を返す
+    
+    Args:
+        similarities, indices: Faiss検索結果（n x k、先頭列は自分自身）
+        phashes: 各画像のpHash（Noneの可能性あり）
+    
+    Returns:
+        {画像インデックス: [(近傍インデックス, CLIP類似度), ...]}（類似度順）
+    """
+    n = indices.shape[0]
+    neighbors = indices[:, 1:]
+    clip_sims = similarities[:, 1:]
+    
+    valid = (neighbors >= 0) & (neighbors != np.arange(n)[:, np.newaxis])
+    safe_neighbors = np.where(valid, neighbors, 0)
+    
+    # CLIP類似度チェック
+    clip_ok = clip_sims >= clip_threshold
+    
+    # pHash類似度チェック（全候補ペアのハミング距離を一括計算）
+    has_phash = np.array([p is not None for p in phashes], dtype=bool)
+    phash_values = as_uint64([p if p is not None else 0 for p in phashes])
+    distances = hamming_pairs(phash_values[:, np.newaxis], phash_values[safe_neighbors])
+    both_have_phash = has_phash[:, np.newaxis] & has_phash[safe_neighbors]
+    # pHashがない場合はCLIPのみで判断
+    phash_ok = np.where(both_have_phash, distances <= max_phash_distance, not require_both)
+    
+    # ハイブリッド判定
+    if require_both:
+        is_similar = clip_ok & phash_ok
+    else:
+        is_similar = clip_ok | phash_ok
+    is_similar &= valid
+    
+    direct_neighbors: Dict[int, List[Tuple[int, float]]] = {}
+    for i in np.flatnonzero(is_similar.any(axis=1)):
+        cols = np.flatnonzero(is_similar[i])
+        direct_neighbors[int(i)] = [
+            (int(neighbors[i, c]), float(clip_sims[i, c])) for c in cols
+        ]
+    return direct_neighbors
 
 
 def find_similar_groups_hybrid(
-    data: List[Tuple[int, str, np.ndarray, Optional[int]]],
+    data: Union[List[Tuple[int, str, np.ndarray, Optional[int]]], EmbeddingSnapshot],
     clip_threshold: float = 0.85,
     phash_threshold: float = 0.85,
     require_both: bool = True
@@ -215,7 +295,7 @@ def find_similar_groups_hybrid(
     CLIP + pHash ハイブリッド類似グループ検出
     
     Args:
-        data: [(id, path, embedding, phash), ...] のリスト
+        data: [(id, path, embedding, phash), ...] のリスト、またはDBの埋め込みストアのスナップショット
         clip_threshold: CLIP類似度の閾値 (0.0-1.0)
         phash_threshold: pHash類似度の閾値 (0.0-1.0)、ハミング距離から変換
         require_both: Trueの場合、CLIPとpHash両方の閾値を満たす必要がある
@@ -228,63 +308,26 @@ def find_similar_groups_hybrid(
         return []
     
     n = len(data)
-    ids = [item[0] for item in data]
-    paths = [item[1] for item in data]
-    embeddings = np.stack([item[2] for item in data], axis=0).astype(np.float32)
-    phashes = [item[3] for item in data]  # Noneの可能性あり
+    ids, paths, blocks = _search_input(data)
+    if isinstance(data, EmbeddingSnapshot):
+        phashes = data.phashes
+    else:
+        phashes = [item[3] for item in data]  # Noneの可能性あり
     
     # pHashの最大ハミング距離を計算（閾値から逆算）
     max_phash_distance = int((1.0 - phash_threshold) * 64)
     
     logger.info(f"Hybrid detection: CLIP threshold={clip_threshold}, pHash threshold={phash_threshold} (max distance={max_phash_distance})")
     
-    # CLIP埋め込みを正規化
-    _faiss.normalize_L2(embeddings)
-    
-    # FAISSインデックス構築
-    dim = embeddings.shape[1]
-    index = _faiss.IndexFlatIP(dim)
-    index.add(embeddings)
-    
     # k近傍検索
     k = min(21, n)
-    similarities, indices = index.search(embeddings, k)
-    
-    # ハイブリッドフィルタリング: CLIPとpHash両方でチェック
-    direct_neighbors: Dict[int, List[Tuple[int, float]]] = {}
+    similarities, indices = _knn_search(blocks, k)
     
-    for i in range(n):
-        neighbors = []
-        for j_idx in range(1, k):
-            j = indices[i, j_idx]
-            clip_sim = similarities[i, j_idx]
-            
-            if j < 0 or j == i:
-                continue
-            
-            # CLIP類似度チェック
-            clip_ok = clip_sim >= clip_threshold
-            
-            # pHash類似度チェック
-            phash_ok = False
-            if phashes[i] is not None and phashes[j] is not None:
-                distance = compute_phash_distance(phashes[i], phashes[j])
-                phash_ok = distance <= max_phash_distance
-            else:
-                # pHashがない場合はCLIPのみで判断
-                phash_ok = True if not require_both else False
-            
-            # ハイブリッド判定
-            if require_both:
-                is_similar = clip_ok and phash_ok
-            else:
-                is_similar = clip_ok or phash_ok
-            
-            if is_similar:
-                neighbors.append((j, float(clip_sim)))
-        
-        if neighbors:
-            direct_neighbors[i] = neighbors
+    # ハイブリッドフィルタリング: CLIPとpHash両方でチェック（全候補ペアを一括評価）
+    direct_neighbors = _filter_hybrid_neighbors(
+        similarities, indices, phashes,
+        clip_threshold, max_phash_distance, require_both
+    )
     
     if not direct_neighbors:
         logger.info("No similar pairs found with hybrid detection")
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - Feature Pipeline Module
+1回のデコードで鮮明度・pHash・CLIP入力を全て用意する特徴抽出パイプライン
+
+従来は1ファイルにつき鮮明度(cv2)・pHash(cv2)・CLIP(PIL)で計3回デコードしていた。
+このモジュールではファイルを1回だけデコードし、派生画像
+（分析用グレースケール、pHash用サムネイル、CLIP用縮小RGB）を各処理で共有する。
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+import cv2
+
+from .hasher import ImageHasher, to_gray
+
+logger = logging.getLogger(__name__)
+
+
+# CLIP用に保持する縮小RGBの短辺サイズ
+# CLIPProcessorは短辺224pxへリサイズするため、その2倍を残せば画質劣化はほぼ無い
+CLIP_PREFETCH_SIZE = 448
+
+# 従来方式で1ファイルあたりに行っていたデコード回数（鮮明度 + pHash + CLIP）
+LEGACY_DECODES_PER_FILE = 3
+
+
+@dataclass
+class DecodedImage:
+    """
+    1回のデコード結果から派生させた画像データ
+    
+    Attributes:
+        path: ファイルパス
+        width: 元画像の幅（ピクセル）
+        height: 元画像の高さ（ピクセル）
+        analysis_gray: 鮮明度分析用グレースケール（長辺ANALYSIS_SIZE以下）
+        phash_gray: pHash用グレースケールサムネイル（32x32）
+        clip_rgb: CLIP前処理用のRGB画像（短辺CLIP_PREFETCH_SIZE以下）
+    """
+    path: Path
+    width: int
+    height: int
+    analysis_gray: np.ndarray
+    phash_gray: np.ndarray
+    clip_rgb: Optional[np.ndarray] = None
+
+
+@dataclass
+class StageTimings:
+    """スキャン各段階の累積処理時間（秒）"""
+    decode: float = 0.0
+    sharpness: float = 0.0
+    phash: float = 0.0
+    clip: float = 0.0
+    decoded_files: int = 0
+    # CLIPリクエストの送信から結果受信までの合計（逐次処理なら全て待ち時間になる）
+    clip_round_trip: float = 0.0
+    clip_images: int = 0
+    # 特徴抽出ループ全体の経過時間（パイプライン化による重なりを含む実時間）
+    elapsed: float = 0.0
+    # 共有により置き換えたデコード回数（CLIPが自前でデコードする場合は2）
+    shared_decodes: int = LEGACY_DECODES_PER_FILE
+    
+    @property
+    def saved_decode_seconds(self) -> float:
+        """
+        デコード共有により削減できた時間の推定値
+        
+        1回あたりのデコード時間 × 省略したデコード回数で概算する。
+        """
+        return self.decode * (self.shared_decodes - 1)
+    
+    @property
+    def serial_seconds(self) -> float:
+        """デコードとCLIP推論を重ねずに逐次実行した場合の所要時間の推定値"""
+        return self.decode + self.sharpness + self.phash + self.clip_round_trip
+    
+    @property
+    def throughput(self) -> float:
+        """実測のCLIP処理スループット（枚/秒）"""
+        return self.clip_images / self.elapsed if self.elapsed > 0 else 0.0
+    
+    @property
+    def serial_throughput(self) -> float:
+        """パイプライン化しなかった場合のスループット推定値（枚/秒）"""
+        serial = self.serial_seconds
+        return self.clip_images / serial if serial > 0 else 0.0
+    
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            'decode': self.decode,
+            'sharpness': self.sharpness,
+            'phash': self.phash,
+            'clip': self.clip,
+            'decoded_files': self.decoded_files,
+            'saved_decode': self.saved_decode_seconds,
+            'clip_round_trip': self.clip_round_trip,
+            'clip_images': self.clip_images,
+            'elapsed': self.elapsed,
+            'throughput': self.throughput,
+            'serial_throughput': self.serial_throughput,
+        }
+    
+    def summary(self) -> str:
+        """ログ出力用の段階別内訳"""
+        return (
+            f"decode={self.decode:.2f}s ({self.decoded_files} files), "
+            f"sharpness={self.sharpness:.2f}s, phash={self.phash:.2f}s, "
+            f"clip={self.clip:.2f}s (round trip {self.clip_round_trip:.2f}s), "
+            f"decode saved~{self.saved_decode_seconds:.2f}s, "
+            f"throughput={self.throughput:.1f} img/s (serial~{self.serial_throughput:.1f} img/s)"
+        )
+
+
+class FeaturePipeline:
+    """
+    デコード1回で全特徴量を抽出するパイプライン
+    
+    使い方:
+        decoded = pipeline.decode(path)
+        features = pipeline.extract(decoded)   # blur_score, phash, width, height
+        embeddings = clip_engine.extract_embeddings_batch(paths, images=[decoded.clip_rgb])
+    
+    decode / extract は複数スレッドから同時に呼び出してよい（計測値はロックで集計）。
+    """
+    
+    def __init__(self, hasher: Optional[ImageHasher] = None, keep_clip_rgb: bool = True):
+        self.hasher = hasher or ImageHasher()
+        self.keep_clip_rgb = keep_clip_rgb
+        self.timings = StageTimings()
+        self._timings_lock = threading.Lock()
+    
+    def reset_timings(self):
+        self.timings = StageTimings(
+            shared_decodes=LEGACY_DECODES_PER_FILE if self.keep_clip_rgb else LEGACY_DECODES_PER_FILE - 1
+        )
+    
+    def decode(self, file_path: Path) -> Optional[DecodedImage]:
+        """ファイルを1回だけデコードし、各処理用の派生画像を作成"""
+        start = time.perf_counter()
+        try:
+            # 全ての派生画像を賄える最小解像度でデコード（JPEGは縮小デコード）
+            phash_size = self.hasher.PHASH_SIZE * self.hasher.PHASH_HIGHFREQ_FACTOR
+            min_short_side = CLIP_PREFETCH_SIZE if self.keep_clip_rgb else phash_size
+            img, width, height = self.hasher.load_image(
+                file_path,
+                min_long_side=self.hasher.ANALYSIS_SIZE * self.hasher.ANALYSIS_DECODE_MARGIN,
+                min_short_side=min_short_side
+            )
+            if img is None:
+                return None
+            
+            gray = to_gray(img)
+            analysis_gray = self.hasher.prepare_analysis_gray(gray)
+            phash_gray = self.hasher.prepare_phash_gray(gray)
+            del gray
+            
+            clip_rgb = None
+            if self.keep_clip_rgb:
+                clip_rgb = self._prepare_clip_rgb(img)
+            del img
+            
+            with self._timings_lock:
+                self.timings.decoded_files += 1
+            return DecodedImage(
+                path=file_path,
+                width=width,
+                height=height,
+                analysis_gray=analysis_gray,
+                phash_gray=phash_gray,
+                clip_rgb=clip_rgb
+            )
+        except Exception as e:
+            logger.error(f"[Pipeline] デコードエラー: {file_path} - {e}")
+            return None
+        finally:
+            self._add_time('decode', time.perf_counter() - start)
+    
+    def extract(self, decoded: DecodedImage, include_phash: bool = True) -> Dict:
+        """デコード済み画像から鮮明度とpHashを計算
+        
+        Args:
+            decoded: decode() の結果
+            include_phash: Falseの場合pHashは計算しない（compute_phashesで一括計算する場合）
+        """
+        start = time.perf_counter()
+        try:
+            sharpness = self.hasher.compute_sharpness_from_gray(decoded.analysis_gray)
+        except Exception as e:
+            logger.error(f"[Sharpness] 例外: {decoded.path} - {e}")
+            sharpness = 0.0
+        self._add_time('sharpness', time.perf_counter() - start)
+        
+        phash = None
+        if include_phash:
+            phash = self.compute_phashes([decoded.phash_gray])[0]
+        
+        return {
+            'width': decoded.width,
+            'height': decoded.height,
+            'blur_score': sharpness,
+            'phash': phash
+        }
+    
+    def compute_phashes(self, thumbs: List[np.ndarray]) -> List[Optional[int]]:
+        """pHash用サムネイルをまとめてハッシュ化（失敗時は全てNone）"""
+        if not thumbs:
+            return []
+        start = time.perf_counter()
+        try:
+            return self.hasher.compute_phash_batch(np.stack(thumbs)).tolist()
+        except Exception as e:
+            logger.error(f"[pHash] バッチ計算エラー: {e}")
+            return [None] * len(thumbs)
+        finally:
+            self._add_time('phash', time.perf_counter() - start)
+    
+    def add_clip_time(self, seconds: float):
+        self._add_time('clip', seconds)
+    
+    def add_clip_round_trip(self, seconds: float, images: int):
+        with self._timings_lock:
+            self.timings.clip_round_trip += seconds
+            self.timings.clip_images += images
+    
+    def _add_time(self, stage: str, seconds: float):
+        with self._timings_lock:
+            setattr(self.timings, stage, getattr(self.timings, stage) + seconds)
+    
+    @staticmethod
+    def _prepare_clip_rgb(img: np.ndarray) -> np.ndarray:
+        """CLIP前処理用に縮小したRGB画像を作成"""
+        if len(img.shape) == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        h, w = img.shape[:2]
+        short_side = min(h, w)
+        if short_side > CLIP_PREFETCH_SIZE:
+            scale = CLIP_PREFETCH_SIZE / short_side
+            new_w = max(1, round(w * scale))
+            new_h = max(1, round(h * scale))
+            img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - Hamming Distance Module
+64ビットpHashのハミング距離をNumPyで一括計算するカーネル
+
+pHashはSQLiteの都合で符号付き64ビット整数として保存されているため、
+ここでは全てuint64のビットパターンとして扱う。
+NumPy 2.0以降では np.bitwise_count を、それ以前はバイト単位の参照テーブルを使う。
+"""
+
+from typing import Iterable, Union
+import numpy as np
+
+# NumPy 2.0+ のハードウェアpopcount
+_HAS_BITWISE_COUNT = hasattr(np, "bitwise_count")
+
+# 0-255 の各バイト値に含まれる1ビットの数
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+HashArrayLike = Union[np.ndarray, Iterable[int]]
+
+
+def as_uint64(hashes: HashArrayLike) -> np.ndarray:
+    """pHash（符号付き/符号なし64ビット整数）をuint64配列に変換"""
+    if isinstance(hashes, np.ndarray):
+        if hashes.dtype == np.uint64:
+            return hashes
+        if hashes.dtype == np.int64:
+            return hashes.view(np.uint64)
+        return hashes.astype(np.int64).view(np.uint64)
+    return np.array([int(h) & _MASK64 for h in hashes], dtype=np.uint64)
+
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """uint64配列の各要素の1ビット数を数える（結果はuint8、形状は入力と同じ）"""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if _HAS_BITWISE_COUNT:
+        return np.bitwise_count(values)
+    as_bytes = values.view(np.uint8).reshape(values.shape + (8,))
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    """2つのpHashのハミング距離（スカラー版）"""
+    # 負の値は64ビットのビットパターンとして扱う
+    xor = (hash1 ^ hash2) & _MASK64
+    return bin(xor).count("1")
+
+
+def hamming_pairs(a: HashArrayLike, b: HashArrayLike) -> np.ndarray:
+    """要素ごとのハミング距離（a, bはブロードキャスト可能な形状）"""
+    return popcount64(np.bitwise_xor(as_uint64(a), as_uint64(b)))
+
+
+def hamming_one_to_many(query: int, hashes: HashArrayLike) -> np.ndarray:
+    """1つのpHashと複数のpHashのハミング距離"""
+    return popcount64(np.bitwise_xor(as_uint64(hashes), np.uint64(int(query) & _MASK64)))
+
+
+def hamming_many_to_many(a: HashArrayLike, b: HashArrayLike) -> np.ndarray:
+    """全組み合わせのハミング距離行列（len(a) x len(b)）"""
+    a = as_uint64(a)
+    b = as_uint64(b)
+    return popcount64(np.bitwise_xor(a[:, np.newaxis], b[np.newaxis, :]))
@@ -6,13 +6,33 @@ SpectraMatch - Image Hasher Module
 
 import hashlib
 import logging
+import math
 from pathlib import Path
 from typing import Optional, Tuple
 import numpy as np
 import cv2
 
+# clip_worker.py から（clip_preprocess経由で）直接importされる場合もある
+try:
+    from .hamming import hamming_distance
+except ImportError:
+    from hamming import hamming_distance
+
 logger = logging.getLogger(__name__)
 
+# JPEGの縮小デコード（libjpegのDCTスケーリング）で使えるフラグ（縮小率の大きい順）
+REDUCED_COLOR_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# JPEGのSOFマーカー（画像サイズを含むフレームヘッダ）
+_JPEG_SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF
+}
+
 
 def imread_unicode(file_path: Path) -> Optional[np.ndarray]:
     """
@@ -32,6 +52,117 @@ def imread_unicode(file_path: Path) -> Optional[np.ndarray]:
         return None
 
 
+def read_jpeg_size(data) -> Optional[Tuple[int, int]]:
+    """
+    JPEGヘッダ（SOFマーカー）から画像サイズを読み取る（デコードなし）
+    
+    Returns:
+        (幅, 高さ)、JPEGでない・解析できない場合はNone
+    """
+    buf = memoryview(data)
+    size = len(buf)
+    if size < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        return None
+    
+    pos = 2
+    while pos + 4 <= size:
+        if buf[pos] != 0xFF:
+            return None
+        marker = buf[pos + 1]
+        if marker == 0xFF:  # パディング
+            pos += 1
+            continue
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:  # 長さを持たないマーカー
+            pos += 2
+            continue
+        seg_len = (buf[pos + 2] << 8) | buf[pos + 3]
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 9 > size:
+                return None
+            height = (buf[pos + 5] << 8) | buf[pos + 6]
+            width = (buf[pos + 7] << 8) | buf[pos + 8]
+            return width, height
+        if marker == 0xDA:  # SOS以降は画像データ
+            return None
+        pos += 2 + seg_len
+    return None
+
+
+def choose_reduced_scale(
+    width: int,
+    height: int,
+    min_long_side: int = 0,
+    min_short_side: int = 0
+) -> int:
+    """
+    目標サイズを下回らない最大の縮小率（1, 2, 4, 8）を選ぶ
+    
+    libjpegの縮小デコードは各辺を ceil(辺 / 縮小率) にする。
+    """
+    for scale, _ in REDUCED_COLOR_FLAGS:
+        long_side = math.ceil(max(width, height) / scale)
+        short_side = math.ceil(min(width, height) / scale)
+        if long_side >= min_long_side and short_side >= min_short_side:
+            return scale
+    return 1
+
+
+def imread_reduced(
+    file_path: Path,
+    min_long_side: int = 0,
+    min_short_side: int = 0
+) -> Tuple[Optional[np.ndarray], int, int]:
+    """
+    目標サイズを満たす最小の解像度でデコードする（JPEGのみ縮小デコード）
+    
+    JPEGはlibjpegのDCTスケーリング（IMREAD_REDUCED_*）で1/2〜1/8のまま
+    デコードするため、フル解像度のIDCTと巨大な一時バッファを省略できる。
+    JPEG以外の形式は通常どおりフル解像度でデコードする。
+    
+    Args:
+        file_path: 画像パス
+        min_long_side: デコード結果の長辺の下限（ピクセル）
+        min_short_side: デコード結果の短辺の下限（ピクセル）
+    
+    Returns:
+        (画像, 元画像の幅, 元画像の高さ)、失敗時は (None, 0, 0)
+    """
+    try:
+        stream = np.fromfile(str(file_path), dtype=np.uint8)
+        if stream is None or len(stream) == 0:
+            return None, 0, 0
+        
+        jpeg_size = read_jpeg_size(stream)
+        if jpeg_size is not None:
+            width, height = jpeg_size
+            scale = choose_reduced_scale(width, height, min_long_side, min_short_side)
+            if scale > 1:
+                flag = dict(REDUCED_COLOR_FLAGS)[scale]
+                img = cv2.imdecode(stream, flag)
+                if img is not None:
+                    # EXIFの回転が適用された場合は縦横を合わせる
+                    img_h, img_w = img.shape[:2]
+                    if (img_h > img_w) != (height > width) and img_h != img_w:
+                        width, height = height, width
+                    return img, width, height
+        
+        img = cv2.imdecode(stream, cv2.IMREAD_COLOR)
+        if img is None:
+            return None, 0, 0
+        height, width = img.shape[:2]
+        return img, width, height
+    except Exception as e:
+        logger.error(f"[Load] 例外: {file_path} - {e}")
+        return None, 0, 0
+
+
+def to_gray(img: np.ndarray) -> np.ndarray:
+    """BGR画像をグレースケールに変換（既にグレースケールならそのまま返す）"""
+    if len(img.shape) == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img
+
+
 class ImageHasher:
     """
     画像情報抽出クラス
@@ -39,14 +170,47 @@ class ImageHasher:
     
     # 先頭バイト読み込みサイズ
     QUICK_HASH_BYTES = 4096  # 4KB
+    # 全体ハッシュの読み込み単位
+    CONTENT_HASH_CHUNK = 1024 * 1024  # 1MB
     
     # pHash設定
     PHASH_SIZE = 8  # 8x8 = 64ビットハッシュ
     PHASH_HIGHFREQ_FACTOR = 4  # DCT用の高周波係数
     
-    def __init__(self):
-        """ImageHasherの初期化"""
-        pass
+    # 鮮明度分析用サイズ（長辺）
+    ANALYSIS_SIZE = 500
+    # 縮小デコード時に分析用サイズに対して確保する余裕（倍率）
+    # DCTスケーリングとINTER_AREAの差でLaplacian分散がずれるのを抑える
+    ANALYSIS_DECODE_MARGIN = 2
+    
+    def __init__(self, reduced_decode: bool = True):
+        """ImageHasherの初期化
+        
+        Args:
+            reduced_decode: JPEGを分析に必要な最小解像度でデコードする
+                            （Falseでフル解像度デコード。比較・検証用）
+        """
+        self.reduced_decode = reduced_decode
+    
+    def load_image(
+        self,
+        file_path: Path,
+        min_long_side: int = 0,
+        min_short_side: int = 0
+    ) -> Tuple[Optional[np.ndarray], int, int]:
+        """
+        分析用に画像を読み込む
+        
+        Returns:
+            (画像, 元画像の幅, 元画像の高さ)、失敗時は (None, 0, 0)
+        """
+        if self.reduced_decode:
+            return imread_reduced(file_path, min_long_side, min_short_side)
+        img = imread_unicode(file_path)
+        if img is None:
+            return None, 0, 0
+        height, width = img.shape[:2]
+        return img, width, height
     
     def compute_file_size(self, file_path: Path) -> int:
         """ファイルサイズを取得"""
@@ -60,6 +224,14 @@ class ImageHasher:
             hasher.update(data)
         return hasher.hexdigest()
     
+    def compute_content_hash(self, file_path: Path) -> str:
+        """ファイル全体のMD5ハッシュを計算（ストリーミング読み込み）"""
+        hasher = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.CONTENT_HASH_CHUNK), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    
     def compute_phash(self, file_path: Path) -> Optional[int]:
         """
         pHash（知覚ハッシュ）を計算
@@ -71,51 +243,66 @@ class ImageHasher:
             64ビットのハッシュ値（int）、失敗時はNone
         """
         try:
-            img = imread_unicode(file_path)
+            phash_size = self.PHASH_SIZE * self.PHASH_HIGHFREQ_FACTOR
+            img, _, _ = self.load_image(file_path, min_short_side=phash_size)
             if img is None:
                 return None
             
-            # グレースケールに変換
-            if len(img.shape) == 3:
-                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = img
-            
-            # DCT用にリサイズ（32x32が一般的）
-            img_size = self.PHASH_SIZE * self.PHASH_HIGHFREQ_FACTOR
-            resized = cv2.resize(gray, (img_size, img_size), interpolation=cv2.INTER_AREA)
-            
-            # float32に変換してDCT
-            resized = np.float32(resized)
-            dct = cv2.dct(resized)
-            
-            # 左上の低周波成分のみ使用（8x8）
-            dct_low = dct[:self.PHASH_SIZE, :self.PHASH_SIZE]
-            
-            # DC成分（左上隅）を除外した中央値を計算
-            dct_flat = dct_low.flatten()
-            median = np.median(dct_flat[1:])  # DC成分を除外
-            
-            # 中央値より大きいか小さいかで0/1を決定
-            diff = dct_low > median
-            
-            # 64ビットハッシュに変換
-            hash_value = 0
-            for i, bit in enumerate(diff.flatten()):
-                if bit:
-                    hash_value |= (1 << i)
-            
-            # SQLiteは符号付き64ビット整数のため、符号付きに変換
-            # 最上位ビットが1の場合、負の値として扱う
-            if hash_value >= (1 << 63):
-                hash_value -= (1 << 64)
-            
-            return hash_value
+            return self.compute_phash_from_gray(self.prepare_phash_gray(to_gray(img)))
             
         except Exception as e:
             logger.error(f"[pHash] 例外: {file_path} - {e}")
             return None
     
+    def prepare_phash_gray(self, gray: np.ndarray) -> np.ndarray:
+        """グレースケール画像をpHash用サイズ（32x32）に縮小"""
+        img_size = self.PHASH_SIZE * self.PHASH_HIGHFREQ_FACTOR
+        return cv2.resize(gray, (img_size, img_size), interpolation=cv2.INTER_AREA)
+    
+    def compute_phash_from_gray(self, thumb: np.ndarray) -> int:
+        """
+        縮小済みグレースケール画像（32x32）からpHashを計算
+        
+        デコード済みの画素を共有するスキャンパイプライン用。
+        """
+        return int(self.compute_phash_batch(thumb[np.newaxis])[0])
+    
+    def compute_phash_batch(self, thumbs) -> np.ndarray:
+        """
+        縮小済みグレースケール画像（N x 32 x 32）のpHashを一括計算
+        
+        DCTは画像ごとに行い、中央値の計算とビットのパックはNumPyで一括処理する。
+        ビット配置は従来の1枚ずつの計算と同じ（8x8低周波成分の行優先順が下位ビットから）。
+        
+        Args:
+            thumbs: (N, 32, 32) の配列、または32x32画像のリスト
+        
+        Returns:
+            符号付き64ビット整数のpHash配列（SQLiteのINTEGERにそのまま格納可能）
+        """
+        thumbs = np.asarray(thumbs, dtype=np.float32)
+        if thumbs.ndim == 2:
+            thumbs = thumbs[np.newaxis]
+        n = thumbs.shape[0]
+        if n == 0:
+            return np.empty(0, dtype=np.int64)
+        
+        # 左上の低周波成分のみ使用（8x8）
+        size = self.PHASH_SIZE
+        dct_low = np.empty((n, size, size), dtype=np.float32)
+        for i in range(n):
+            dct_low[i] = cv2.dct(np.ascontiguousarray(thumbs[i]))[:size, :size]
+        
+        # DC成分（左上隅）を除外した中央値より大きいかで0/1を決定
+        flat = dct_low.reshape(n, size * size)
+        medians = np.median(flat[:, 1:], axis=1)
+        bits = flat > medians[:, np.newaxis]
+        
+        # 64ビットを8バイトにパックし、リトルエンディアンの符号付き整数として解釈
+        # （SQLiteは符号付き64ビット整数のため、最上位ビットが1なら負の値になる）
+        packed = np.packbits(bits, axis=1, bitorder='little')
+        return packed.view('<i8').reshape(n).astype(np.int64)
+    
     def compute_phash_distance(self, hash1: int, hash2: int) -> int:
         """
         2つのpHashのハミング距離を計算
@@ -123,9 +310,7 @@ class ImageHasher:
         Returns:
             ハミング距離（0-64）、値が小さいほど類似
         """
-        # 負の値は64ビットのビットパターンとして扱う
-        xor = (hash1 ^ hash2) & 0xFFFFFFFFFFFFFFFF
-        return bin(xor).count('1')
+        return hamming_distance(hash1, hash2)
     
     def compute_phash_similarity(self, hash1: int, hash2: int) -> float:
         """
@@ -145,45 +330,51 @@ class ImageHasher:
         スコアが低いほど低品質（ブレやノイズが多い）
         """
         try:
-            img = imread_unicode(file_path)
+            img, width, height = self.load_image(
+                file_path,
+                min_long_side=self.ANALYSIS_SIZE * self.ANALYSIS_DECODE_MARGIN
+            )
             if img is None:
                 return 0.0, 0, 0
             
-            height, width = img.shape[:2]
-            
-            if len(img.shape) == 3:
-                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = img
-            
-            ANALYSIS_SIZE = 500  # 分析用サイズ（長辺）
-            h, w = gray.shape[:2]
-            if max(h, w) > ANALYSIS_SIZE:
-                scale = ANALYSIS_SIZE / max(h, w)
-                new_w = int(w * scale)
-                new_h = int(h * scale)
-                gray_resized = cv2.resize(gray, (new_w, new_h), interpolation=cv2.INTER_AREA)
-            else:
-                gray_resized = gray
-            
-            # 1. ブレ検出（Laplacian分散）
-            laplacian = cv2.Laplacian(gray_resized, cv2.CV_64F)
-            blur_score = laplacian.var()
+            gray_resized = self.prepare_analysis_gray(to_gray(img))
             
-            # 2. ノイズ検出（高周波成分の分析）
-            noise_score = self._estimate_noise(gray_resized)
-            
-            # 3. 複合品質スコアの計算
-            # ブレスコア（高いほど良い）とノイズスコア（低いほど良い）を組み合わせる
-            # ノイズペナルティを適用: ノイズが多いほどスコアを下げる
-            noise_penalty = max(0, 1 - (noise_score / 30))  # ノイズスコア30以上で大幅減点
-            quality_score = blur_score * noise_penalty
-            
-            return float(quality_score), width, height
+            return self.compute_sharpness_from_gray(gray_resized), width, height
         except Exception as e:
             logger.error(f"[Sharpness] 例外: {file_path} - {e}")
             return 0.0, 0, 0
     
+    def prepare_analysis_gray(self, gray: np.ndarray) -> np.ndarray:
+        """グレースケール画像を分析用サイズ（長辺ANALYSIS_SIZE以下）に縮小"""
+        h, w = gray.shape[:2]
+        if max(h, w) > self.ANALYSIS_SIZE:
+            scale = self.ANALYSIS_SIZE / max(h, w)
+            new_w = int(w * scale)
+            new_h = int(h * scale)
+            return cv2.resize(gray, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        return gray
+    
+    def compute_sharpness_from_gray(self, gray_resized: np.ndarray) -> float:
+        """
+        分析用に縮小済みのグレースケール画像から品質スコアを計算
+        
+        デコード済みの画素を共有するスキャンパイプライン用。
+        """
+        # 1. ブレ検出（Laplacian分散）
+        laplacian = cv2.Laplacian(gray_resized, cv2.CV_64F)
+        blur_score = laplacian.var()
+        
+        # 2. ノイズ検出（高周波成分の分析）
+        noise_score = self._estimate_noise(gray_resized)
+        
+        # 3. 複合品質スコアの計算
+        # ブレスコア（高いほど良い）とノイズスコア（低いほど良い）を組み合わせる
+        # ノイズペナルティを適用: ノイズが多いほどスコアを下げる
+        noise_penalty = max(0, 1 - (noise_score / 30))  # ノイズスコア30以上で大幅減点
+        quality_score = blur_score * noise_penalty
+        
+        return float(quality_score)
+    
     def _estimate_noise(self, gray_img: np.ndarray) -> float:
         """
         画像のノイズレベルを推定
@@ -217,21 +408,14 @@ class ImageHasher:
             
             # 方法3: 局所分散によるノイズ検出
             # 画像を小さなブロックに分割し、テクスチャの少ない領域の分散を見る
-            block_size = 16
-            h, w = gray_img.shape
-            min_vars = []
-            for y in range(0, h - block_size, block_size):
-                for x in range(0, w - block_size, block_size):
-                    block = gray_img[y:y+block_size, x:x+block_size]
-                    var = np.var(block)
-                    min_vars.append(var)
+            block_vars = self._block_variances(gray_img, block_size=16)
             
             # 最も分散の低いブロック（平坦な領域）のノイズを見る
-            if min_vars:
-                min_vars.sort()
+            if block_vars.size > 0:
                 # 下位10%の分散を平均（平坦領域のノイズ推定）
-                num_blocks = max(1, len(min_vars) // 10)
-                noise_level_3 = np.sqrt(np.mean(min_vars[:num_blocks]))
+                num_blocks = max(1, block_vars.size // 10)
+                lowest = np.partition(block_vars, num_blocks - 1)[:num_blocks]
+                noise_level_3 = np.sqrt(np.mean(lowest))
             else:
                 noise_level_3 = 0
             
@@ -246,3 +430,26 @@ class ImageHasher:
         except Exception as e:
             logger.error(f"[Noise] ノイズ推定エラー: {e}")
             return 0.0
+    
+    @staticmethod
+    def _block_variances(gray_img: np.ndarray, block_size: int = 16) -> np.ndarray:
+        """
+        画像をblock_size四方のブロックに分割し、全ブロックの分散を一括計算
+        
+        (行ブロック, block_size, 列ブロック, block_size) に reshape したビューで
+        分散を求めるため、ブロック数に比例したPythonループが発生しない。
+        ブロックの取り方は従来のループ（range(0, h - block_size, block_size)）と同じで、
+        末尾の端数・最終ブロックは含めない。
+        
+        Returns:
+            各ブロックの分散（1次元配列）
+        """
+        h, w = gray_img.shape[:2]
+        n_y = len(range(0, h - block_size, block_size))
+        n_x = len(range(0, w - block_size, block_size))
+        if n_y == 0 or n_x == 0:
+            return np.empty(0, dtype=np.float64)
+        
+        region = gray_img[:n_y * block_size, :n_x * block_size].astype(np.float64)
+        blocks = region.reshape(n_y, block_size, n_x, block_size)
+        return blocks.var(axis=(1, 3)).ravel()
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+SpectraMatch - ONNX Runtime Backend
+CLIP画像エンコーダーをONNX Runtime（CPU）で実行する推論バックエンド
+
+初回のみ transformers/PyTorch で CLIP のビジョン部分（vision_model + visual_projection）を
+ONNXにエクスポートし、~/.spectramatch/onnx にキャッシュする。以降は onnxruntime と
+numpy/OpenCV（前処理は clip_preprocess）だけで推論できるため、
+PyTorch（約2GB）の読み込みを待たずに起動できる。
+OpenCV が入っていない環境（opencv-python-headless 追加前のAI環境）では、
+CLIPProcessor と同じ手順の PIL 前処理（preprocess_images）にフォールバックする。
+
+数値の同等性:
+    PyTorch版とのずれは、L2正規化後の埋め込みで要素ごとの最大絶対誤差が
+    EMBEDDING_TOLERANCE 以下、コサイン類似度が MIN_COSINE_SIMILARITY 以上。
+    グラフ最適化による演算順序の違いで生じるfloat32の丸め誤差のみで、
+    類似度判定（閾値は1%刻み）には影響しない。
+
+INT8量子化（オプトイン）:
+    ビジョンエンコーダーの線形層（MatMul / Gemm）の重みをINT8に量子化したモデルを
+    別ファイルとして作る。キャリブレーション画像（ユーザーのライブラリから抽出した
+    サンプル）を渡した場合は活性化の範囲も事前に測る静的量子化、無い場合は
+    実行時に範囲を求める動的量子化になる。量子化モデルの埋め込みはfp32とは
+    別のモデルタグ（model_tag）で保存し、同じインデックスに混在させない。
+    OpenCV前処理を使う場合はタグに preprocess_model_tag() の接尾辞が付く。
+
+clip_worker.py からも同じディレクトリのモジュールとして直接importされるため、
+パッケージ内の相対importはフォールバック付きで使う。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    from .clip_protocol import FP32_MODEL_TAG
+except ImportError:
+    from clip_protocol import FP32_MODEL_TAG
+
+# OpenCVによる前処理。clip_preprocess（とOpenCV）が無い場合は PIL で同じ前処理を行う
+try:
+    try:
+        from .clip_preprocess import (
+            CLIP_IMAGE_SIZE, CLIP_MEAN, CLIP_STD, CLIPPreprocessor, preprocess_model_tag
+        )
+    except ImportError:
+        from clip_preprocess import (
+            CLIP_IMAGE_SIZE, CLIP_MEAN, CLIP_STD, CLIPPreprocessor, preprocess_model_tag
+        )
+except ImportError:
+    CLIPPreprocessor = None
+    preprocess_model_tag = lambda model_tag: model_tag
+    # CLIPProcessor (openai/clip-vit-base-patch32) と同じ前処理パラメータ
+    CLIP_IMAGE_SIZE = 224
+    CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+    CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+logger = logging.getLogger(__name__)
+
+# エクスポートしたONNXモデルの保存先
+ONNX_CACHE_DIR = Path.home() / ".spectramatch" / "onnx"
+
+# PyTorch版との許容誤差（L2正規化後の埋め込み）
+EMBEDDING_TOLERANCE = 1e-4
+MIN_COSINE_SIMILARITY = 0.99999
+
+ONNX_OPSET = 17
+
+# 静的量子化のキャリブレーションに使う画像数と、1回に流す枚数
+QUANTIZATION_SAMPLE_SIZE = 128
+QUANTIZATION_CALIBRATION_BATCH = 16
+
+
+def is_onnx_available() -> bool:
+    """onnxruntime がインポートできるか"""
+    try:
+        import onnxruntime  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def onnx_model_path(model_name: str, cache_dir: Path = ONNX_CACHE_DIR, quantized: bool = False) -> Path:
+    """モデル名に対応するエクスポート済みONNXファイルのパス（quantized=TrueならINT8版）"""
+    suffix = "-vision-int8.onnx" if quantized else "-vision.onnx"
+    return cache_dir / f"{model_name.replace('/', '--')}{suffix}"
+
+
+def select_calibration_sample(paths: Sequence[Path], count: int = QUANTIZATION_SAMPLE_SIZE) -> List[Path]:
+    """ライブラリからキャリブレーション用の画像を選ぶ（同じ入力なら毎回同じ選択）"""
+    paths = sorted(paths)
+    if len(paths) <= count:
+        return list(paths)
+    return sorted(random.Random(0).sample(paths, count))
+
+
+def preprocess_images(images: list) -> np.ndarray:
+    """PIL画像（またはRGB配列）のリストをCLIP入力テンソル (N, 3, 224, 224) float32 に変換
+    
+    OpenCV が無い場合のフォールバック。CLIPProcessor と同じく、短辺224pxへバイキュービック縮小 →
+    中央224x224切り出し → [0, 1] へのスケーリング → 平均・標準偏差で正規化 の順に処理する。
+    """
+    from PIL import Image
+    
+    size = CLIP_IMAGE_SIZE
+    batch = np.empty((len(images), 3, size, size), dtype=np.float32)
+    for i, image in enumerate(images):
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        w, h = image.size
+        if w <= h:
+            new_w, new_h = size, int(size * h / w)
+        else:
+            new_w, new_h = int(size * w / h), size
+        image = image.resize((new_w, new_h), resample=Image.BICUBIC)
+        top = (new_h - size) // 2
+        left = (new_w - size) // 2
+        pixels = np.asarray(image, dtype=np.float32)[top:top + size, left:left + size]
+        pixels = (pixels * (1.0 / 255.0) - CLIP_MEAN) / CLIP_STD
+        batch[i] = pixels.transpose(2, 0, 1)
+    return batch
+
+
+def _load_pil(path: Path):
+    """キャリブレーション画像をPILで読み込む（OpenCVが無い場合。読めなければNone）"""
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            return image.convert("RGB")
+    except Exception as e:
+        logger.error(f"Error loading image: {path} - {e}")
+        return None
+
+
+def export_vision_model(model_name: str, output_path: Path, opset: int = ONNX_OPSET) -> Path:
+    """CLIPのビジョンエンコーダーをONNXにエクスポート（transformers + PyTorch が必要）"""
+    import torch
+    from transformers import CLIPModel
+    
+    class VisionEncoder(torch.nn.Module):
+        """pixel_values → 射影済み画像特徴（get_image_features と同じ出力）"""
+        
+        def __init__(self, clip_model):
+            super().__init__()
+            self.clip_model = clip_model
+        
+        def forward(self, pixel_values):
+            return self.clip_model.get_image_features(pixel_values=pixel_values)
+    
+    model = CLIPModel.from_pretrained(model_name).eval()
+    encoder = VisionEncoder(model).eval()
+    dummy = torch.zeros(1, 3, CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE, dtype=torch.float32)
+    
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = output_path.with_suffix(".onnx.tmp")
+    export_kwargs = dict(
+        input_names=["pixel_values"],
+        output_names=["image_embeds"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+        opset_version=opset,
+        do_constant_folding=True,
+    )
+    with torch.no_grad():
+        try:
+            # PyTorch 2.5+ は dynamo エクスポーターが既定になりつつあるため従来方式を明示
+            torch.onnx.export(encoder, (dummy,), str(temp_path), dynamo=False, **export_kwargs)
+        except TypeError:
+            torch.onnx.export(encoder, (dummy,), str(temp_path), **export_kwargs)
+    
+    # 書き込み途中のファイルをキャッシュとして使わないよう、完成後に置き換える
+    os.replace(temp_path, output_path)
+    logger.info(f"Exported CLIP vision model to ONNX: {output_path}")
+    return output_path
+
+
+class _CalibrationReader:
+    """キャリブレーション画像を前処理済みテンソルとして順に渡すデータリーダー"""
+    
+    def __init__(self, input_name: str, paths: Sequence[Path], batch_size: int):
+        self.input_name = input_name
+        self.paths = list(paths)
+        self.batch_size = batch_size
+        self._offset = 0
+        self._preprocess = CLIPPreprocessor(capacity=batch_size) if CLIPPreprocessor is not None else None
+    
+    def get_next(self):
+        while self._offset < len(self.paths):
+            batch_paths = self.paths[self._offset:self._offset + self.batch_size]
+            self._offset += self.batch_size
+            if self._preprocess is None:
+                images = [image for image in map(_load_pil, batch_paths) if image is not None]
+                if images:
+                    return {self.input_name: preprocess_images(images)}
+                continue
+            images = [image for image in self._preprocess.load(batch_paths) if image is not None]
+            if images:
+                # キャリブレーターが保持する場合に備えてバッファのコピーを渡す
+                return {self.input_name: self._preprocess(images).copy()}
+        return None
+    
+    def rewind(self):
+        self._offset = 0
+
+
+def quantize_vision_model(
+    fp32_path: Path,
+    output_path: Path,
+    calibration_paths: Optional[Sequence[Path]] = None
+) -> str:
+    """fp32のONNXモデルから線形層をINT8化したモデルを作り、モデルタグを返す
+    
+    calibration_paths があれば静的量子化（活性化はキャリブレーション画像のMinMax範囲）、
+    無ければ動的量子化。タグには量子化方式と作成したモデルのハッシュを含めるため、
+    別のサンプルで作り直したモデルの埋め込みとも混在しない。
+    """
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+    
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = output_path.with_suffix(".onnx.tmp")
+    op_types = ["MatMul", "Gemm"]
+    
+    if calibration_paths:
+        mode = "static"
+        reader = _CalibrationReader("pixel_values", calibration_paths, QUANTIZATION_CALIBRATION_BATCH)
+        quantize_static(
+            str(fp32_path),
+            str(temp_path),
+            reader,
+            quant_format=QuantFormat.QDQ,
+            op_types_to_quantize=op_types,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8
+        )
+    else:
+        mode = "dynamic"
+        quantize_dynamic(
+            str(fp32_path),
+            str(temp_path),
+            op_types_to_quantize=op_types,
+            per_channel=True,
+            weight_type=QuantType.QInt8
+        )
+    
+    digest = hashlib.sha1()
+    with open(temp_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    tag = f"int8-{mode}:{digest.hexdigest()[:12]}"
+    
+    # タグはモデルと対になるサイドカーに保存（読み込みのたびにハッシュを計算しない）
+    os.replace(temp_path, output_path)
+    with open(_tag_path(output_path), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_tag": tag,
+            "mode": mode,
+            "calibration_images": len(calibration_paths or [])
+        }, f)
+    logger.info(f"Quantized CLIP vision model ({mode}, tag={tag}): {output_path}")
+    return tag
+
+
+def read_model_tag(model_path: Path) -> Optional[str]:
+    """量子化モデルのサイドカーからモデルタグを読む（無ければNone）"""
+    try:
+        with open(_tag_path(model_path), "r", encoding="utf-8") as f:
+            return json.load(f).get("model_tag")
+    except (OSError, ValueError):
+        return None
+
+
+def _tag_path(model_path: Path) -> Path:
+    return model_path.with_suffix(".json")
+
+
+class ONNXCLIPBackend:
+    """
+    ONNX Runtime による CLIP 画像特徴抽出
+    
+    使い方:
+        backend = ONNXCLIPBackend("openai/clip-vit-base-patch32")
+        if backend.load():
+            embeddings = backend.embed(pil_images)   # (N, 512) L2正規化済み
+    
+    quantized=True の場合はINT8モデルを使う（未作成なら load の calibration_paths で作る）。
+    """
+    
+    def __init__(
+        self,
+        model_name: str,
+        threads: int = 0,
+        cache_dir: Path = ONNX_CACHE_DIR,
+        quantized: bool = False
+    ):
+        self.model_name = model_name
+        self.threads = threads
+        self.quantized = quantized
+        self.fp32_path = onnx_model_path(model_name, cache_dir)
+        self.model_path = onnx_model_path(model_name, cache_dir, quantized)
+        self.model_tag = FP32_MODEL_TAG
+        self.session = None
+        self._input_name = "pixel_values"
+        self._preprocess = CLIPPreprocessor() if CLIPPreprocessor is not None else preprocess_images
+    
+    @property
+    def is_exported(self) -> bool:
+        return self.model_path.exists()
+    
+    def load(
+        self,
+        progress_callback: Optional[Callable[[str], None]] = None,
+        calibration_paths: Optional[Sequence[Path]] = None
+    ) -> bool:
+        """ONNXモデルを読み込む（未エクスポート・未量子化なら先に作成する）"""
+        if self.session is not None:
+            return True
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            logger.warning(f"onnxruntime is not installed: {e}")
+            return False
+        
+        try:
+            if not self.fp32_path.exists():
+                if progress_callback:
+                    progress_callback("ONNXモデルを作成中（初回のみ）...")
+                export_vision_model(self.model_name, self.fp32_path)
+            
+            if self.quantized:
+                self.model_tag = read_model_tag(self.model_path) if self.is_exported else None
+                if self.model_tag is None:
+                    if progress_callback:
+                        progress_callback(
+                            f"INT8量子化モデルを作成中（初回のみ、サンプル{len(calibration_paths or [])}枚）..."
+                        )
+                    self.model_tag = quantize_vision_model(
+                        self.fp32_path, self.model_path, calibration_paths
+                    )
+            
+            if progress_callback:
+                progress_callback("ONNXモデルを読み込み中...")
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.threads > 0:
+                options.intra_op_num_threads = self.threads
+            self.session = ort.InferenceSession(
+                str(self.model_path),
+                sess_options=options,
+                providers=["CPUExecutionProvider"]
+            )
+            self._input_name = self.session.get_inputs()[0].name
+            # OpenCV前処理の埋め込みは従来（PIL）のものと区別する
+            if CLIPPreprocessor is not None:
+                self.model_tag = preprocess_model_tag(self.model_tag)
+            logger.info(f"ONNX CLIP backend ready: {self.model_path} (model_tag={self.model_tag})")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load ONNX CLIP backend: {e}")
+            self.session = None
+            return False
+    
+    def embed(self, images: list) -> np.ndarray:
+        """RGB画像（配列またはPIL）のリストを1回の推論で処理し、L2正規化した (N, dim) 行列を返す"""
+        return self.embed_pixels(self._preprocess(images))
+    
+    def embed_pixels(self, pixel_values: np.ndarray) -> np.ndarray:
+        """前処理済みテンソル (N, 3, 224, 224) から埋め込みを計算"""
+        outputs = self.session.run(None, {self._input_name: pixel_values})[0]
+        embeddings = outputs.astype(np.float32, copy=False)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms > 1e-6, norms, 1.0)
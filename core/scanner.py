@@ -11,13 +11,15 @@ SQLite + Faiss対応の大規模スキャナー
 
 import gc
 import logging
-import pickle
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
 from queue import Empty, Queue
-from threading import Event, Thread
+from threading import Condition, Event, Lock, Thread
 from typing import Callable, List, Optional, Set, Dict, Tuple
 import numpy as np
 
@@ -25,7 +27,11 @@ from PySide6.QtCore import QObject, Signal
 
 from .comparator import ImageInfo, SimilarityGroup
 from .hasher import ImageHasher
-from .database import ImageDatabase
+from .clip_protocol import FP32_MODEL_TAG
+from .database import ImageDatabase, folder_range, split_path
+from .db_writer import DatabaseWriter
+from .embedding_store import EmbeddingSnapshot
+from .feature_pipeline import FeaturePipeline
 
 # サポートする画像拡張子
 SUPPORTED_EXTENSIONS: Set[str] = {
@@ -35,6 +41,23 @@ SUPPORTED_EXTENSIONS: Set[str] = {
 
 logger = logging.getLogger(__name__)
 
+# 先読みで保持するデコード済み画素の上限（バイト）
+PREFETCH_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# 推論中に先読みしておくバッチ数
+PREFETCH_BATCHES = 2
+
+# 更新日時がこの秒数以内のフォルダは記録しない（更新日時の分解能が粗いファイルシステムで、
+# 同じ時刻のうちに続けて変更されると検知できないため。次回のスキャンで一覧を取得し直す）
+DIRECTORY_MTIME_GRACE = 2.0
+
+# NumPyでのCLIPグループ化で一度に比較する行数（類似度の一時行列は QUERY × DATA × 4バイト）
+NUMPY_QUERY_BLOCK = 1024
+NUMPY_DATA_BLOCK = 8192
+
+# NumPyでのCLIPグループ化で画像ごとに残す類似画像の数
+NUMPY_MAX_NEIGHBORS = 20
+
 
 class ScanMode(Enum):
     """スキャンモード"""
@@ -48,10 +71,159 @@ class ScanResult:
     processed_files: int = 0
     skipped_files: int = 0
     cached_files: int = 0  # キャッシュから読み込んだファイル数
+    duplicate_files: int = 0  # 完全一致のため解析を省略したファイル数
     groups: List[SimilarityGroup] = field(default_factory=list)
     errors: List[str] = field(default_factory=list)
     mode: ScanMode = ScanMode.AI_CLIP
     all_images: List['ImageInfo'] = field(default_factory=list)  # 全画像リスト（ブレ画像表示用）
+    timings: Dict[str, float] = field(default_factory=dict)  # 段階別処理時間（秒）
+
+
+@dataclass
+class PreparedBatch:
+    """先読みローダーが用意した1バッチ分の解析結果"""
+    paths: List[Path]
+    file_infos: List[Optional[Dict]]  # pathsと同順（読み込み失敗はNone）
+    clip_images: List[Optional[np.ndarray]]  # file_infosの有効要素と同順のCLIP用RGB
+    nbytes: int = 0  # 保持しているデコード済み画素のバイト数
+
+
+class PrefetchLoader:
+    """
+    ファイル読み込み・デコード・鮮明度/pHash計算を先行させるローダー
+    
+    スレッドプールでバッチN+1のファイルを並列にデコードしている間に、
+    呼び出し側はバッチNのCLIP推論を行える。キューに積むバッチ数と
+    デコード済み画素の合計バイト数の両方に上限を設ける。
+    
+    使い方:
+        loader = PrefetchLoader(pipeline, paths, batch_size=32)
+        for batch in loader:
+            ...
+        loader.close()
+    """
+    
+    def __init__(
+        self,
+        pipeline: FeaturePipeline,
+        paths: List[Path],
+        batch_size: int,
+        content_hashes: Optional[Dict[str, str]] = None,
+        stop_event: Optional[Event] = None,
+        max_workers: int = 4,
+        max_batches: int = PREFETCH_BATCHES,
+        memory_limit: int = PREFETCH_MEMORY_LIMIT
+    ):
+        self.pipeline = pipeline
+        self.paths = paths
+        self.batch_size = max(1, batch_size)
+        self.content_hashes = content_hashes or {}
+        self.max_batches = max(1, max_batches)
+        self.memory_limit = memory_limit
+        
+        self._stop_event = stop_event or Event()
+        self._closed = Event()
+        self._queue: Queue = Queue()
+        self._condition = Condition()
+        self._queued_batches = 0
+        self._queued_bytes = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="Prefetch")
+        self._producer = Thread(target=self._produce, name="PrefetchLoader", daemon=True)
+        self._producer.start()
+    
+    def __iter__(self):
+        """用意できたバッチを順番に返す（中断・終了で止まる）"""
+        while True:
+            try:
+                batch = self._queue.get(timeout=0.5)
+            except Empty:
+                if self._stop_event.is_set() or self._closed.is_set():
+                    return
+                continue
+            if batch is None:
+                return
+            with self._condition:
+                self._queued_batches -= 1
+                self._queued_bytes -= batch.nbytes
+                self._condition.notify_all()
+            yield batch
+    
+    def close(self):
+        """先読みを止めてスレッドを終了する"""
+        self._closed.set()
+        with self._condition:
+            self._condition.notify_all()
+        self._producer.join(timeout=10)
+        self._executor.shutdown(wait=True)
+    
+    def _should_stop(self) -> bool:
+        return self._stop_event.is_set() or self._closed.is_set()
+    
+    def _produce(self):
+        """バッチ単位でデコードし、上限内でキューに積む（生産者スレッド本体）"""
+        try:
+            for start in range(0, len(self.paths), self.batch_size):
+                if self._should_stop():
+                    break
+                batch = self._prepare(self.paths[start:start + self.batch_size])
+                
+                # 上限を超える間は待つ（キューが空なら大きなバッチでも1つは通す）
+                with self._condition:
+                    while not self._should_stop() and self._queued_batches > 0 and (
+                        self._queued_batches >= self.max_batches
+                        or self._queued_bytes + batch.nbytes > self.memory_limit
+                    ):
+                        self._condition.wait(timeout=0.5)
+                    if self._should_stop():
+                        break
+                    self._queued_batches += 1
+                    self._queued_bytes += batch.nbytes
+                self._queue.put(batch)
+        except Exception as e:
+            logger.error(f"先読みローダーエラー: {e}")
+        finally:
+            self._queue.put(None)
+    
+    def _prepare(self, batch_paths: List[Path]) -> PreparedBatch:
+        """バッチ内のファイルを並列にデコードし、pHashは一括計算する"""
+        loaded = list(self._executor.map(self._load_file, batch_paths))
+        
+        file_infos = [info for info, _, _ in loaded]
+        clip_images = [clip_rgb for info, _, clip_rgb in loaded if info is not None]
+        
+        thumbs = [(info, thumb) for info, thumb, _ in loaded if thumb is not None]
+        phashes = self.pipeline.compute_phashes([thumb for _, thumb in thumbs])
+        for (info, _), phash in zip(thumbs, phashes):
+            info['phash'] = phash
+        
+        nbytes = sum(img.nbytes for img in clip_images if img is not None)
+        return PreparedBatch(batch_paths, file_infos, clip_images, nbytes)
+    
+    def _load_file(self, path: Path) -> Tuple[Optional[Dict], Optional[np.ndarray], Optional[np.ndarray]]:
+        """1ファイルを読み込む（戻り値: ファイル情報, pHash用サムネイル, CLIP用RGB）"""
+        if self._should_stop():
+            return None, None, None
+        logger.info(f"Processing file: {path}")
+        try:
+            stat = path.stat()
+            decoded = self.pipeline.decode(path)
+            if decoded is not None:
+                info = self.pipeline.extract(decoded, include_phash=False)
+                thumb, clip_rgb = decoded.phash_gray, decoded.clip_rgb
+            else:
+                # OpenCVで読めない形式はCLIP側（PIL）の読み込みに任せる
+                info = {'width': 0, 'height': 0, 'blur_score': 0.0, 'phash': None}
+                thumb, clip_rgb = None, None
+            info.update({
+                'path': path,
+                'file_size': stat.st_size,
+                'last_modified': stat.st_mtime,
+                'content_hash': self.content_hashes.get(str(path))
+            })
+            return info, thumb, clip_rgb
+        except Exception as e:
+            logger.error(f"ファイル情報取得エラー: {path} - {e}")
+            return None, None, None
 
 
 class ImageScanner(QObject):
@@ -73,12 +245,29 @@ class ImageScanner(QObject):
         self, 
         hasher: Optional[ImageHasher] = None,
         max_workers: int = 4,
-        db: Optional[ImageDatabase] = None
+        db: Optional[ImageDatabase] = None,
+        clip_pool_size: int = 1,
+        clip_worker_threads: int = 0,
+        clip_backend: str = "torch",
+        clip_quantize: bool = False,
+        clip_daemon: bool = False,
+        clip_daemon_idle_timeout: int = 30 * 60
     ):
         super().__init__()
         self.hasher = hasher or ImageHasher()
         self.max_workers = max_workers
         
+        # CLIPワーカープールの構成（CLIPEngine参照）
+        self.clip_pool_size = clip_pool_size
+        self.clip_worker_threads = clip_worker_threads
+        self.clip_backend = clip_backend
+        self.clip_quantize = clip_quantize
+        self.clip_daemon = clip_daemon
+        self.clip_daemon_idle_timeout = clip_daemon_idle_timeout
+        
+        # デコード1回で全特徴量を抽出するパイプライン
+        self.pipeline = FeaturePipeline(self.hasher)
+        
         # データベース
         self.db = db or ImageDatabase()
         
@@ -89,14 +278,150 @@ class ImageScanner(QObject):
         self._stop_event = Event()
         self._scan_thread: Optional[Thread] = None
     
+        # モデルの先読み（start_warmup）
+        self._warmup_thread: Optional[Thread] = None
+        self._warmup_cancel = Event()
+        self._warmup_lock = Lock()
+        
+        # 最初の埋め込みまでの時間の計測（スキャンごとにログへ出す）
+        self._scan_started = 0.0
+        self._first_embedding_pending = False
+        self._model_state = "cold"
+    
     @property
     def clip_engine(self):
         """CLIPエンジンを取得（遅延初期化）"""
         if self._clip_engine is None:
             from .clip_engine import CLIPEngine
-            self._clip_engine = CLIPEngine()
+            self._clip_engine = CLIPEngine(
+                pool_size=self.clip_pool_size,
+                worker_threads=self.clip_worker_threads,
+                backend=self.clip_backend,
+                quantize=self.clip_quantize,
+                use_daemon=self.clip_daemon,
+                daemon_idle_timeout=self.clip_daemon_idle_timeout
+            )
         return self._clip_engine
     
+    def set_clip_backend(self, backend: str):
+        """CLIP推論バックエンドを切り替える（読み込み済みのエンジンは次回スキャン時に作り直す）"""
+        if backend == self.clip_backend:
+            return
+        self.clip_backend = backend
+        self._reset_clip_engine()
+    
+    def set_clip_quantize(self, quantize: bool):
+        """INT8量子化の有無を切り替える（モデルタグが変わるため、次回スキャンで埋め込みを再計算する）"""
+        if quantize == self.clip_quantize:
+            return
+        self.clip_quantize = quantize
+        self._reset_clip_engine()
+    
+    def set_clip_daemon(self, enabled: bool):
+        """常駐CLIPデーモンの使用を切り替える（無効にしてもデーモンはアイドル時間の経過で終了する）"""
+        if enabled == self.clip_daemon:
+            return
+        self.clip_daemon = enabled
+        self._reset_clip_engine()
+    
+    def _reset_clip_engine(self):
+        """読み込み済みのCLIPエンジンを破棄（スキャン中は何もしない）"""
+        if self._clip_engine is None or self.is_scanning():
+            return
+        with self._warmup_lock:
+            engine = self._clip_engine
+            self._clip_engine = None
+            if self._warmup_thread is not None:
+                # 読み込み中のエンジンは先読みスレッドが終了時に停止する
+                self._warmup_cancel.set()
+                return
+        engine._stop_pool()
+        engine._stop_worker()
+    
+    def start_warmup(self) -> bool:
+        """CLIPモデルの先読みをバックグラウンドで開始する
+        
+        スキャン開始時の load_model は先読み中の読み込みの完了を待ってそのエンジンを使う。
+        AIコンポーネントが無い場合や空きメモリが足りない場合は何もしない（スキャン時に読み込む）。
+        
+        Returns:
+            先読みスレッドを開始した場合True
+        """
+        with self._warmup_lock:
+            if self._warmup_thread is not None or self.is_scanning():
+                return False
+            if self._clip_engine is not None and self._clip_engine.is_loaded:
+                return False
+            engine = self.clip_engine
+            self._warmup_cancel = Event()
+            self._warmup_thread = Thread(
+                target=self._warmup_worker,
+                args=(engine, self._warmup_cancel),
+                name="CLIPWarmup",
+                daemon=True
+            )
+            self._warmup_thread.start()
+        return True
+    
+    def cancel_warmup(self):
+        """先読みを中止する（読み込み中のモデルは読み込みが終わった時点で破棄する）"""
+        self._warmup_cancel.set()
+    
+    def is_warming_up(self) -> bool:
+        return self._warmup_thread is not None
+    
+    def _warmup_worker(self, engine, cancel: Event):
+        """先読みスレッド本体: 利用可否と空きメモリを確認してからモデルを読み込み、1回推論する"""
+        from .clip_engine import WARMUP_MIN_FREE_MEMORY, get_available_memory, lower_thread_priority
+        
+        lower_thread_priority()
+        try:
+            if cancel.is_set() or not engine.is_available:
+                return
+            
+            # 計測モード（pool_size=0）はスキャン時に候補構成を順に起動するため先読みしない
+            if engine._use_pool and engine.pool_size == 0:
+                logger.info("CLIP warm-up skipped: worker pool will be calibrated on the first scan")
+                return
+            # INT8モデルの初回作成はライブラリの画像でキャリブレーションするためスキャン時に行う
+            if engine.needs_quantization_calibration:
+                logger.info("CLIP warm-up skipped: quantized model needs calibration images")
+                return
+            
+            required = WARMUP_MIN_FREE_MEMORY * (engine.pool_size if engine._use_pool else 1)
+            available = get_available_memory()
+            if available is not None and available < required:
+                logger.info(
+                    f"CLIP warm-up skipped: {available / 1024 ** 3:.1f}GB free, "
+                    f"{required / 1024 ** 3:.1f}GB required"
+                )
+                return
+            
+            logger.info("CLIP warm-up started")
+            elapsed = engine.warm_up(cancel)
+            if elapsed is not None:
+                logger.info(f"CLIP warm-up complete: time to first embedding {elapsed:.2f}s")
+            elif cancel.is_set():
+                logger.info("CLIP warm-up cancelled")
+        except Exception as e:
+            logger.warning(f"CLIP warm-up failed: {e}")
+        finally:
+            with self._warmup_lock:
+                self._warmup_thread = None
+                # 中止された場合は、その間にスキャンが始まってエンジンを使っていない限り破棄する
+                if cancel.is_set() and self._clip_engine is engine and not self.is_scanning():
+                    self._clip_engine = None
+                discarded = self._clip_engine is not engine
+            if discarded:
+                engine._stop_pool()
+                engine._stop_worker()
+    
+    def calibrated_clip_pool(self) -> Optional[Tuple[int, int]]:
+        """自動計測で決まったCLIPワーカープール構成 (ワーカー数, スレッド数)。未計測ならNone"""
+        if self._clip_engine is None:
+            return None
+        return self._clip_engine.calibrated_pool
+    
     def is_clip_available(self) -> bool:
         try:
             return self.clip_engine.is_available
@@ -128,9 +453,14 @@ class ImageScanner(QObject):
         threshold: float = 85.0,
         recursive: bool = True,
         mode: ScanMode = ScanMode.AI_CLIP,
-        use_cache: bool = True
+        use_cache: bool = True,
+        full_walk: bool = False
     ):
-        """スキャンを開始（非同期）"""
+        """スキャンを開始（非同期）
+        
+        full_walk: 変更の無いフォルダの一覧もDBの記録を使わずに取得し直す
+                   （フォルダの更新日時が当てにならないファイルシステム向け）
+        """
         if self.is_scanning():
             self.scan_error.emit("スキャンは既に実行中です")
             return
@@ -138,31 +468,132 @@ class ImageScanner(QObject):
         self._stop_event.clear()
         self._scan_thread = Thread(
             target=self._scan_worker,
-            args=(folder_path, threshold, recursive, mode, use_cache),
+            args=(folder_path, threshold, recursive, mode, use_cache, full_walk),
             daemon=True
         )
         self._scan_thread.start()
     
-    def _find_image_files(self, folder_path: Path, recursive: bool = True) -> List[Path]:
-        """画像ファイルを探索"""
+    def _find_image_files(
+        self,
+        folder_path: Path,
+        recursive: bool = True,
+        stats: Optional[Dict[str, Tuple[int, float]]] = None,
+        dir_mtimes: Optional[Dict[str, float]] = None,
+        use_recorded: bool = False
+    ) -> List[Path]:
+        """画像ファイルを探索
+        
+        os.scandir でフォルダを走査する（ディレクトリへのシンボリックリンクはたどらない）。
+        stats を渡した場合は各ファイルの (サイズ, 更新日時) を記録する。Windowsでは
+        ディレクトリ一覧の取得時に得られる値なので、ファイルごとのstatが不要になる。
+        
+        dir_mtimes を渡した場合は訪れたフォルダの更新日時を {フォルダのパス（末尾に区切り文字）: mtime}
+        で記録する。use_recorded がTrueなら、更新日時がDBの記録と同じフォルダは一覧を取得せず、
+        DBに登録済みのファイルとサブフォルダを使う（stats にはDBのサイズ・更新日時が入る）。
+        ファイルの追加・削除・名前の変更はフォルダの更新日時を変えるが、既存ファイルの上書きは
+        変えないため、上書きはDBの記録を使わない探索（full_walk）でのみ検知される。
+        """
         image_files: List[Path] = []
+        pending = [folder_path]
         
-        try:
-            pattern = "**/*" if recursive else "*"
-            for file_path in folder_path.glob(pattern):
-                if self._stop_event.is_set():
-                    break
-                if file_path.is_file():
-                    ext = file_path.suffix.lower()
-                    if ext in SUPPORTED_EXTENSIONS:
+        recorded: Dict[str, Tuple[int, Optional[float]]] = {}
+        subdirectories: Dict[int, List[str]] = defaultdict(list)
+        if use_recorded:
+            for dir_id, parent_id, dir_path, mtime in self.db.iter_directories(str(folder_path)):
+                recorded[dir_path] = (dir_id, mtime)
+                subdirectories[parent_id].append(dir_path)
+        reused = 0
+        
+        while pending and not self._stop_event.is_set():
+            directory = pending.pop()
+            dir_key = folder_range(str(directory))[0]
+            
+            if dir_mtimes is not None or recorded:
+                try:
+                    mtime = os.stat(directory).st_mtime
+                except OSError as e:
+                    logger.warning(f"フォルダを読めません: {directory} - {e}")
+                    continue
+                if dir_mtimes is not None:
+                    dir_mtimes[dir_key] = mtime
+                
+                # 変更の無いフォルダはDBの記録から
+                dir_id, recorded_mtime = recorded.get(dir_key, (None, None))
+                if dir_id is not None and recorded_mtime == mtime:
+                    for name, size, last_modified in self.db.get_directory_files(dir_id):
+                        if os.path.splitext(name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                            continue
+                        file_path = Path(dir_key + name)
                         image_files.append(file_path)
-        except PermissionError as e:
-            logger.warning(f"アクセス拒否: {folder_path} - {e}")
-        except Exception as e:
-            logger.error(f"ファイル探索エラー: {folder_path} - {e}")
+                        if stats is not None:
+                            stats[str(file_path)] = (size, last_modified)
+                    if recursive:
+                        pending.extend(Path(child) for child in subdirectories[dir_id])
+                    reused += 1
+                    continue
+            
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if recursive:
+                                    pending.append(Path(entry.path))
+                                continue
+                            if not entry.is_file():
+                                continue
+                            if os.path.splitext(entry.name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                                continue
+                            file_path = Path(entry.path)
+                            image_files.append(file_path)
+                            if stats is not None:
+                                stat = entry.stat()
+                                stats[str(file_path)] = (stat.st_size, stat.st_mtime)
+                        except OSError:
+                            continue
+            except PermissionError as e:
+                logger.warning(f"アクセス拒否: {directory} - {e}")
+            except Exception as e:
+                logger.error(f"ファイル探索エラー: {directory} - {e}")
         
+        if use_recorded:
+            logger.info(f"Reused recorded listings for {reused} unchanged directories")
         return image_files
     
+    def _record_directory_mtimes(
+        self,
+        folder_path: Path,
+        image_files: List[Path],
+        file_stats: Dict[str, Tuple[int, float]],
+        dir_mtimes: Dict[str, float],
+        recursive: bool
+    ):
+        """探索したフォルダの更新日時をDBに記録（次回の探索で変更の無いフォルダの一覧を省く）
+        
+        DBの登録内容が現在のファイルと一致しないファイル（解析に失敗した・中断で未保存など）を
+        含むフォルダと、更新されたばかりのフォルダは記録しない（次回も一覧を取得して再確認する）。
+        サブフォルダまで探索した場合は、見つからなかったフォルダの記録を削除する。
+        """
+        model_tag = self.clip_engine.model_tag
+        up_to_date: Set[str] = set()
+        for key, size, mtime, tag in self.db.iter_file_index(str(folder_path)):
+            stat = file_stats.get(key)
+            if stat is not None and not ImageDatabase.is_entry_changed((size, mtime, tag), *stat, model_tag):
+                up_to_date.add(key)
+        
+        mtimes: Dict[str, Optional[float]] = dict(dir_mtimes)
+        now = time.time()
+        for dir_key, mtime in dir_mtimes.items():
+            if now - mtime < DIRECTORY_MTIME_GRACE:
+                mtimes[dir_key] = None
+        for path in image_files:
+            key = str(path)
+            if key not in up_to_date:
+                mtimes[split_path(key)[0]] = None
+        self.db.set_directory_mtimes(mtimes)
+        if recursive:
+            self.db.prune_directories(str(folder_path), mtimes)
+    
     # _process_image_phash は削除されました
     
     def _process_image_clip(self, file_path: Path) -> Optional[Dict]:
@@ -175,36 +606,124 @@ class ImageScanner(QObject):
             file_size = stat.st_size
             last_modified = stat.st_mtime
             
-            sharpness, width, height = self.hasher.compute_sharpness(file_path)
-            embedding = self.clip_engine.extract_embedding(file_path)
+            decoded = self.pipeline.decode(file_path)
+            if decoded is not None:
+                features = self.pipeline.extract(decoded)
+                embedding = self.clip_engine.get_embedding(file_path, decoded.clip_rgb)
+            else:
+                features = {'width': 0, 'height': 0, 'blur_score': 0.0, 'phash': None}
+                embedding = self.clip_engine.get_embedding(file_path)
             
             return {
                 'path': file_path,
                 'file_size': file_size,
                 'last_modified': last_modified,
-                'width': width,
-                'height': height,
-                'phash_int': 0,
-                'blur_score': sharpness,
-                'embedding': embedding
+                'width': features['width'],
+                'height': features['height'],
+                'phash': features['phash'],
+                'blur_score': features['blur_score'],
+                'embedding': embedding,
+                'model_tag': self.clip_engine.model_tag
             }
         except Exception as e:
             logger.error(f"CLIP処理エラー: {file_path} - {e}")
             return None
     
+    def _submit_clip_batch(
+        self,
+        paths: List[Path],
+        images: List[Optional[np.ndarray]],
+        batch_size: int
+    ) -> Future:
+        """CLIP埋め込みの抽出を依頼し、送信から結果受信までの時間を記録する"""
+        submitted = time.perf_counter()
+        future = self.clip_engine.submit_embeddings_batch(paths, batch_size=batch_size, images=images)
+        self.pipeline.add_clip_time(time.perf_counter() - submitted)
+        future.add_done_callback(
+            lambda _: self.pipeline.add_clip_round_trip(time.perf_counter() - submitted, len(paths))
+        )
+        return future
+    
+    def _collect_clip_batch(
+        self,
+        batch_paths: List[Path],
+        file_infos: List[Optional[Dict]],
+        future: Future,
+        result: "ScanResult"
+    ) -> List[Dict]:
+        """CLIPの結果を待ってファイル情報とマージし、DB保存用のレコードを返す"""
+        wait_start = time.perf_counter()
+        embeddings = future.result()
+        self.pipeline.add_clip_time(time.perf_counter() - wait_start)
+        
+        if self._first_embedding_pending and any(e is not None for e in embeddings):
+            self._first_embedding_pending = False
+            logger.info(
+                f"Time to first embedding: {time.perf_counter() - self._scan_started:.2f}s "
+                f"after scan start (model {self._model_state})"
+            )
+        
+        records: List[Dict] = []
+        embed_idx = 0
+        for i, info in enumerate(file_infos):
+            if info is None:
+                result.skipped_files += 1
+                result.errors.append(f"スキップ: {batch_paths[i]}")
+                continue
+            
+            embedding = embeddings[embed_idx] if embed_idx < len(embeddings) else None
+            embed_idx += 1
+            
+            if embedding is not None:
+                info['embedding'] = embedding
+                info['model_tag'] = self.clip_engine.model_tag
+                records.append(info)
+                result.processed_files += 1
+            else:
+                result.skipped_files += 1
+                result.errors.append(f"CLIP処理失敗: {info['path']}")
+        return records
+    
+    def _throughput_text(self) -> str:
+        """進捗表示用のCLIPスループット（パイプライン化なしの推定値と併記）"""
+        timings = self.pipeline.timings
+        if not timings.clip_images:
+            return ""
+        return (
+            f" - {timings.throughput:.1f}枚/秒"
+            f"（パイプラインなし推定 {timings.serial_throughput:.1f}枚/秒）"
+        )
+    
     def _scan_worker(
         self, 
         folder_path: Path, 
         threshold: float,
         recursive: bool,
         mode: ScanMode,
-        use_cache: bool
+        use_cache: bool,
+        full_walk: bool = False
     ):
         """スキャンのメインワーカー"""
         result = ScanResult(mode=mode)
         
+        self._scan_started = time.perf_counter()
+        self._first_embedding_pending = True
+        if self._clip_engine is not None and self._clip_engine.is_loaded:
+            self._model_state = "pre-warmed"
+        else:
+            self._model_state = "warming up" if self.is_warming_up() else "cold"
+        
+        # 解析結果のDB保存（専用スレッド）。中断・エラー時も finally で残りを書き込む
+        writer: Optional[DatabaseWriter] = None
+        
         try:
             # AIモードの場合、まずモデルをロード
+            image_files: Optional[List[Path]] = None
+            # 探索時に記録した {パス: (サイズ, 更新日時)}（キャッシュ確認と完全一致検出で使う）
+            file_stats: Dict[str, Tuple[int, float]] = {}
+            # 探索したフォルダの更新日時（キャッシュ使用時は変更の無いフォルダの一覧をDBの記録で代用する）
+            dir_mtimes: Dict[str, float] = {}
+            use_recorded = use_cache and not full_walk
             if mode == ScanMode.AI_CLIP:
                 if not self.is_clip_available():
                     self.scan_error.emit(
@@ -217,15 +736,26 @@ class ImageScanner(QObject):
                 def progress_cb(msg):
                     self.progress_updated.emit(0, 0, msg)
                 
+                # INT8モデルの初回作成時は、このライブラリの画像でキャリブレーションする
+                if self.clip_engine.needs_quantization_calibration:
+                    self.progress_updated.emit(0, 0, "量子化用のサンプル画像を選択中...")
+                    image_files = self._find_image_files(
+                        folder_path, recursive, file_stats, dir_mtimes, use_recorded
+                    )
+                    self.clip_engine.set_calibration_sample(image_files)
+                
                 if not self.clip_engine.load_model(progress_cb):
                     self.scan_error.emit("CLIPモデルのロードに失敗しました")
                     self.scan_completed.emit(result)
                     return
             
             # Phase 1: ファイル探索
-            self.progress_updated.emit(0, 0, "画像ファイルを検索中...")
-            logger.info(f"Scanning for images in: {folder_path} (recursive={recursive})")
-            image_files = self._find_image_files(folder_path, recursive)
+            if image_files is None:
+                self.progress_updated.emit(0, 0, "画像ファイルを検索中...")
+                logger.info(f"Scanning for images in: {folder_path} (recursive={recursive})")
+                image_files = self._find_image_files(
+                    folder_path, recursive, file_stats, dir_mtimes, use_recorded
+                )
             logger.info(f"Found {len(image_files)} images.")
             result.total_files = len(image_files)
             
@@ -249,16 +779,24 @@ class ImageScanner(QObject):
             current_file_paths = {str(p) for p in image_files}
             
             if use_cache:
-                # 削除されたファイルの検知（スキャン対象フォルダ内のみ）
-                folder_prefix = str(folder_path)
-                db_paths = self.db.get_all_paths()
-                # このフォルダに属するDBパスのうち、実際に存在しないものを抽出
-                stale_paths = [
-                    p for p in db_paths 
-                    if p.startswith(folder_prefix) and p not in current_file_paths
-                ]
+                # スキャン対象フォルダの登録情報を1回のクエリで順に読み、
+                # 削除されたファイルとキャッシュが有効なファイルを振り分ける
+                # （別のモデルで計算した埋め込みも再計算の対象）
+                model_tag = self.clip_engine.model_tag
+                stale_paths: List[str] = []
+                cached_paths: Set[str] = set()
+                for key, size, mtime, tag in self.db.iter_file_index(str(folder_path)):
+                    if self._stop_event.is_set():
+                        break
+                    if key not in current_file_paths:
+                        stale_paths.append(key)
+                        continue
+                    stat = file_stats.get(key)
+                    if stat is not None and not ImageDatabase.is_entry_changed((size, mtime, tag), *stat, model_tag):
+                        cached_paths.add(key)
                 
-                if stale_paths:
+                # 削除されたファイルの検知（スキャン対象フォルダ内のみ）
+                if stale_paths and not self._stop_event.is_set():
                     logger.info(f"Removing {len(stale_paths)} deleted files from database")
                     self.progress_updated.emit(
                         0, result.total_files,
@@ -267,13 +805,8 @@ class ImageScanner(QObject):
                     self.db.delete_by_paths(stale_paths)
                 
                 # 新規・変更ファイルの検出
-                for path in image_files:
-                    if self._stop_event.is_set():
-                        break
-                    if self.db.is_file_changed(path):
-                        files_to_process.append(path)
-                    else:
-                        cached_count += 1
+                files_to_process = [path for path in image_files if str(path) not in cached_paths]
+                cached_count = len(image_files) - len(files_to_process)
                 result.cached_files = cached_count
             else:
                 files_to_process = image_files
@@ -284,6 +817,24 @@ class ImageScanner(QObject):
             )
             logger.info(f"Cache check complete. Cached: {cached_count}, To process: {len(files_to_process)}")
             
+            if self._stop_event.is_set():
+                self.scan_completed.emit(result)
+                return
+            
+            # Phase 3: 完全一致ファイルの事前検出（同一内容のコピーはCLIPを通さない）
+            content_hashes: Dict[str, str] = {}
+            clone_jobs: List[Tuple[str, List[Dict]]] = []
+            if files_to_process:
+                self.progress_updated.emit(
+                    cached_count, result.total_files, "完全一致ファイルを検出中..."
+                )
+                files_to_process, clone_jobs, content_hashes = self._find_exact_duplicates(
+                    files_to_process, file_stats
+                )
+                duplicate_count = sum(len(targets) for _, targets in clone_jobs)
+                if duplicate_count:
+                    logger.info(f"Exact duplicates: {duplicate_count} files will reuse existing features")
+            
             if self._stop_event.is_set():
                 self.scan_completed.emit(result)
                 return
@@ -291,106 +842,112 @@ class ImageScanner(QObject):
             # CLIPモードはバッチ処理（高速化）
             mode_name = "AIセマンティック分析"
             processed = cached_count
-            batch_records: List[Dict] = []
-            BATCH_SIZE = 100
+            writer = DatabaseWriter(self.db)
             
             logger.info("Starting processing loop...")
             
+            # CLIPがデコード済み画像を受け取れる場合のみCLIP用RGBを保持
+            self.pipeline.keep_clip_rgb = self.clip_engine.accepts_decoded_images
+            self.pipeline.reset_timings()
+            
             CLIP_BATCH_SIZE = 32  # RTX4060に最適化
             MEMORY_RELEASE_INTERVAL = 5000  # 5000枚ごとにメモリ解放
             images_since_gc = 0  # GCからの処理枚数カウンタ
             
-            for batch_start in range(0, len(files_to_process), CLIP_BATCH_SIZE):
-                if self._stop_event.is_set():
-                    break
-                
-                batch_end = min(batch_start + CLIP_BATCH_SIZE, len(files_to_process))
-                batch_paths = files_to_process[batch_start:batch_end]
-                
-                # ファイル情報を先に取得
-                file_infos = []
-                for i, path in enumerate(batch_paths):
-                    logger.info(f"Processing file {i+1}/{len(batch_paths)}: {path}")
-                    try:
-                        stat = path.stat()
-                        sharpness, width, height = self.hasher.compute_sharpness(path)
-                        phash = self.hasher.compute_phash(path)  # pHash計算
-                        file_infos.append({
-                            'path': path,
-                            'file_size': stat.st_size,
-                            'last_modified': stat.st_mtime,
-                            'width': width,
-                            'height': height,
-                            'blur_score': sharpness,
-                            'phash': phash
-                        })
-                    except Exception as e:
-                        logger.error(f"ファイル情報取得エラー: {path} - {e}")
-                        file_infos.append(None)
-                
-                logger.info(f"Batch pre-processing complete. Valid files: {len([f for f in file_infos if f])}")
+            # パイプライン化できる場合は1バッチ分先行して送信し、推論中に次のバッチをデコードする
+            pipeline_depth = 1 if self.clip_engine.supports_pipelining else 0
+            pending_batches: List[Tuple[List[Path], List[Optional[Dict]], Future]] = []
+            loop_start = time.perf_counter()
+            
+            # デコードは先読みローダーのスレッドで行い、このスレッドはCLIPとDB保存を担当する
+            loader = PrefetchLoader(
+                self.pipeline,
+                files_to_process,
+                CLIP_BATCH_SIZE,
+                content_hashes=content_hashes,
+                stop_event=self._stop_event,
+                max_workers=self.max_workers
+            )
+            
+            try:
+                for prepared in loader:
+                    if self._stop_event.is_set():
+                        break
+                    
+                    batch_paths = prepared.paths
+                    file_infos = prepared.file_infos
+                    clip_images = prepared.clip_images
+                    del prepared
+                    
+                    logger.info(f"Batch pre-processing complete. Valid files: {len([f for f in file_infos if f])}")
 
-                # バッチでCLIP埋め込みを抽出
-                valid_paths = [info['path'] for info in file_infos if info is not None]
-                if valid_paths:
-                    logger.info(f"Extracting embeddings for {len(valid_paths)} files...")
-                    embeddings = self.clip_engine.extract_embeddings_batch(valid_paths, batch_size=CLIP_BATCH_SIZE)
-                else:
-                    embeddings = []
-                
-                # 結果をマージ
-                embed_idx = 0
-                for i, info in enumerate(file_infos):
-                    if info is None:
-                        result.skipped_files += 1
-                        result.errors.append(f"スキップ: {batch_paths[i]}")
-                    else:
-                        embedding = embeddings[embed_idx] if embed_idx < len(embeddings) else None
-                        embed_idx += 1
-                        
-                        if embedding is not None:
-                            info['embedding'] = embedding
-                            batch_records.append(info)
-                            result.processed_files += 1
-                        else:
-                            result.skipped_files += 1
-                            result.errors.append(f"CLIP処理失敗: {info['path']}")
+                    # バッチでCLIP埋め込みを抽出（ワーカー版は送信のみで結果は後で回収）
+                    valid_paths = [info['path'] for info in file_infos if info is not None]
+                    pending_batches.append(
+                        (batch_paths, file_infos, self._submit_clip_batch(valid_paths, clip_images, CLIP_BATCH_SIZE))
+                    )
+                    clip_images = []
                     
-                    processed += 1
-                
-                # バッチでDBに保存
-                if len(batch_records) >= BATCH_SIZE:
-                    self.db.batch_upsert(batch_records)
-                    batch_records = []
-                
-                # 進捗更新（バッチ単位で更新）
-                self.progress_updated.emit(
-                    processed, result.total_files,
-                    f"{mode_name}中... ({processed}/{result.total_files})"
-                )
-                
-                # 5000枚ごとにメモリ解放
-                images_since_gc += len(batch_paths)
-                if images_since_gc >= MEMORY_RELEASE_INTERVAL:
-                    logger.info(f"メモリ解放を実行中... ({processed}枚処理済み)")
+                    # 回収した結果はライタースレッドがまとめてDBに保存する
+                    while len(pending_batches) > pipeline_depth:
+                        done_paths, done_infos, future = pending_batches.pop(0)
+                        writer.put(self._collect_clip_batch(done_paths, done_infos, future, result))
+                        processed += len(done_paths)
+                    self.pipeline.timings.elapsed = time.perf_counter() - loop_start
+                    
+                    # 進捗更新（バッチ単位で更新）
                     self.progress_updated.emit(
                         processed, result.total_files,
-                        f"メモリ最適化中... ({processed}/{result.total_files})"
+                        f"{mode_name}中... ({processed}/{result.total_files})"
+                        f"{self._throughput_text()}"
                     )
                     
-                    # バッチレコードを先にDBに保存
-                    if batch_records:
-                        self.db.batch_upsert(batch_records)
-                        batch_records = []
-                    
-                    # ガベージコレクション実行
-                    gc.collect()
-                    images_since_gc = 0
-                    logger.info("メモリ解放完了")
+                    # 5000枚ごとにメモリ解放
+                    images_since_gc += len(batch_paths)
+                    if images_since_gc >= MEMORY_RELEASE_INTERVAL:
+                        logger.info(f"メモリ解放を実行中... ({processed}枚処理済み)")
+                        self.progress_updated.emit(
+                            processed, result.total_files,
+                            f"メモリ最適化中... ({processed}/{result.total_files})"
+                        )
+                        
+                        # ガベージコレクション実行
+                        gc.collect()
+                        images_since_gc = 0
+                        logger.info("メモリ解放完了")
+            finally:
+                loader.close()
+            
+            # 送信済みで未回収のバッチを回収（中断時も推論済みの結果は保存する）
+            for done_paths, done_infos, future in pending_batches:
+                writer.put(self._collect_clip_batch(done_paths, done_infos, future, result))
+                processed += len(done_paths)
+            pending_batches = []
+            self.pipeline.timings.elapsed = time.perf_counter() - loop_start
             
-            # 残りをDBに保存
-            if batch_records:
-                self.db.batch_upsert(batch_records)
+            # 残りをDBに保存（複製元の取得と類似度分析はコミット済みのデータを読む）
+            self._close_writer(writer, result)
+            
+            # 完全一致ファイルに解析結果を複製
+            if clone_jobs and not self._stop_event.is_set():
+                for source, targets in clone_jobs:
+                    cloned = self.db.clone_features(source, targets)
+                    if cloned:
+                        result.duplicate_files += cloned
+                    else:
+                        result.skipped_files += len(targets)
+                        result.errors.extend(f"スキップ: {t['path']}" for t in targets)
+                    processed += len(targets)
+                self.progress_updated.emit(
+                    processed, result.total_files,
+                    f"完全一致: {result.duplicate_files}件の解析を省略"
+                )
+            
+            # 探索したフォルダの更新日時を記録（保存済みのファイルだけのフォルダのみ）
+            self._record_directory_mtimes(folder_path, image_files, file_stats, dir_mtimes, recursive)
+            
+            result.timings = self.pipeline.timings.as_dict()
+            logger.info(f"Stage timings: {self.pipeline.timings.summary()}")
             
             if self._stop_event.is_set():
                 self.progress_updated.emit(processed, result.total_files, "中断されました")
@@ -404,6 +961,9 @@ class ImageScanner(QObject):
             )
             
             result.groups = self._find_groups_clip(threshold)
+            exact_groups = self._find_exact_match_groups(folder_path)
+            if exact_groups:
+                result.groups = self._merge_exact_groups(result.groups, exact_groups)
             
             self.progress_updated.emit(
                 result.total_files,
@@ -411,10 +971,9 @@ class ImageScanner(QObject):
                 f"完了! {len(result.groups)}個の類似グループを検出"
             )
             
-            # 全画像情報を取得（ブレ画像表示用）
-            all_image_data = self.db.get_all_images()
+            # 全画像情報を取得（ブレ画像表示用、埋め込みは読まない）
             result.all_images = []
-            for img_data in all_image_data:
+            for img_data in self.db.iter_images():
                 info = ImageInfo(
                     path=Path(img_data['path']),
                     file_size=img_data.get('file_size', 0),
@@ -432,8 +991,191 @@ class ImageScanner(QObject):
             self.scan_error.emit(error_msg)
         
         finally:
+            if writer is not None:
+                self._close_writer(writer, result)
             self.scan_completed.emit(result)
     
+    def _close_writer(self, writer: DatabaseWriter, result: ScanResult):
+        """DBライターの残りを書き込んで閉じ、保存に失敗した件数を結果に記録"""
+        if writer.closed:
+            return
+        writer.close()
+        if writer.failed_records:
+            result.errors.append(f"DB保存失敗: {writer.failed_records}件")
+    
+    def _find_exact_duplicates(
+        self,
+        files_to_process: List[Path],
+        file_stats: Optional[Dict[str, Tuple[int, float]]] = None
+    ) -> Tuple[List[Path], List[Tuple[str, List[Dict]]], Dict[str, str]]:
+        """
+        バイト単位で同一のファイルを段階的に検出
+        
+        1. ファイルサイズでグループ化（登録済みファイルも含む）
+        2. 同サイズのファイルを先頭4KBのハッシュで絞り込み
+        3. 残った候補のみファイル全体のハッシュを計算
+        
+        file_stats に探索時の (サイズ, 更新日時) があればstatし直さない。
+        
+        Returns:
+            (解析が必要なファイル,
+             [(複製元パス, 複製先レコードのリスト), ...],
+             {解析対象ファイルのパス: コンテンツハッシュ})
+        """
+        stats: Dict[str, Tuple[int, float]] = {}
+        for path in files_to_process:
+            if self._stop_event.is_set():
+                return files_to_process, [], {}
+            known = file_stats.get(str(path)) if file_stats else None
+            if known is not None:
+                stats[str(path)] = known
+                continue
+            try:
+                stat = path.stat()
+                stats[str(path)] = (stat.st_size, stat.st_mtime)
+            except OSError:
+                continue
+        
+        new_paths = set(stats)
+        
+        # 同サイズの登録済みファイル（変更されたファイルの古いレコードは除外）
+        sizes = sorted({size for size, _ in stats.values()})
+        db_rows = {
+            row['path']: row for row in self.db.get_files_by_sizes(sizes)
+            if row['path'] not in new_paths
+        }
+        
+        # 1. ファイルサイズ
+        by_size: Dict[int, List[str]] = defaultdict(list)
+        for path, (size, _) in stats.items():
+            by_size[size].append(path)
+        for path, row in db_rows.items():
+            by_size[row['file_size']].append(path)
+        
+        content_hashes: Dict[str, str] = {}
+        for paths in by_size.values():
+            if len(paths) < 2 or not any(p in new_paths for p in paths):
+                continue
+            
+            # 2. 先頭4KBのハッシュ
+            by_quick: Dict[str, List[str]] = defaultdict(list)
+            for path in paths:
+                if self._stop_event.is_set():
+                    return files_to_process, [], {}
+                try:
+                    by_quick[self.hasher.compute_quick_hash(Path(path))].append(path)
+                except OSError:
+                    continue  # 登録済みだが既に存在しないファイルなど
+            
+            # 3. ファイル全体のハッシュ（登録済みのハッシュがあれば再利用）
+            for candidates in by_quick.values():
+                if len(candidates) < 2 or not any(p in new_paths for p in candidates):
+                    continue
+                for path in candidates:
+                    known = db_rows[path]['content_hash'] if path in db_rows else None
+                    if known:
+                        content_hashes[path] = known
+                        continue
+                    try:
+                        content_hashes[path] = self.hasher.compute_content_hash(Path(path))
+                    except OSError:
+                        continue
+        
+        by_hash: Dict[str, List[str]] = defaultdict(list)
+        for path, content_hash in content_hashes.items():
+            by_hash[content_hash].append(path)
+        
+        duplicates: Set[str] = set()
+        clone_jobs: List[Tuple[str, List[Dict]]] = []
+        for content_hash, paths in by_hash.items():
+            new_members = sorted(p for p in paths if p in new_paths)
+            if len(paths) < 2 or not new_members:
+                continue
+            
+            # 解析済みの登録ファイルがあればそれを複製元にし、無ければ最初の1枚だけ解析する
+            cached = sorted(
+                p for p in paths
+                if p in db_rows and db_rows[p]['has_embedding'] and self._has_current_model_tag(db_rows[p])
+            )
+            if cached:
+                source, clones = cached[0], new_members
+            else:
+                source, clones = new_members[0], new_members[1:]
+            if not clones:
+                continue
+            
+            clone_jobs.append((source, [
+                {
+                    'path': Path(p),
+                    'file_size': stats[p][0],
+                    'last_modified': stats[p][1],
+                    'content_hash': content_hash
+                }
+                for p in clones
+            ]))
+            duplicates.update(clones)
+        
+        # 登録済みファイルで新たに計算したハッシュを保存
+        self.db.update_content_hashes([
+            (p, h) for p, h in content_hashes.items()
+            if p in db_rows and not db_rows[p]['content_hash']
+        ])
+        
+        remaining = [p for p in files_to_process if str(p) not in duplicates]
+        new_hashes = {p: h for p, h in content_hashes.items() if p in new_paths}
+        return remaining, clone_jobs, new_hashes
+    
+    def _has_current_model_tag(self, row: Dict) -> bool:
+        """DBの行の埋め込みが現在のモデル（fp32 / INT8）で計算されたものか"""
+        return (row.get('model_tag') or FP32_MODEL_TAG) == self.clip_engine.model_tag
+    
+    def _find_exact_match_groups(self, folder_path: Path) -> List[SimilarityGroup]:
+        """DBのコンテンツハッシュから完全一致グループを作成"""
+        result = []
+        for rows in self.db.get_exact_duplicate_groups(str(folder_path)):
+            images = [
+                ImageInfo(
+                    path=Path(row['path']),
+                    file_size=row.get('file_size') or 0,
+                    width=row.get('width') or 0,
+                    height=row.get('height') or 0,
+                    sharpness_score=row.get('blur_score') or 0
+                )
+                for row in rows
+            ]
+            result.append(SimilarityGroup(
+                group_id=0,
+                images=images,
+                is_exact_match=True,
+                min_distance=0,
+                max_distance=0
+            ))
+        return result
+    
+    def _merge_exact_groups(
+        self,
+        similar_groups: List[SimilarityGroup],
+        exact_groups: List[SimilarityGroup]
+    ) -> List[SimilarityGroup]:
+        """
+        類似グループと完全一致グループを統合
+        
+        完全一致のコピー（各グループの先頭以外）は類似グループから除外し、
+        同じ画像が複数グループに重複して表示されないようにする。
+        """
+        copies = {str(img.path) for group in exact_groups for img in group.images[1:]}
+        
+        merged = []
+        for group in similar_groups:
+            group.images = [img for img in group.images if str(img.path) not in copies]
+            if len(group.images) >= 2:
+                merged.append(group)
+        merged.extend(exact_groups)
+        
+        for group_id, group in enumerate(merged, start=1):
+            group.group_id = group_id
+        return merged
+    
     # _find_groups_phash は削除されました
     
     def _find_groups_clip(self, threshold: float) -> List[SimilarityGroup]:
@@ -445,61 +1187,92 @@ class ImageScanner(QObject):
         try:
             from .faiss_engine import find_similar_groups_hybrid, find_similar_groups_faiss_clip, _check_faiss_available
             if _check_faiss_available():
-                # ハイブリッドモード: CLIP + pHash
-                hybrid_data = self.db.get_all_embeddings_with_phash()
-                if len(hybrid_data) < 2:
+                # ハイブリッドモード: CLIP + pHash（埋め込みはストアのmemmapをそのまま渡す）
+                snapshot = self.db.load_embedding_snapshot(self.clip_engine.model_tag)
+                if len(snapshot) < 2:
                     return []
                 
                 # pHashがあるデータが一定数あればハイブリッドモード
-                phash_count = sum(1 for d in hybrid_data if d[3] is not None)
-                use_hybrid = phash_count >= len(hybrid_data) * 0.5  # 50%以上にpHashがあれば使用
+                phash_count = sum(1 for p in snapshot.phashes if p is not None)
+                use_hybrid = phash_count >= len(snapshot) * 0.5  # 50%以上にpHashがあれば使用
                 
                 if use_hybrid:
-                    logger.info(f"Using hybrid detection mode (pHash available for {phash_count}/{len(hybrid_data)} images)")
+                    logger.info(f"Using hybrid detection mode (pHash available for {phash_count}/{len(snapshot)} images)")
                     groups = find_similar_groups_hybrid(
-                        hybrid_data, 
+                        snapshot, 
                         clip_threshold=clip_threshold,
                         phash_threshold=phash_threshold,
                         require_both=True  # 両方の条件を満たす必要あり
                     )
                 else:
-                    logger.info(f"Using CLIP-only mode (pHash available for only {phash_count}/{len(hybrid_data)} images)")
-                    clip_data = [(d[0], d[1], d[2]) for d in hybrid_data]
-                    groups = find_similar_groups_faiss_clip(clip_data, clip_threshold)
+                    logger.info(f"Using CLIP-only mode (pHash available for only {phash_count}/{len(snapshot)} images)")
+                    groups = find_similar_groups_faiss_clip(snapshot, clip_threshold)
                 
-                return self._convert_to_similarity_groups(groups, is_phash=False)
+                return self._convert_to_similarity_groups(groups, snapshot, is_phash=False)
         except ImportError as e:
             logger.warning(f"Faiss import failed: {e}")
         
         # フォールバック: NumPy実装
         return self._find_groups_clip_numpy(clip_threshold)
     
+    @staticmethod
+    def _clip_neighbors_numpy(snapshot, threshold: float) -> Dict[int, List[Tuple[int, float]]]:
+        """各画像について類似度（(cos + 1) / 2）が threshold 以上の画像を類似度順に上位 NUMPY_MAX_NEIGHBORS 件集める
+        
+        N×N の類似度行列は作らず、NUMPY_QUERY_BLOCK × NUMPY_DATA_BLOCK のブロックごとに計算して
+        閾値以上の候補だけを残す。類似度が同じ場合はインデックスの小さい方を優先する。
+        """
+        k = NUMPY_MAX_NEIGHBORS
+        direct_neighbors: Dict[int, List[Tuple[int, float]]] = {}
+        
+        def top_k(rows: np.ndarray, cols: np.ndarray, sims: np.ndarray):
+            """行ごとに類似度の高い順（同値はインデックス順）に k 件まで残す"""
+            order = np.lexsort((cols, -sims, rows))
+            rows, cols, sims = rows[order], cols[order], sims[order]
+            rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+            keep = rank < k
+            return rows[keep], cols[keep], sims[keep]
+        
+        query_start = 0
+        for query in snapshot.iter_blocks(NUMPY_QUERY_BLOCK):
+            query_end = query_start + len(query)
+            rows = np.empty(0, dtype=np.int64)
+            cols = np.empty(0, dtype=np.int64)
+            sims = np.empty(0, dtype=np.float32)
+            
+            data_start = 0
+            for data in snapshot.iter_blocks(NUMPY_DATA_BLOCK):
+                data_end = data_start + len(data)
+                similarity = (query @ data.T + 1.0) / 2.0
+                
+                # 自分自身は除外
+                own = np.arange(max(query_start, data_start), min(query_end, data_end))
+                similarity[own - query_start, own - data_start] = -np.inf
+                
+                block_rows, block_cols = np.nonzero(similarity >= threshold)
+                if len(block_rows):
+                    rows = np.concatenate([rows, block_rows + query_start])
+                    cols = np.concatenate([cols, block_cols + data_start])
+                    sims = np.concatenate([sims, similarity[block_rows, block_cols]])
+                    if len(rows) > len(query) * k:
+                        rows, cols, sims = top_k(rows, cols, sims)
+                data_start = data_end
+            
+            rows, cols, sims = top_k(rows, cols, sims)
+            for i, j, sim in zip(rows.tolist(), cols.tolist(), sims.tolist()):
+                direct_neighbors.setdefault(i, []).append((j, sim))
+            query_start = query_end
+        
+        return direct_neighbors
+    
     def _find_groups_clip_numpy(self, threshold: float) -> List[SimilarityGroup]:
         """NumPyによるCLIPグループ化（連鎖防止版）"""
-        clip_data = self.db.get_all_embeddings()
-        if len(clip_data) < 2:
+        snapshot = self.db.load_embedding_snapshot(self.clip_engine.model_tag)
+        if len(snapshot) < 2:
             return []
         
-        n = len(clip_data)
-        ids = [item[0] for item in clip_data]
-        paths = [item[1] for item in clip_data]
-        embeddings = np.stack([item[2] for item in clip_data], axis=0)
-        
-        # コサイン類似度行列
-        similarity_matrix = embeddings @ embeddings.T
-        similarity_matrix = (similarity_matrix + 1.0) / 2.0
-        
-        # 各画像の直接類似画像を収集
-        direct_neighbors: Dict[int, List[Tuple[int, float]]] = {}
-        for i in range(n):
-            neighbors = []
-            for j in range(n):
-                if i != j and similarity_matrix[i, j] >= threshold:
-                    neighbors.append((j, float(similarity_matrix[i, j])))
-            if neighbors:
-                # 類似度順でソート
-                neighbors.sort(key=lambda x: -x[1])
-                direct_neighbors[i] = neighbors[:20]  # 上位20件に制限
+        # 各画像の直接類似画像を収集（類似度順、上位 NUMPY_MAX_NEIGHBORS 件）
+        direct_neighbors = self._clip_neighbors_numpy(snapshot, threshold)
         
         if not direct_neighbors:
             return []
@@ -517,6 +1290,9 @@ class ImageScanner(QObject):
         if not mutual_pairs:
             return []
         
+        # グループに入り得る画像（相互類似ペアの両端）の情報をまとめて取得
+        images = self._load_group_images(snapshot, [m for pair in mutual_pairs for m in pair])
+        
         # 貪欲法でグループを構築（完全連結）
         used = set()
         result = []
@@ -555,22 +1331,7 @@ class ImageScanner(QObject):
             
             if len(group_members) >= 2:
                 group_id += 1
-                group_images = []
-                for m in group_members:
-                    img_data = self.db.get_image_by_path(paths[m])
-                    if img_data:
-                        embedding = None
-                        if img_data.get('embedding'):
-                            embedding = pickle.loads(img_data['embedding'])
-                        info = ImageInfo(
-                            path=Path(img_data['path']),
-                            file_size=img_data.get('file_size', 0),
-                            width=img_data.get('width', 0),
-                            height=img_data.get('height', 0),
-                            sharpness_score=img_data.get('blur_score', 0),
-                            clip_embedding=embedding
-                        )
-                        group_images.append(info)
+                group_images = [images[m] for m in group_members if m in images]
                 
                 if len(group_images) >= 2:
                     result.append(SimilarityGroup(
@@ -587,22 +1348,7 @@ class ImageScanner(QObject):
         for i, j in mutual_pairs:
             if i not in used and j not in used:
                 group_id += 1
-                group_images = []
-                for m in [i, j]:
-                    img_data = self.db.get_image_by_path(paths[m])
-                    if img_data:
-                        embedding = None
-                        if img_data.get('embedding'):
-                            embedding = pickle.loads(img_data['embedding'])
-                        info = ImageInfo(
-                            path=Path(img_data['path']),
-                            file_size=img_data.get('file_size', 0),
-                            width=img_data.get('width', 0),
-                            height=img_data.get('height', 0),
-                            sharpness_score=img_data.get('blur_score', 0),
-                            clip_embedding=embedding
-                        )
-                        group_images.append(info)
+                group_images = [images[m] for m in (i, j) if m in images]
                 
                 if len(group_images) >= 2:
                     result.append(SimilarityGroup(
@@ -620,34 +1366,23 @@ class ImageScanner(QObject):
     def _convert_to_similarity_groups(
         self, 
         groups: List[List[tuple]], 
+        snapshot: EmbeddingSnapshot,
         is_phash: bool
     ) -> List[SimilarityGroup]:
-        """Faiss結果をSimilarityGroupに変換"""
+        """Faiss結果をSimilarityGroupに変換（groups の各要素は (DB ID, パス)、snapshot は検索に使ったもの）"""
+        member_ids = {item[0] for group in groups for item in group}
+        position = {db_id: i for i, db_id in enumerate(snapshot.ids) if db_id in member_ids}
+        images = self._load_group_images(snapshot, list(position.values()))
+        
         result = []
         group_id = 0
         
         for group in groups:
             group_id += 1
-            group_images = []
-            
-            for item in group:
-                db_id, path = item[0], item[1]
-                img_data = self.db.get_image_by_path(path)
-                if img_data:
-                    embedding = None
-                    if img_data.get('embedding'):
-                        embedding = pickle.loads(img_data['embedding'])
-                    
-                    info = ImageInfo(
-                        path=Path(img_data['path']),
-                        file_size=img_data.get('file_size', 0),
-                        width=img_data.get('width', 0),
-                        height=img_data.get('height', 0),
-                        phash_int=img_data.get('phash_int', 0),
-                        sharpness_score=img_data.get('blur_score', 0),
-                        clip_embedding=embedding
-                    )
-                    group_images.append(info)
+            group_images = [
+                images[position[item[0]]] for item in group
+                if position.get(item[0]) in images
+            ]
             
             if len(group_images) >= 2:
                 result.append(SimilarityGroup(
@@ -659,3 +1394,30 @@ class ImageScanner(QObject):
                 ))
         
         return result
+    
+    def _load_group_images(self, snapshot: EmbeddingSnapshot, indices: List[int]) -> Dict[int, ImageInfo]:
+        """スナップショット内のインデックス → ImageInfo（DBから消えた画像は含まない）
+        
+        表示用の列はIDの IN 句でまとめて取得し、埋め込みはDBから読み直さずに
+        スナップショットの行列からコピーする（ストアのファイルを掴み続けないため）。
+        """
+        indices = sorted(set(indices))
+        if not indices:
+            return {}
+        rows = self.db.get_images_by_ids([snapshot.ids[i] for i in indices])
+        embeddings = np.array(snapshot.matrix[snapshot.rows[indices]], dtype=np.float32)
+        
+        images: Dict[int, ImageInfo] = {}
+        for i, embedding in zip(indices, embeddings):
+            row = rows.get(snapshot.ids[i])
+            if row is None:
+                continue
+            images[i] = ImageInfo(
+                path=Path(row['path']),
+                file_size=row.get('file_size', 0),
+                width=row.get('width', 0),
+                height=row.get('height', 0),
+                sharpness_score=row.get('blur_score', 0),
+                clip_embedding=embedding
+            )
+        return images
@@ -9,7 +9,7 @@ import logging
 from pathlib import Path
 from typing import List
 
-from PySide6.QtCore import Qt, Slot, QProcess
+from PySide6.QtCore import Qt, Slot, QProcess, QTimer
 from PySide6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QPushButton, QProgressBar,
@@ -20,8 +20,11 @@ from PySide6.QtWidgets import (
 from PySide6.QtGui import QFont
 
 from core.scanner import ImageScanner, ScanResult, ScanMode
+from core.database import ImageDatabase
 from core.comparator import SimilarityGroup
-from core.clip_engine import is_ai_installed, is_ai_installed_on_disk, get_install_command
+from core.clip_engine import (
+    ai_probe_result, get_install_command, invalidate_ai_probe, is_ai_installed_on_disk, start_ai_probe
+)
 from core.config import ConfigManager
 from PySide6.QtGui import QFont, QKeySequence, QShortcut
 from .image_grid import ImageGridWidget, BlurredImagesGridWidget
@@ -32,6 +35,12 @@ from .styles import DarkTheme
 
 logger = logging.getLogger(__name__)
 
+# 起動後、ウィンドウの描画が落ち着いてからAIモデルの先読みを始めるまでの待ち時間
+WARMUP_DELAY_MS = 1500
+
+# AIエンジンの確認が終わっていない状態でスキャンが押された場合の再確認間隔
+AI_PROBE_POLL_MS = 200
+
 
 class MainWindow(QMainWindow):
     """
@@ -49,7 +58,18 @@ class MainWindow(QMainWindow):
         # 設定の読み込み
         self.config = ConfigManager()
         
-        self.scanner = ImageScanner()
+        # AIエンジンの有無はバックグラウンドで確認する（結果はキャッシュされる）
+        start_ai_probe()
+        
+        self.scanner = ImageScanner(
+            db=ImageDatabase(embedding_dtype=self.config.get_embedding_storage()),
+            clip_pool_size=self.config.get_clip_pool_size(),
+            clip_worker_threads=self.config.get_clip_worker_threads(),
+            clip_backend=self.config.get_clip_backend(),
+            clip_quantize=self.config.get_clip_quantize(),
+            clip_daemon=self.config.get_clip_daemon(),
+            clip_daemon_idle_timeout=self.config.get_clip_daemon_idle_minutes() * 60
+        )
         
         # 設定から復元
         saved_folders = self.config.get_scan_folders()
@@ -66,6 +86,19 @@ class MainWindow(QMainWindow):
         # UIに初期値を反映（スキャンボタンの有効化など）
         self._update_settings_summary()
         self.scan_btn.setEnabled(len(self.current_folders) > 0)
+        
+        # AIコンポーネントがあれば、スキャン前にモデルをバックグラウンドで読み込んでおく
+        QTimer.singleShot(WARMUP_DELAY_MS, self._start_model_warmup)
+    
+    def _start_model_warmup(self):
+        """AIモデルの先読みを開始（未インストールなら何もしない）"""
+        if is_ai_installed_on_disk():
+            self.scanner.start_warmup()
+    
+    def closeEvent(self, event):
+        """終了時は読み込み中のAIモデルの先読みを中止する"""
+        self.scanner.cancel_warmup()
+        super().closeEvent(event)
     
     def _setup_ui(self):
         self.setWindowTitle("SpectraMatch - 画像類似検出・削除ツール")
@@ -581,9 +614,17 @@ class MainWindow(QMainWindow):
             parent=self,
             current_folders=self.current_folders,
             current_threshold=self.current_threshold,
-            db=self.scanner.db
+            db=self.scanner.db,
+            current_backend=self.config.get_clip_backend(),
+            current_quantize=self.config.get_clip_quantize(),
+            current_daemon=self.config.get_clip_daemon(),
+            current_incremental_discovery=self.config.get_incremental_discovery()
         )
         dialog.settings_applied.connect(self._on_settings_applied)
+        dialog.backend_changed.connect(self._on_backend_changed)
+        dialog.quantize_changed.connect(self._on_quantize_changed)
+        dialog.daemon_changed.connect(self._on_daemon_changed)
+        dialog.incremental_discovery_changed.connect(self._on_incremental_discovery_changed)
         dialog.cache_cleared.connect(self._on_cache_cleared)
         dialog.exec()
     
@@ -605,6 +646,36 @@ class MainWindow(QMainWindow):
         
         logger.info(f"Settings applied and saved: {len(folders)} folders, threshold={threshold}%")
     
+    @Slot(str)
+    def _on_backend_changed(self, backend: str):
+        """AI推論エンジンが変更されたときの処理"""
+        self.config.set_clip_backend(backend)
+        self.scanner.set_clip_backend(backend)
+        self._start_model_warmup()
+        logger.info(f"CLIP backend changed: {backend}")
+    
+    @Slot(bool)
+    def _on_quantize_changed(self, quantize: bool):
+        """INT8量子化の設定が変更されたときの処理"""
+        self.config.set_clip_quantize(quantize)
+        self.scanner.set_clip_quantize(quantize)
+        self._start_model_warmup()
+        logger.info(f"CLIP INT8 quantization: {quantize}")
+    
+    @Slot(bool)
+    def _on_daemon_changed(self, enabled: bool):
+        """常駐AIデーモンの設定が変更されたときの処理"""
+        self.config.set_clip_daemon(enabled)
+        self.scanner.set_clip_daemon(enabled)
+        self._start_model_warmup()
+        logger.info(f"CLIP daemon: {enabled}")
+    
+    @Slot(bool)
+    def _on_incremental_discovery_changed(self, enabled: bool):
+        """変更の無いフォルダの探索を省く設定が変更されたときの処理"""
+        self.config.set_incremental_discovery(enabled)
+        logger.info(f"Incremental discovery: {enabled}")
+    
     @Slot()
     def _on_cache_cleared(self):
         """キャッシュがクリアされたときの処理"""
@@ -644,7 +715,15 @@ class MainWindow(QMainWindow):
         if not self.current_folders:
             return
             
-        if not is_ai_installed():
+        available = ai_probe_result()
+        if available is None:
+            # 起動直後の確認がまだ終わっていない（GUIスレッドでは待たずに少し後でやり直す）
+            self.progress_label.setText("AIエンジンを確認中...")
+            self.scan_btn.setEnabled(False)
+            QTimer.singleShot(AI_PROBE_POLL_MS, self._retry_start_scan)
+            return
+            
+        if not available:
             reply = QMessageBox.question(
                 self, "AIエンジン未検出",
                 "AIスキャンに必要なコンポーネント(約2GB)がインストールされていません。\n"
@@ -657,6 +736,13 @@ class MainWindow(QMainWindow):
             
         self._on_start_scan_actual()
         
+    def _retry_start_scan(self):
+        """AIエンジンの確認が終わるのを待ってからスキャンを開始"""
+        self.scan_btn.setEnabled(True)
+        if ai_probe_result() is not None:
+            self.progress_label.setText("")
+        self._on_start_scan()
+        
     def _install_ai_engine(self):
         """AIエンジンのセットアップ (QProcess版)"""
         self.progress_bar.setVisible(True)
@@ -741,6 +827,8 @@ class MainWindow(QMainWindow):
         
         if exit_code == 0:
             self.log_view.appendPlainText("\n--- セットアップ完了 ---")
+            # キャッシュしたAIエンジンの確認結果を破棄して確認し直す
+            invalidate_ai_probe()
             # インストール直後はファイルシステムベースでチェック（インポートは再起動後に有効化）
             if is_ai_installed_on_disk():
                 self.progress_label.setText("セットアップ完了 - 再起動が必要です")
@@ -783,7 +871,10 @@ class MainWindow(QMainWindow):
         mode = self.algo_combo.currentData()
         
         # 最初のフォルダをスキャン
-        self.scanner.start_scan(self.current_folders[0], threshold, mode=mode)
+        self.scanner.start_scan(
+            self.current_folders[0], threshold, mode=mode,
+            full_walk=not self.config.get_incremental_discovery()
+        )
     
     @Slot()
     def _on_stop_scan(self):
@@ -815,10 +906,18 @@ class MainWindow(QMainWindow):
         self.progress_bar.setVisible(False)
         self.progress_container.setVisible(False)
         
+        # 自動計測したワーカープール構成を保存（次回以降は計測しない）
+        calibrated = self.scanner.calibrated_clip_pool()
+        if calibrated and self.config.get_clip_pool_size() == 0:
+            self.config.set_clip_pool(*calibrated)
+            logger.info(f"CLIP worker pool calibrated: {calibrated[0]} workers x {calibrated[1]} threads")
+        
         if result.groups:
             self.image_grid.set_groups(result.groups)
             total_images = sum(g.count for g in result.groups)
             cache_info = f", キャッシュ: {result.cached_files}" if result.cached_files > 0 else ""
+            if result.duplicate_files > 0:
+                cache_info += f", 完全一致: {result.duplicate_files}"
             self.status_label.setText(
                 f"✅ {len(result.groups)}グループ / {total_images}枚 "
                 f"(処理: {result.processed_files}{cache_info}, スキップ: {result.skipped_files})"
@@ -11,7 +11,7 @@ from typing import List, Optional
 from PySide6.QtCore import Qt, Signal
 from PySide6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
-    QComboBox, QListWidget, QListWidgetItem, QFileDialog,
+    QComboBox, QCheckBox, QListWidget, QListWidgetItem, QFileDialog,
     QFrame, QMessageBox, QGroupBox, QWidget, QTabWidget
 )
 
@@ -24,11 +24,19 @@ class SettingsDialog(QDialog):
     
     - スキャン対象フォルダの管理
     - 類似度閾値の設定
+    - AI推論エンジンの選択
     - キャッシュ管理
     """
     
+    # 推論バックエンドの選択肢（コンボボックスの並び順）
+    BACKENDS = ["torch", "onnx"]
+    
     # 設定が適用されたときに発行するシグナル
     settings_applied = Signal(list, int)  # (folders, threshold)
+    backend_changed = Signal(str)  # "torch" / "onnx"
+    quantize_changed = Signal(bool)
+    daemon_changed = Signal(bool)
+    incremental_discovery_changed = Signal(bool)
     cache_cleared = Signal()
     
     def __init__(
@@ -36,11 +44,19 @@ class SettingsDialog(QDialog):
         parent=None, 
         current_folders: List[Path] = None,
         current_threshold: int = 85,
-        db=None
+        db=None,
+        current_backend: str = "torch",
+        current_quantize: bool = False,
+        current_daemon: bool = False,
+        current_incremental_discovery: bool = True
     ):
         super().__init__(parent)
         self.current_folders = list(current_folders) if current_folders else []
         self.current_threshold = current_threshold
+        self.current_backend = current_backend
+        self.current_quantize = current_quantize
+        self.current_daemon = current_daemon
+        self.current_incremental_discovery = current_incremental_discovery
         self.db = db
         
         self._setup_ui()
@@ -222,6 +238,47 @@ class SettingsDialog(QDialog):
         
         layout.addWidget(threshold_group)
         
+        # === AI推論エンジン ===
+        backend_group = QGroupBox("🧠 AI推論エンジン")
+        backend_layout = QVBoxLayout(backend_group)
+        backend_layout.setSpacing(12)
+        
+        backend_desc = QLabel(
+            "ONNX Runtimeは起動が速く、CPUでの推論が高速です。\n"
+            "初回のみモデルの変換に時間がかかります。"
+        )
+        backend_desc.setStyleSheet("color: #95a5a6; font-size: 11px;")
+        backend_desc.setWordWrap(True)
+        backend_layout.addWidget(backend_desc)
+        
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItems([
+            "PyTorch（標準）",
+            "ONNX Runtime（CPU高速）"
+        ])
+        self.backend_combo.setStyleSheet(self.threshold_combo.styleSheet())
+        backend_layout.addWidget(self.backend_combo)
+        
+        self.quantize_check = QCheckBox("INT8量子化を使う（GPUの無いPC向け・高速）")
+        self.quantize_check.setStyleSheet("color: #e0e0e0;")
+        self.quantize_check.setToolTip(
+            "ビジョンエンコーダーを8ビット整数で計算します。\n"
+            "初回はライブラリの画像を使って量子化モデルを作成し、\n"
+            "切り替えた後のスキャンでは全画像の特徴量を計算し直します。"
+        )
+        backend_layout.addWidget(self.quantize_check)
+        
+        self.daemon_check = QCheckBox("AIモデルを常駐させる（次回以降のスキャン開始が速くなる）")
+        self.daemon_check.setStyleSheet("color: #e0e0e0;")
+        self.daemon_check.setToolTip(
+            "AIモデルを読み込んだバックグラウンドプロセスを残し、\n"
+            "アプリを開き直してもモデルの読み込みを省略します。\n"
+            "一定時間使われないと自動的に終了します（メモリ約1GB）。"
+        )
+        backend_layout.addWidget(self.daemon_check)
+        
+        layout.addWidget(backend_group)
+        
         # === キャッシュ管理 ===
         cache_group = QGroupBox("🗄️ キャッシュ管理")
         cache_layout = QVBoxLayout(cache_group)
@@ -240,6 +297,16 @@ class SettingsDialog(QDialog):
         self.cache_info_label.setStyleSheet("color: #3498db;")
         cache_layout.addWidget(self.cache_info_label)
         
+        # フォルダの更新日時による探索の省略
+        self.incremental_check = QCheckBox("変更の無いフォルダの探索を省く")
+        self.incremental_check.setStyleSheet("color: #e0e0e0;")
+        self.incremental_check.setToolTip(
+            "前回のスキャンから更新日時が変わっていないフォルダは、\n"
+            "ファイル一覧を取得せずキャッシュの記録を使います（NASなどで高速）。\n"
+            "上書き保存されたファイルを確実に検出するにはオフにしてください。"
+        )
+        cache_layout.addWidget(self.incremental_check)
+        
         # キャッシュ削除ボタン
         self.clear_cache_btn = QPushButton("🗑️ キャッシュを削除")
         self.clear_cache_btn.setStyleSheet(
@@ -253,6 +320,15 @@ class SettingsDialog(QDialog):
         self.clear_cache_btn.clicked.connect(self._on_clear_cache)
         cache_layout.addWidget(self.clear_cache_btn)
         
+        # 埋め込みストアのコンパクション
+        self.compact_store_btn = QPushButton("🧹 埋め込みストアを最適化")
+        self.compact_store_btn.setToolTip(
+            "削除・再解析された画像の古い埋め込みをストアから取り除き、\n"
+            "ディスク容量を解放します（解析結果は保持されます）"
+        )
+        self.compact_store_btn.clicked.connect(self._on_compact_store)
+        cache_layout.addWidget(self.compact_store_btn)
+        
         layout.addWidget(cache_group)
         
         # スペーサー
@@ -302,6 +378,15 @@ class SettingsDialog(QDialog):
         except ValueError:
             self.threshold_combo.setCurrentIndex(2)  # デフォルト: 標準
         
+        # 推論エンジン
+        if self.current_backend in self.BACKENDS:
+            self.backend_combo.setCurrentIndex(self.BACKENDS.index(self.current_backend))
+        else:
+            self.backend_combo.setCurrentIndex(0)
+        self.quantize_check.setChecked(self.current_quantize)
+        self.daemon_check.setChecked(self.current_daemon)
+        self.incremental_check.setChecked(self.current_incremental_discovery)
+        
         self._on_threshold_changed(index)
     
     def _update_cache_info(self):
@@ -388,6 +473,23 @@ class SettingsDialog(QDialog):
                     f"キャッシュの削除に失敗しました:\n{e}"
                 )
     
+    def _on_compact_store(self):
+        """埋め込みストアのコンパクション"""
+        if not self.db:
+            return
+        
+        try:
+            removed = self.db.compact_embedding_stores()
+            QMessageBox.information(
+                self, "完了",
+                f"埋め込みストアを最適化しました（{removed}件の不要な埋め込みを削除）。"
+            )
+        except Exception as e:
+            QMessageBox.critical(
+                self, "エラー",
+                f"埋め込みストアの最適化に失敗しました:\n{e}"
+            )
+    
     def _on_apply(self):
         """設定を適用"""
         # フォルダリストを取得
@@ -407,6 +509,22 @@ class SettingsDialog(QDialog):
         # シグナル発行
         self.settings_applied.emit(folders, threshold)
         
+        backend = self.get_backend()
+        if backend != self.current_backend:
+            self.backend_changed.emit(backend)
+        
+        quantize = self.quantize_check.isChecked()
+        if quantize != self.current_quantize:
+            self.quantize_changed.emit(quantize)
+        
+        daemon = self.daemon_check.isChecked()
+        if daemon != self.current_daemon:
+            self.daemon_changed.emit(daemon)
+        
+        incremental = self.incremental_check.isChecked()
+        if incremental != self.current_incremental_discovery:
+            self.incremental_discovery_changed.emit(incremental)
+        
         # ダイアログを閉じる
         self.accept()
     
@@ -418,6 +536,13 @@ class SettingsDialog(QDialog):
             folders.append(item.data(Qt.UserRole))
         return folders
     
+    def get_backend(self) -> str:
+        """選択中の推論バックエンドを取得"""
+        index = self.backend_combo.currentIndex()
+        if 0 <= index < len(self.BACKENDS):
+            return self.BACKENDS[index]
+        return "torch"
+    
     def get_threshold(self) -> int:
         """現在の閾値を取得"""
         values = [60, 75, 85, 92, 98]